@@ -0,0 +1,260 @@
+"""
+Headless benchmark suite.
+
+    python benchmark.py                                   # default matrix
+    python benchmark.py --maps grid-medium --loads 100 1000 --ticks 200
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --tolerance 0.15
+
+Each scenario builds a synthetic map (mapgen.py), pre-fills it with up to N
+cars scattered along their routes where they fit (see prefill; "prefilled"
+in the results) and steps Simulation.update with a fixed dt. Spawning tops
+the load up to N. Crashes are counted but do not reset the episode.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from bisect import bisect_right
+from time import perf_counter
+
+from config import TILE
+from lanes import IDM_MIN_GAP
+from map_loader import MapSpec, compile_map
+from mapgen import GENERATORS, generate
+from pathfinding import bfs_find_path
+from profiler import Profiler
+from simulation import Simulation
+from utils import rects_overlap
+
+DEFAULT_MAPS = ["grid-medium", "arterial", "multi-portal"]
+DEFAULT_LOADS = [100, 1000, 10000]
+
+
+# ============================================================
+# Scenario setup
+# ============================================================
+def build_simulation(compiled, cars, profiler=None, hybrid=False, seed=None):
+    return Simulation(
+        compiled.make_lights(), compiled.portals, profiler=profiler, grid=compiled.grid,
+        max_active_cars=cars, spawn_interval_ms=0, reset_on_crash=False, routes=compiled,
+        hybrid=hybrid, seed=seed,
+    )
+
+
+def scatter(car, rng, fits, tries=8):
+    """Move a freshly spawned car to a random waypoint of its own route where fits(car); False if none did."""
+    if len(car.path) < 3:
+        return False
+    for _ in range(tries):
+        k = rng.randrange(1, len(car.path) - 1)
+        (ax, ay), (bx, by) = car.path[k - 1], car.path[k]
+        car.x, car.y = ax, ay
+        car.angle = math.degrees(math.atan2(by - ay, bx - ax))
+        car.target_index = k
+        if fits(car):
+            return True
+    return False
+
+
+def prefill(sim, n, rng):
+    """
+    Place up to n cars along their routes, off junction tiles and their
+    approaches and at least IDM_MIN_GAP clear of every car already placed,
+    so the run starts crash-free. Returns the number of cars placed.
+    """
+    placed = {}  # tile -> cars placed on it
+
+    def fits(car):
+        tx, ty = int(car.x // TILE), int(car.y // TILE)
+        # not on a junction nor on its approach (too close to book a crossing)
+        path = car.tile_path
+        i = bisect_right(car.route.tile_starts, car.target_index - 1) - 1
+        if any(sim.lanes.is_junction(t) for t in path[i:i + 2]):
+            return False
+        x, y, w, h = car.get_rect()
+        m = IDM_MIN_GAP
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for o in placed.get((tx + dx, ty + dy), ()):
+                    if rects_overlap(x - m, y - m, w + 2 * m, h + 2 * m, *o.get_rect()):
+                        return False
+        return True
+
+    attempts = 0
+    while len(sim.cars) < n and attempts < n * 4:
+        attempts += 1
+        car = sim.spawn_car_random()
+        if car is None:
+            continue
+        if not scatter(car, rng, fits):
+            sim.pool.release(car)
+            continue
+        sim.add_car(car)
+        sim.lanes.remove(car)
+        sim.lanes.insert(car)  # mid-lane: link in position order, not at the lane's tail
+        placed.setdefault((int(car.x // TILE), int(car.y // TILE)), []).append(car)
+    return len(sim.cars)
+
+
+def path_latency(grid, portals, samples, rng):
+    tiles = [t for ts in portals.values() for t in ts]
+    if len(tiles) < 2:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0}
+    times = []
+    for _ in range(samples):
+        a, b = rng.sample(tiles, 2)
+        t0 = perf_counter()
+        bfs_find_path(a, b, grid)
+        times.append((perf_counter() - t0) * 1e3)
+    times.sort()
+    return {
+        "mean": sum(times) / len(times),
+        "p50": times[len(times) // 2],
+        "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+    }
+
+
+# ============================================================
+# Scenario run
+# ============================================================
+def run_scenario(map_name, cars, ticks=300, dt=1 / 60, budget=60.0, seed=0,
+                 memory_ticks=2, path_samples=200, hybrid=False):
+    rng = random.Random(seed)
+    grid, light_specs = generate(map_name, seed=seed)
+    compiled = compile_map(MapSpec(grid, light_specs))
+
+    # peak memory: setup + a few ticks under tracemalloc (slow, so kept short)
+    tracemalloc.start()
+    sim = build_simulation(compiled, cars, hybrid=hybrid, seed=seed)
+    active = prefill(sim, cars, rng)
+    for _ in range(memory_ticks):
+        sim.update(dt)
+    peak_mem = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # timed run
+    profiler = Profiler()
+    sim.profiler = profiler
+    done = 0
+    t0 = perf_counter()
+    while done < ticks and perf_counter() - t0 < budget:
+        sim.update(dt)
+        done += 1
+    elapsed = perf_counter() - t0
+
+    snap = profiler.snapshot()
+    return {
+        "map": map_name,
+        "cars": cars,
+        "size": [len(grid[0]), len(grid)],
+        "portals": len(sim.portals),
+        "lights": len(sim.traffic_lights),
+        "prefilled": active,
+        "active_cars": len(sim.cars),
+        "ticks": done,
+        "elapsed_s": elapsed,
+        "ticks_per_s": done / elapsed if elapsed > 0 else 0.0,
+        "phase_ms": {name: p["mean_ms"] for name, p in snap["phases"].items()},
+        "counters_per_tick": {k: v / done for k, v in snap["counters"].items()} if done else {},
+        "peak_mem_mb": peak_mem / 2 ** 20,
+        "path_ms": path_latency(grid, sim.portals, path_samples, rng),
+        "crashes": sim.episode_crashes,
+    }
+
+
+# ============================================================
+# Baselines
+# ============================================================
+def scenario_key(result):
+    return f"{result['map']}/{result['cars']}"
+
+
+def save_baseline(path, results):
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {scenario_key(r): r for r in results},
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def compare(baseline, results, tolerance=0.15, abs_floor_ms=0.05):
+    """Return a list of human-readable regressions (empty = pass)."""
+    base = baseline["results"]
+    regressions = []
+    for r in results:
+        key = scenario_key(r)
+        b = base.get(key)
+        if b is None:
+            continue
+        if b["ticks_per_s"] > 0 and r["ticks_per_s"] < b["ticks_per_s"] * (1 - tolerance):
+            regressions.append(f"{key}: ticks/s {r['ticks_per_s']:.1f} < baseline {b['ticks_per_s']:.1f}")
+        if r["peak_mem_mb"] > b["peak_mem_mb"] * (1 + tolerance):
+            regressions.append(f"{key}: peak memory {r['peak_mem_mb']:.1f}MB > baseline {b['peak_mem_mb']:.1f}MB")
+        bp, rp = b["path_ms"]["p95"], r["path_ms"]["p95"]
+        if rp > bp * (1 + tolerance) and rp - bp > abs_floor_ms:
+            regressions.append(f"{key}: path p95 {rp:.3f}ms > baseline {bp:.3f}ms")
+    return regressions
+
+
+def format_row(r):
+    phases = " ".join(f"{k}={v:.2f}" for k, v in r["phase_ms"].items())
+    return (
+        f"{scenario_key(r):<22} {r['size'][0]}x{r['size'][1]:<4} cars={r['active_cars']:<6} "
+        f"ticks/s={r['ticks_per_s']:8.1f} mem={r['peak_mem_mb']:7.1f}MB "
+        f"path p95={r['path_ms']['p95']:.3f}ms | {phases}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless traffic simulation benchmarks")
+    parser.add_argument("--maps", nargs="+", default=DEFAULT_MAPS, choices=sorted(GENERATORS))
+    parser.add_argument("--loads", nargs="+", type=int, default=DEFAULT_LOADS)
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument("--budget", type=float, default=60.0, help="max seconds per scenario (at least one tick runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--json", metavar="PATH", help="write raw results to PATH")
+    parser.add_argument("--hybrid", action="store_true", help="run with the hybrid link model enabled")
+    args = parser.parse_args(argv)
+
+    results = []
+    for map_name in args.maps:
+        for cars in args.loads:
+            r = run_scenario(map_name, cars, ticks=args.ticks, dt=args.dt, budget=args.budget, seed=args.seed,
+                             hybrid=args.hybrid)
+            results.append(r)
+            print(format_row(r), flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,10 @@
-import pygame
 import math
 import random
-from config import TILE, ROAD_MAP
+from config import FPS, ROAD_MAP, STOPPED_SPEED, STOP_DISTANCE
 from utils import world_center
-from pathfinding import bfs_find_path, tile_path_to_lane_points
+from pathfinding import bfs_find_path, spawn_pose, tile_path_to_lane_points
+from routes import Route
+from lanes import idm_accel, IDM_MIN_GAP
 
 
 # ================================= ===========================
@@ -24,11 +25,15 @@ def lines_intersect(x1, y1, x2, y2, x3, y3, x4, y4):
 # Raycast helper
 # ============================================================
 def raycast_to_rect(x1, y1, x2, y2, rect):
+    # rect = (left, top, width, height)
+    left, top, w, h = rect
+    right = left + w
+    bottom = top + h
     lines = [
-        ((rect.left, rect.top), (rect.right, rect.top)),
-        ((rect.right, rect.top), (rect.right, rect.bottom)),
-        ((rect.right, rect.bottom), (rect.left, rect.bottom)),
-        ((rect.left, rect.bottom), (rect.left, rect.top)),
+        ((left, top), (right, top)),
+        ((right, top), (right, bottom)),
+        ((right, bottom), (left, bottom)),
+        ((left, bottom), (left, top)),
     ]
 
     for (ax, ay), (bx, by) in lines:
@@ -37,20 +42,74 @@ def raycast_to_rect(x1, y1, x2, y2, rect):
     return False
 
 
+CAR_TYPES = [
+    {"name": "compact", "w": (21, 27), "h": (12, 15), "speed": (95, 105)},
+    {"name": "sedan", "w": (24, 30), "h": (12, 15), "speed": (90, 100)},
+    {"name": "suv", "w": (27, 33), "h": (15, 18), "speed": (85, 95)},
+    {"name": "van", "w": (30, 36), "h": (15, 18), "speed": (78, 88)},
+]
+MAX_CAR_LENGTH = max(t["w"][1] for t in CAR_TYPES)
+
+
 class Car:
+    __slots__ = (
+        "start_tile", "goal_tile", "color", "traffic_lights", "car_id",
+        "spawn_time", "stop_time", "light_wait", "light_waits", "ray_tests",
+        "blocked_by_car", "block_gap", "release_gap",
+        "width", "height", "max_speed", "speed", "car_type",
+        "prev_dir", "reached", "control_light", "has_cleared_light",
+        "route", "tile_path", "path", "lane_index", "light_idx",
+        "x", "y", "angle", "target_index", "prev_x", "prev_y",
+        "tile_idx", "lane_key", "lane_ahead", "lane_behind",
+        "occ_slot", "occ_state",
+        "meso", "meso_pos", "meso_end",
+    )
+
+    # physics constants shared by every car
+    accel = 220.0
+    brake = 500.0
+    drag = 0.98           # speed kept per frame at FPS
+    blend = 0.12          # share of the gap to the target speed closed per frame at FPS
+    safe_distance = 36.0
+
     def get_rect(self):
-        # axis-aligned rect is enough for collision event detection
-        return pygame.Rect(
+        # axis-aligned (x, y, w, h) is enough for collision event detection
+        return (
             int(self.x - self.width // 2),
             int(self.y - self.height // 2),
             int(self.width),
             int(self.height),
         )
-    def __init__(self, start_tile, goal_tile, color, traffic_lights):
+
+    def __init__(self, start_tile, goal_tile, color, traffic_lights, grid=None, tile_path=None, route_table=None,
+                 rng=None, lane_index=None):
+        self.reset(start_tile, goal_tile, color, traffic_lights, grid, tile_path, route_table, rng, lane_index)
+
+    def reset(self, start_tile, goal_tile, color, traffic_lights, grid=None, tile_path=None, route_table=None,
+              rng=None, lane_index=None):
+        """
+        (Re)initialise every per-trip field; used by __init__ and by CarPool.
+        lane_index=None picks a random lane on a 2-lane start tile.
+        """
+        if rng is None:
+            rng = random  # simulations pass their own stream (Simulation.car_rng)
+        if grid is None:
+            grid = route_table.grid if route_table is not None else ROAD_MAP
+
         self.start_tile = start_tile
         self.goal_tile = goal_tile
         self.color = color
         self.traffic_lights = traffic_lights
+        self.car_id = 0  # assigned by the simulation on spawn
+
+        # trip metrics (seconds of simulation time)
+        self.spawn_time = 0.0
+        self.stop_time = 0.0
+        self.light_wait = 0.0
+        self.light_waits = ()  # ((light index, seconds stopped), ...) in the order waited at
+
+        # raycast tests performed in the last update (profiling counter)
+        self.ray_tests = 0
 
         # --- jam stability state ---
         self.blocked_by_car = False
@@ -66,30 +125,39 @@ class Car:
         self.speed = self.max_speed * 0.5
 
         self.prev_dir = (0, 0)
-        self.accel = 220.0
-        self.brake = 500.0
-        self.drag = 0.98
-        self.safe_distance = 36.0
         self.reached = False
 
         # Randomize size + speed personality
-        self._randomize_appearance_and_physics()
+        self._randomize_appearance_and_physics(rng)
 
         # traffic light association (optional logic you already had)
         self.control_light = self.assign_control_light(start_tile)
         self.has_cleared_light = False
 
-        # Path
-        tile_path = bfs_find_path(start_tile, goal_tile, ROAD_MAP)
-        self.tile_path = tile_path
+        # Path (shared by reference when a route table is given)
+        if tile_path is None:
+            if route_table is not None:
+                tile_path = route_table.tile_path(start_tile, goal_tile)
+            else:
+                tile_path = bfs_find_path(start_tile, goal_tile, grid)
 
         self.lane_index = 0
-        if tile_path:
+        if lane_index is not None:
+            self.lane_index = lane_index
+        elif tile_path:
             sx, sy = tile_path[0]
-            if ROAD_MAP[sy][sx] == -10:  # 2-lane tile
-                self.lane_index = random.randint(0, 1)
+            if grid[sy][sx] == -10:  # 2-lane tile
+                self.lane_index = rng.randint(0, 1)
 
-        self.path = tile_path_to_lane_points(tile_path, lane_index=self.lane_index)
+        if route_table is not None:
+            self.route = route_table.get(start_tile, goal_tile, self.lane_index)
+        else:
+            key = (start_tile, goal_tile, self.lane_index)
+            points = tile_path_to_lane_points(tile_path, lane_index=self.lane_index, grid=grid)
+            self.route = Route(key, tile_path, points, list(enumerate(traffic_lights)))
+        self.tile_path = self.route.tile_path
+        self.path = self.route.points
+        self.light_idx = 0  # next entry of route.lights
 
         if len(tile_path) > 1:
             self.x, self.y, self.angle = self.compute_spawn(tile_path[0], tile_path[1])
@@ -99,6 +167,15 @@ class Car:
             self.x, self.y = cx, cy
             self.angle = 0
             self.target_index = 0
+        self.prev_x, self.prev_y = self.x, self.y  # position at the start of the tick (swept crash check)
+
+        # lane-ordered occupancy (maintained by LaneOccupancy when the simulation uses it)
+        self.tile_idx = 0
+        self.lane_key = self.lane_ahead = self.lane_behind = None
+        self.occ_slot = None  # TileOccupancy bookkeeping
+        self.occ_state = 0
+        self.meso = False  # advanced by MesoModel instead of update() while True
+        self.meso_pos = self.meso_end = 0.0
 
         if not self.path:
             self.reached = True
@@ -106,26 +183,19 @@ class Car:
     # ------------------------------------------------------------
     # Random car models (size/speed) to make traffic feel real
     # ------------------------------------------------------------
-    def _randomize_appearance_and_physics(self):
-        car_types = [
-            {"name": "compact", "w": (21, 27), "h": (12, 15), "speed": (95, 105)},
-            {"name": "sedan", "w": (24, 30), "h": (12, 15), "speed": (90, 100)},
-            {"name": "suv", "w": (27, 33), "h": (15, 18), "speed": (85, 95)},
-            {"name": "van", "w": (30, 36), "h": (15, 18), "speed": (78, 88)},
-        ]
-
-        t = random.choice(car_types)
+    def _randomize_appearance_and_physics(self, rng=random):
+        t = rng.choice(CAR_TYPES)
         self.car_type = t["name"]
 
-        self.width = random.randint(*t["w"])
-        self.height = random.randint(*t["h"])
+        self.width = rng.randint(*t["w"])
+        self.height = rng.randint(*t["h"])
 
-        self.max_speed = random.uniform(*t["speed"])
-        self.speed = self.max_speed * random.uniform(0.35, 0.6)
+        self.max_speed = rng.uniform(*t["speed"])
+        self.speed = self.max_speed * rng.uniform(0.35, 0.6)
 
         # scale jam spacing with car length (prevents pixel pushing)
-        self.block_gap = max(getattr(self, "block_gap", 55), self.width * 1.4)
-        self.release_gap = max(getattr(self, "release_gap", 70), self.width * 1.9)
+        self.block_gap = max(self.block_gap, self.width * 1.4)
+        self.release_gap = max(self.release_gap, self.width * 1.9)
 
     # ------------------------------------------------------------
     # Traffic light helpers
@@ -138,29 +208,12 @@ class Car:
         return None
 
     def compute_spawn(self, start_tile, next_tile):
-        sx, sy = start_tile
-        nx, ny = next_tile
-        dir_x = nx - sx
-        dir_y = ny - sy
-        cx, cy = world_center(sx, sy)
-
-        OFFSET = TILE * 0.25
-        SPAWN_DISTANCE = TILE * 0.6
-
-        if dir_x == 1:
-            return cx - SPAWN_DISTANCE, cy + OFFSET, 0
-        if dir_x == -1:
-            return cx + SPAWN_DISTANCE, cy - OFFSET, 180
-        if dir_y == 1:
-            return cx - OFFSET, cy - SPAWN_DISTANCE, 90
-        if dir_y == -1:
-            return cx + OFFSET, cy + SPAWN_DISTANCE, 270
-        return cx, cy, 0
+        return spawn_pose(start_tile, next_tile)
 
     # ------------------------------------------------------------
     # Update
     # ------------------------------------------------------------
-    def update(self, dt, all_cars):
+    def update(self, dt, all_cars, lanes=None, junctions=None):
         if self.reached:
             return
 
@@ -169,6 +222,10 @@ class Car:
             self.reached = True
             return
 
+        # per-frame constants, rescaled so sub-steps of any length compound alike
+        frames = dt * FPS
+        blend = 1 - (1 - self.blend) ** frames
+
         tx, ty = self.path[self.target_index]
         dx = tx - self.x
         dy = ty - self.y
@@ -187,11 +244,22 @@ class Car:
         if self.speed > 10:
             self.prev_dir = (dir_dx, dir_dy)
 
-        # 2) traffic lights
+        # 2) traffic lights: only the next light on this route can stop the car
         stop_for_light = False
-        STOP_DISTANCE = 55
-
-        for tl in self.traffic_lights:
+        stop_light = -1
+        lights = self.route.lights
+        pos = self.route.cum_length[self.target_index] - dist  # arc length travelled
+        i = self.light_idx
+        if i < len(lights):
+            while i < len(lights) and lights[i][0] < pos:
+                i += 1
+            self.light_idx = i
+
+        # lights sharing a stop point (one per controlled approach) share an arc position
+        j = i
+        while j < len(lights) and lights[j][0] == lights[i][0]:
+            tl = self.traffic_lights[lights[j][1]]
+            j += 1
             lx, ly = tl.stop_point
             vec_x = lx - self.x
             vec_y = ly - self.y
@@ -202,6 +270,7 @@ class Car:
                 if projection > 0:
                     if not tl.car_can_pass(self, dir_dx, dir_dy):
                         stop_for_light = True
+                        stop_light = lights[j - 1][1]
                         break
 
         # 2.5) clear own light
@@ -213,76 +282,111 @@ class Car:
             if passed_projection > 20:
                 self.has_cleared_light = True
 
-        # 3) collision avoidance (raycasts) + spacing hysteresis
-        slow_factor = 1.0
-        nearest_ahead = None
-
-        RAY_ANGLE_SPREAD = 15
-        RAY_LENGTH = max(80, int(self.width * 2.2))  # scale with car length
-
-        desired_heading = math.degrees(math.atan2(move_dy, move_dx)) if (move_dx or move_dy) else self.angle
-        angles = [desired_heading,
-                  desired_heading - RAY_ANGLE_SPREAD,
-                  desired_heading + RAY_ANGLE_SPREAD]
-
-
-
-
-
-        for ang in angles:
-            ray_end_x = self.x + math.cos(math.radians(ang)) * RAY_LENGTH
-            ray_end_y = self.y + math.sin(math.radians(ang)) * RAY_LENGTH
-
-            for o in all_cars:
-                if o is self or o.reached:
-                    continue
-
-                rect = pygame.Rect(
-                    o.x - o.width // 2,
-                    o.y - o.height // 2,
-                    o.width,
-                    o.height
-                )
-
-                if raycast_to_rect(self.x, self.y, ray_end_x, ray_end_y, rect):
-                    d = math.hypot(o.x - self.x, o.y - self.y)
-
-                    if nearest_ahead is None or d < nearest_ahead:
-                        nearest_ahead = d
-
-                    if d < 90:
-                        slow_factor = min(slow_factor, 0.6)
-                    if d < 60:
-                        slow_factor = min(slow_factor, 0.25)
-                    if d < 40:
-                        slow_factor = min(slow_factor, 0.01)
-
-        # spacing hysteresis: stop creeping/pushing in jams
-        if nearest_ahead is not None:
-            if nearest_ahead < self.block_gap:
-                self.blocked_by_car = True
-
-            if self.blocked_by_car:
-                if nearest_ahead > self.release_gap:
-                    self.blocked_by_car = False
-                else:
-                    slow_factor = 0.0
+        # 2.6) junction reservation: distance to the stop line if not allowed in
+        gate = None
+        if junctions is not None:
+            gate = junctions.gate(self, pos, hold=stop_for_light)
+
+        # 3) car following
+        # On plain road the lane leader is known, so use IDM on the headway.
+        # Near junctions (lanes cross) fall back to raycasts at every car,
+        # unless an intersection manager serializes the crossing movements.
+        leader = None
+        use_rays = True
+        if lanes is not None:
+            probe_x = self.x + move_dx * self.width
+            probe_y = self.y + move_dy * self.width
+            if (junctions is not None and not lanes.raycast_only) or not lanes.near_junction(self, probe_x, probe_y):
+                use_rays = False
+                leader = lanes.leader(self)
+
+        if not use_rays:
+            gap = lanes.headway(self, leader) if leader is not None else None
+            leader_speed = leader.speed if leader is not None else 0.0
+            if gate is not None and (gap is None or gate < gap):
+                gap, leader_speed = gate, 0.0  # standing virtual leader at the stop line
+            v0 = self.max_speed * (0.45 if is_turn else 1.0)
+
+            # 4) speed control
+            if stop_for_light:
+                self.speed += (0.0 - self.speed) * blend
+            else:
+                self.speed += idm_accel(self.speed, v0, self.accel, gap, leader_speed) * dt
+            self.speed = max(0, min(self.speed, self.max_speed))
+
+            self.blocked_by_car = gap is not None and gap < IDM_MIN_GAP * 2 and self.speed < STOPPED_SPEED
+            blocked = stop_for_light or self.blocked_by_car
         else:
-            self.blocked_by_car = False
-
-        # 4) speed control
-        if stop_for_light or self.blocked_by_car:
-            desired = 0.0
-        else:
-            desired = self.max_speed * slow_factor
-
-        if is_turn:
-            desired = min(desired, self.max_speed * 0.45)
-
-        self.speed += (desired - self.speed) * 0.12
-        self.speed = max(0, min(self.speed, self.max_speed))
-
-        blocked = stop_for_light or self.blocked_by_car or (slow_factor <= 0.3 and self.speed < 15)
+            # 3) collision avoidance (raycasts) + spacing hysteresis
+            slow_factor = 1.0
+            nearest_ahead = None
+
+            RAY_ANGLE_SPREAD = 15
+            RAY_LENGTH = max(80, int(self.width * 2.2))  # scale with car length
+
+            desired_heading = math.degrees(math.atan2(move_dy, move_dx)) if (move_dx or move_dy) else self.angle
+            angles = [desired_heading,
+                      desired_heading - RAY_ANGLE_SPREAD,
+                      desired_heading + RAY_ANGLE_SPREAD]
+
+            ray_tests = 0
+            for ang in angles:
+                ray_end_x = self.x + math.cos(math.radians(ang)) * RAY_LENGTH
+                ray_end_y = self.y + math.sin(math.radians(ang)) * RAY_LENGTH
+
+                for o in all_cars:
+                    if o is self or o.reached:
+                        continue
+
+                    rect = (
+                        int(o.x - o.width // 2),
+                        int(o.y - o.height // 2),
+                        int(o.width),
+                        int(o.height),
+                    )
+
+                    ray_tests += 1
+                    if raycast_to_rect(self.x, self.y, ray_end_x, ray_end_y, rect):
+                        d = math.hypot(o.x - self.x, o.y - self.y)
+
+                        if nearest_ahead is None or d < nearest_ahead:
+                            nearest_ahead = d
+
+                        if d < 90:
+                            slow_factor = min(slow_factor, 0.6)
+                        if d < 60:
+                            slow_factor = min(slow_factor, 0.25)
+                        if d < 40:
+                            slow_factor = min(slow_factor, 0.01)
+
+            self.ray_tests += ray_tests  # reset once per tick by Simulation.substeps
+
+            # spacing hysteresis: stop creeping/pushing in jams
+            if nearest_ahead is not None:
+                if nearest_ahead < self.block_gap:
+                    self.blocked_by_car = True
+
+                if self.blocked_by_car:
+                    if nearest_ahead > self.release_gap:
+                        self.blocked_by_car = False
+                    else:
+                        slow_factor = 0.0
+            else:
+                self.blocked_by_car = False
+
+            # 4) speed control
+            if stop_for_light or self.blocked_by_car or (gate is not None and gate < self.block_gap):
+                desired = 0.0
+            else:
+                desired = self.max_speed * slow_factor
+
+            if is_turn:
+                desired = min(desired, self.max_speed * 0.45)
+
+            self.speed += (desired - self.speed) * blend
+            self.speed = max(0, min(self.speed, self.max_speed))
+
+            blocked = stop_for_light or self.blocked_by_car or (slow_factor <= 0.3 and self.speed < 15)
 
         # 5) steering (do NOT rotate in place when blocked)
         if dist > 0.001 and not blocked:
@@ -294,7 +398,18 @@ class Car:
         rad = math.radians(self.angle)
         self.x += math.cos(rad) * self.speed * dt
         self.y += math.sin(rad) * self.speed * dt
-        self.speed *= self.drag
+        self.speed *= self.drag ** frames
+
+        if self.speed < STOPPED_SPEED:
+            self.stop_time += dt
+            if stop_for_light:
+                self.light_wait += dt
+                # immutable, so snapshots can share it
+                w = self.light_waits
+                if w and w[-1][0] == stop_light:
+                    self.light_waits = w[:-1] + ((stop_light, w[-1][1] + dt),)
+                else:
+                    self.light_waits = w + ((stop_light, dt),)
 
         # 7) waypoint reached
         if dist < 8:
@@ -302,36 +417,55 @@ class Car:
             if self.target_index >= len(self.path):
                 self.reached = True
 
+        if lanes is not None:
+            lanes.advance(self)
+
     # ------------------------------------------------------------
     # Draw
     # ------------------------------------------------------------
     def draw(self, surf):
-        if self.reached:
-            return
+        from render import draw_car
 
-        car_surf = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        car_surf.fill(self.color)
-
-        # scaled "nose" arrow so longer cars look right
-        nose = max(6, int(self.width * 0.18))
-        nose_back = max(12, int(self.width * 0.45))
-        pad = max(3, int(self.height * 0.20))
-        pygame.draw.polygon(
-            car_surf, (255, 240, 240),
-            [
-                (self.width - nose, self.height // 2),
-                (self.width - nose_back, pad),
-                (self.width - nose_back, self.height - pad),
-            ]
-        )
+        draw_car(surf, self)
 
-        rot = pygame.transform.rotate(car_surf, -self.angle)
-        rect = rot.get_rect(center=(int(self.x), int(self.y)))
-        surf.blit(rot, rect)
 
-        # OPTIONAL DEBUG: draw rays (comment out if you want clean visuals)
-        # desired_heading = self.angle
-        # for ang in [desired_heading, desired_heading - 15, desired_heading + 15]:
-        #     rx = self.x + math.cos(math.radians(ang)) * max(80, int(self.width * 2.2))
-        #     ry = self.y + math.sin(math.radians(ang)) * max(80, int(self.width * 2.2))
-        #     pygame.draw.line(surf, (255, 255, 255), (self.x, self.y), (rx, ry), 1)
+# ============================================================
+# Free-list pool: spawning reuses finished Car objects
+# ============================================================
+class CarPool:
+    def __init__(self, max_free=4096):
+        self.free = []
+        self.max_free = max_free
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, start_tile, goal_tile, color, traffic_lights, route_table, rng=None, lane_index=None):
+        if self.free:
+            car = self.free.pop()
+            car.reset(start_tile, goal_tile, color, traffic_lights, route_table=route_table, rng=rng,
+                      lane_index=lane_index)
+            self.reused += 1
+        else:
+            car = Car(start_tile, goal_tile, color, traffic_lights, route_table=route_table, rng=rng,
+                      lane_index=lane_index)
+            self.created += 1
+        return car
+
+    def take(self):
+        """Uninitialised car for the caller to fill in (snapshot restore)."""
+        if self.free:
+            self.reused += 1
+            return self.free.pop()
+        self.created += 1
+        return Car.__new__(Car)
+
+    def release(self, car):
+        if len(self.free) < self.max_free:
+            # drop references so pooled cars do not pin routes/lights
+            car.route = car.tile_path = car.path = None
+            car.control_light = car.lane_ahead = car.lane_behind = None
+            self.free.append(car)
+
+    def release_all(self, cars):
+        for car in cars:
+            self.release(car)
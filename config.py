@@ -1,5 +1,3 @@
-import pygame
-
 # ============================================
 # Settings
 # ============================================
@@ -19,6 +17,22 @@ ONEWAY_N = -4
 MAX_ACTIVE_CARS = 100
 SPAWN_INTERVAL_MS = 1500
 MAX_SPAWN_TRIES = 12
+STOPPED_SPEED = 5.0          # px/s below which a car counts as stopped (metrics)
+QUEUE_SPEED = 10.0           # px/s below which a car counts as queued (tile occupancy)
+STOP_DISTANCE = 55           # px from a light's stop point at which an approaching car obeys it
+SUBSTEP_PX = 4.0             # max px a car (or the gap to its leader) may change per physics sub-step
+MAX_SUBSTEPS = 16            # cap on sub-steps per Simulation.update
+
+# Light controller reward (per light per tick) and switching
+REWARD_WEIGHTS = {
+    "clear": 2.0,    # per car that left the queue
+    "queue": 1.0,    # per car still queued (penalty)
+    "opp": 0.5,      # per car queued on the crossing approaches (penalty)
+    "switch": 2.0,   # on the tick the light switched (penalty)
+    "block": 5.0,    # while the intersection is blocked (penalty)
+    "crash": 200.0,  # applied to every light's last decision on a crash (penalty)
+}
+MIN_HOLD = 8                 # ticks a light keeps its phase before it may switch again
 
 # Colors
 BG = (40, 40, 40)
@@ -43,6 +57,15 @@ ROAD_MAP = [
     [0,    0,   0,   0,   0,   3,   0,   0,   0,   0],
 ]
 
+# Traffic lights on ROAD_MAP: stop point tile, start phase, and optionally the
+# spawn tiles ("controlled") whose cars must obey it (default: its own tile).
+# Maps loaded from files declare their lights the same way (see map_loader.py).
+LIGHTS = [
+    {"tile": (1, 0.5), "id": 7, "green": True},
+    {"tile": (1, 4), "id": 7, "green": True},
+    {"tile": (0.5, 3), "id": 7, "green": False},
+    {"tile": (3, 2.5), "id": 7, "green": False},
+]
 
 ROWS = len(ROAD_MAP)
 COLS = len(ROAD_MAP[0])
@@ -0,0 +1,160 @@
+"""
+Origin-destination demand.
+
+    {"periods": [
+        {"start": 0,   "end": 600,  "od": {"2": {"3": 300, "4": 120}, "3": {"2": 200}}},
+        {"start": 600, "end": 1200, "od": {"2": {"3": 900}}, "scale": 1.0}
+    ]}
+
+Rates are vehicles per hour between portal ids (see pathfinding.collect_portals),
+piecewise constant over [start, end) seconds of simulation time. Arrivals are
+pre-sampled as one Poisson process per period (total rate, OD pair picked by
+weight) in chunks, and kept in a time-ordered heap. Due arrivals wait in a
+per-origin backlog until the portal's entry lane has room and the active car
+cap allows a spawn, so the cost per tick depends on due and waiting arrivals,
+not on the number of portals.
+"""
+import heapq
+import json
+import random
+from bisect import bisect_right
+from collections import deque
+
+
+class DemandPeriod:
+    __slots__ = ("start", "end", "pairs", "cum", "total")
+
+    def __init__(self, start, end, od, scale=1.0):
+        self.start = float(start)
+        self.end = float(end)
+        self.pairs = []
+        self.cum = []
+        total = 0.0
+        for origin, row in od.items():
+            for dest, rate in row.items():
+                rate = float(rate) * scale / 3600.0  # veh/h -> veh/s
+                if rate <= 0 or int(origin) == int(dest):
+                    continue
+                total += rate
+                self.pairs.append((int(origin), int(dest)))
+                self.cum.append(total)
+        self.total = total
+
+    def pick(self, rng):
+        return self.pairs[bisect_right(self.cum, rng.random() * self.total)]
+
+
+def uniform_od(portal_ids, rate):
+    """Every ordered pair of distinct portals at `rate` veh/h."""
+    return {o: {d: rate for d in portal_ids if d != o} for o in portal_ids}
+
+
+class DemandModel:
+    def __init__(self, periods, seed=None, chunk=60.0, max_backlog=200):
+        self.periods = sorted(periods, key=lambda p: p.start)
+        self.rng = random.Random(seed)
+        self.chunk = chunk              # seconds of arrivals sampled at a time
+        self.max_backlog = max_backlog  # waiting cars per origin portal
+        self.heap = []                  # (time, seq, origin, dest)
+        self.horizon = self.periods[0].start if self.periods else 0.0
+        self._seq = 0
+        self.backlog = {}               # origin -> deque of dest (only non-empty)
+
+        self.sampled = 0
+        self.spawned = 0
+        self.dropped = 0      # backlog overflow
+        self.unroutable = 0   # no path between the drawn portal tiles
+
+    @classmethod
+    def from_dict(cls, data, **kw):
+        periods = [
+            DemandPeriod(p["start"], p["end"], p["od"], p.get("scale", 1.0))
+            for p in data["periods"]
+        ]
+        return cls(periods, **kw)
+
+    @classmethod
+    def from_file(cls, path, **kw):
+        with open(path) as f:
+            return cls.from_dict(json.load(f), **kw)
+
+    # -----------------------------
+    # ARRIVALS
+    # -----------------------------
+    def _sample(self, t0, t1):
+        rng = self.rng
+        heap = self.heap
+        for p in self.periods:
+            lo, hi = max(t0, p.start), min(t1, p.end)
+            if lo >= hi or p.total <= 0:
+                continue
+            t = lo
+            while True:
+                t += rng.expovariate(p.total)
+                if t >= hi:
+                    break
+                origin, dest = p.pick(rng)
+                heapq.heappush(heap, (t, self._seq, origin, dest))
+                self._seq += 1
+                self.sampled += 1
+
+    def _refill(self, now):
+        while self.horizon <= now and self.periods and self.horizon < self.periods[-1].end:
+            t1 = self.horizon + self.chunk
+            self._sample(self.horizon, t1)
+            self.horizon = t1
+
+    def waiting(self):
+        return sum(len(q) for q in self.backlog.values())
+
+    # -----------------------------
+    # RELEASE
+    # -----------------------------
+    def release(self, sim):
+        """Move due arrivals to their portal backlog and spawn what fits; returns cars spawned."""
+        now = sim.sim_time
+        self._refill(now)
+
+        heap = self.heap
+        backlog = self.backlog
+        while heap and heap[0][0] <= now:
+            _, _, origin, dest = heapq.heappop(heap)
+            q = backlog.get(origin)
+            if q is None:
+                q = backlog[origin] = deque()
+            if len(q) >= self.max_backlog:
+                self.dropped += 1
+                continue
+            q.append(dest)
+
+        spawned = 0
+        rng = self.rng
+        portals = sim.portals
+        for origin in list(backlog):
+            if len(sim.cars) >= sim.max_active_cars:
+                break
+            q = backlog[origin]
+            dest = q[0]
+            start_tiles = portals.get(origin)
+            goal_tiles = portals.get(dest)
+            if not start_tiles or not goal_tiles:
+                self.unroutable += 1
+                car = None
+            else:
+                start = rng.choice(start_tiles)
+                goal = rng.choice(goal_tiles)
+                if not sim.route_path(start, goal):
+                    self.unroutable += 1
+                    car = None
+                else:
+                    car = sim.spawn_car(start, goal)
+                    if car is None:
+                        continue  # entry lane full: keep waiting (backpressure)
+                    sim.add_car(car)
+                    spawned += 1
+            q.popleft()
+            if not q:
+                del backlog[origin]
+
+        self.spawned += spawned
+        return spawned
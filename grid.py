@@ -1,38 +1,77 @@
 import pygame
-from config import ROAD_GRAY, LANE_LINE, PORTAL_COL, BLACK, WHITE, TILE, ROWS, COLS, ROAD_MAP
-from utils import tile_rect, world_center
-
-def draw_map(surface):
-    for y in range(ROWS):
-        for x in range(COLS):
-            val = ROAD_MAP[y][x]
-            r = tile_rect(x,y)
-            if val == 0:
-                continue
-
-            pygame.draw.rect(surface, ROAD_GRAY, r)
-
-            cx, cy = world_center(x,y)
-            horiz = (x+1 < COLS and ROAD_MAP[y][x+1]!=0) or (x-1>=0 and ROAD_MAP[y][x-1]!=0)
-            vert  = (y+1 < ROWS and ROAD_MAP[y+1][x]!=0) or (y-1>=0 and ROAD_MAP[y-1][x]!=0)
-
-            if horiz and not vert:
-                pygame.draw.line(surface, LANE_LINE, (x*TILE, cy-6), (x*TILE+TILE, cy-6), 2)
-                pygame.draw.line(surface, LANE_LINE, (x*TILE, cy+6), (x*TILE+TILE, cy+6), 2)
-            elif vert and not horiz:
-                pygame.draw.line(surface, LANE_LINE, (cx-6, y*TILE), (cx-6, y*TILE+TILE), 2)
-                pygame.draw.line(surface, LANE_LINE, (cx+6, y*TILE), (cx+6, y*TILE+TILE), 2)
-            else:
-                pygame.draw.line(surface, LANE_LINE, (x*TILE+8, y*TILE+8), (x*TILE+TILE-8, y*TILE+TILE-8), 2)
-                pygame.draw.line(surface, LANE_LINE, (x*TILE+8, y*TILE+TILE-8), (x*TILE+TILE-8, y*TILE+8), 2)
-
-            if val > 1:
-                pygame.draw.rect(surface, PORTAL_COL, r.inflate(-TILE//4, -TILE//4))
-                font = pygame.font.SysFont(None, 20)
-                txt = font.render(str(val), True, BLACK)
-                surface.blit(txt, (x*TILE+6, y*TILE+6))
-
-            pygame.draw.rect(surface, BLACK, r, 2)
+from config import ROAD_GRAY, LANE_LINE, PORTAL_COL, BLACK, WHITE, TILE, ROAD_MAP
+from utils import world_center
+
+def tile_rect(tx, ty):
+    return pygame.Rect(tx * TILE, ty * TILE, TILE, TILE)
+
+# cached map layer: id(grid) -> (grid, surface); tiles are redrawn only when edited
+_map_cache = {}
+_font = None
+
+
+def _draw_tile(surface, grid, x, y):
+    global _font
+    ROWS, COLS = len(grid), len(grid[0])
+    r = tile_rect(x, y)
+    surface.fill((0, 0, 0, 0), r)
+    val = grid[y][x]
+    if val == 0:
+        return
+
+    pygame.draw.rect(surface, ROAD_GRAY, r)
+
+    cx, cy = world_center(x,y)
+    horiz = (x+1 < COLS and grid[y][x+1]!=0) or (x-1>=0 and grid[y][x-1]!=0)
+    vert  = (y+1 < ROWS and grid[y+1][x]!=0) or (y-1>=0 and grid[y-1][x]!=0)
+
+    if horiz and not vert:
+        pygame.draw.line(surface, LANE_LINE, (x*TILE, cy-6), (x*TILE+TILE, cy-6), 2)
+        pygame.draw.line(surface, LANE_LINE, (x*TILE, cy+6), (x*TILE+TILE, cy+6), 2)
+    elif vert and not horiz:
+        pygame.draw.line(surface, LANE_LINE, (cx-6, y*TILE), (cx-6, y*TILE+TILE), 2)
+        pygame.draw.line(surface, LANE_LINE, (cx+6, y*TILE), (cx+6, y*TILE+TILE), 2)
+    else:
+        pygame.draw.line(surface, LANE_LINE, (x*TILE+8, y*TILE+8), (x*TILE+TILE-8, y*TILE+TILE-8), 2)
+        pygame.draw.line(surface, LANE_LINE, (x*TILE+8, y*TILE+TILE-8), (x*TILE+TILE-8, y*TILE+8), 2)
+
+    if val > 1:
+        pygame.draw.rect(surface, PORTAL_COL, r.inflate(-TILE//4, -TILE//4))
+        if _font is None:
+            _font = pygame.font.SysFont(None, 20)
+        txt = _font.render(str(val), True, BLACK)
+        surface.blit(txt, (x*TILE+6, y*TILE+6))
+
+    pygame.draw.rect(surface, BLACK, r, 2)
+
+
+def draw_map(surface, grid=None, dirty=()):
+    """
+    Blit the road layer. It is drawn once per grid and afterwards only the
+    `dirty` tiles (edited since the last call, see map_edit.py) and their
+    neighbours, whose lane markings depend on them, are redrawn.
+    """
+    if grid is None:
+        grid = ROAD_MAP
+    ROWS, COLS = len(grid), len(grid[0])
+    cached = _map_cache.get(id(grid))
+    if cached is None or cached[0] is not grid:
+        layer = pygame.Surface((COLS * TILE, ROWS * TILE), pygame.SRCALPHA)
+        for y in range(ROWS):
+            for x in range(COLS):
+                _draw_tile(layer, grid, x, y)
+        cached = _map_cache[id(grid)] = (grid, layer)
+    elif dirty:
+        layer = cached[1]
+        redraw = set()
+        for x, y in dirty:
+            redraw.add((x, y))
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                redraw.add((x + dx, y + dy))
+        for x, y in redraw:
+            if 0 <= x < COLS and 0 <= y < ROWS:
+                _draw_tile(layer, grid, x, y)
+    surface.blit(cached[1], (0, 0))
 
 def draw_debug_paths(surface, cars):
     for car in cars:
@@ -43,3 +82,32 @@ def draw_debug_paths(surface, cars):
             pygame.draw.lines(surface, (120,120,255), False, pts, 2)
         for p in pts:
             pygame.draw.circle(surface, (255,255,255), p, 3)
+
+# cached heatmap overlay: (stats, field, window) -> (stats.version, surface)
+_heat_cache = {}
+
+
+def draw_heatmap(surface, stats, field="stopped", window=None, refresh=30, alpha=150):
+    """
+    Tint tiles by a TileStats field (normalised to its current maximum). The
+    overlay surface is rebuilt at most every `refresh` stats updates.
+    """
+    key = (id(stats), field, window)
+    cached = _heat_cache.get(key)
+    if cached is None or stats.version - cached[0] >= refresh:
+        np = stats.np
+        values = stats.field(field, window)
+        peak = float(values.max())
+        small = pygame.Surface((stats.cols, stats.rows), pygame.SRCALPHA)
+        if peak > 0:
+            v = values.T / peak  # surfarray arrays are indexed [x, y]
+            rgb = pygame.surfarray.pixels3d(small)
+            rgb[..., 0] = 255
+            rgb[..., 1] = (255 * (1 - v)).astype(np.uint8)
+            rgb[..., 2] = 0
+            a = pygame.surfarray.pixels_alpha(small)
+            a[...] = np.where(v > 0.01, alpha * v, 0).astype(np.uint8)
+            del rgb, a  # unlock the surface before scaling it
+        overlay = pygame.transform.scale(small, (stats.cols * TILE, stats.rows * TILE))
+        cached = _heat_cache[key] = (stats.version, overlay)
+    surface.blit(cached[1], (0, 0))
@@ -0,0 +1,122 @@
+import math
+
+from config import TILE, STOPPED_SPEED
+
+# ============================================================
+# Per-tile congestion statistics
+# ============================================================
+# Exponentially decayed per-tile sums, one column per decay window:
+#
+#   occupancy   car-seconds spent on the tile
+#   stopped     car-seconds spent below STOPPED_SPEED
+#   throughput  cars that entered the tile
+#   speed       speed * seconds (mean speed = speed / occupancy)
+#
+# Decay is lazy: contributions are added scaled by exp(t / tau) and the
+# arrays are only multiplied back down when that factor gets large, so a
+# tick costs O(cars) and the arrays stay O(tiles).
+
+DEFAULT_WINDOWS = (10.0, 60.0, 300.0)  # decay time constants (s)
+RENORM = 1e6                           # growth factor at which the arrays are rescaled
+FIELDS = ("occupancy", "stopped", "throughput", "speed")
+
+
+class TileStats:
+    """Requires numpy (imported on construction, like TrajectoryReader.as_array)."""
+
+    def __init__(self, rows, cols, windows=DEFAULT_WINDOWS, stopped_speed=STOPPED_SPEED):
+        import numpy as np
+
+        self.np = np
+        self.rows = rows
+        self.cols = cols
+        self.windows = tuple(float(w) for w in windows)
+        self.stopped_speed = stopped_speed
+        self.tau = np.array(self.windows)
+        self.sums = {f: np.zeros((rows * cols, len(self.windows))) for f in FIELDS}
+        self.t0 = 0.0          # time at which the stored sums are in real units
+        self.now = 0.0
+        self.version = 0       # bumped every update (render cache key)
+        self._tile = {}        # car id -> flat tile index last tick
+
+    # -----------------------------
+    # UPDATE (simulation thread)
+    # -----------------------------
+    def update(self, cars, dt, now):
+        np = self.np
+        cols, rows = self.cols, self.rows
+        last = self._tile
+        seen = {}
+        idx, speed, stopped, entered = [], [], [], []
+        for car in cars:
+            key = car.lane_key
+            if key is not None:
+                tx, ty = key[0]
+            else:
+                tx, ty = int(car.x // TILE), int(car.y // TILE)
+            if not (0 <= tx < cols and 0 <= ty < rows):
+                continue
+            i = ty * cols + tx
+            idx.append(i)
+            speed.append(car.speed)
+            if car.speed < self.stopped_speed:
+                stopped.append(i)
+            if last.get(car.car_id) != i:
+                entered.append(i)
+            seen[car.car_id] = i
+        self._tile = seen
+
+        self.now = now
+        self.version += 1
+        g = np.exp((now - self.t0) / self.tau)
+        if idx:
+            w = g * dt
+            np.add.at(self.sums["occupancy"], idx, w)
+            np.add.at(self.sums["speed"], idx, np.outer(speed, w))
+        if stopped:
+            np.add.at(self.sums["stopped"], stopped, g * dt)
+        if entered:
+            np.add.at(self.sums["throughput"], entered, g)
+        if g.max() > RENORM:
+            self._rescale(now)
+
+    def forget(self, car_ids):
+        """Drop cars taken off the map outside the normal arrival path (map edits)."""
+        for car_id in car_ids:
+            self._tile.pop(car_id, None)
+
+    def _rescale(self, now):
+        scale = self.np.exp(-(now - self.t0) / self.tau)
+        for a in self.sums.values():
+            a *= scale
+        self.t0 = now
+
+    # -----------------------------
+    # EXPORT
+    # -----------------------------
+    def window_index(self, window):
+        return self.windows.index(float(window)) if window is not None else 0
+
+    def field(self, name, window=None):
+        """(rows, cols) array of one statistic for one decay window (default: the first)."""
+        np = self.np
+        w = self.window_index(window)
+        decay = math.exp(-(self.now - self.t0) / self.windows[w])
+        if name == "mean_speed":
+            occ = self.sums["occupancy"][:, w]
+            out = np.divide(self.sums["speed"][:, w], occ, out=np.zeros_like(occ), where=occ > 1e-9)
+        else:
+            out = self.sums[name][:, w] * decay
+        return out.reshape(self.rows, self.cols)
+
+    def arrays(self):
+        """{name: (windows, rows, cols) array} of occupancy/stopped seconds, throughput and mean speed."""
+        np = self.np
+        return {
+            name: np.stack([self.field(name, w) for w in self.windows])
+            for name in ("occupancy", "stopped", "throughput", "mean_speed")
+        }
+
+    def save(self, path):
+        """Write arrays() and the window lengths to an .npz file."""
+        self.np.savez_compressed(path, windows=self.np.array(self.windows), **self.arrays())
@@ -0,0 +1,361 @@
+import math
+
+from config import TILE
+from lanes import IDM_MIN_GAP, IDM_COMFORT_DECEL
+
+# ============================================================
+# Intersection manager (tile-time reservations)
+# ============================================================
+# Every junction tile (see LaneOccupancy.is_junction) is split into 2x2
+# cells. A route's crossing is a run of consecutive junction tiles; its
+# footprint is the set of cells the lane polyline sweeps (plus car width)
+# and its arc-length span [s_in, s_out].
+#
+# Approaching cars book (cell, time slot) entries for their footprint. The
+# way is open while the booked window has started, no other car physically
+# holds one of the cells and the exit lane has room; an open car commits once
+# it is within braking distance of the stop line and then holds the cells
+# until its tail leaves the crossing. A car facing a closed way gets a virtual
+# standing leader at the stop line, so IDM brakes it.
+#
+# Conflicting movements are serialized by table lookups; movements with
+# disjoint footprints (opposite straights, right turns) cross together.
+#
+# Only junction tiles are reserved. Links, corners and the tiles next to a
+# junction are left to car following on each lane, which holds because the
+# lane polylines of opposite directions never meet off a junction (see
+# tile_path_to_lane_points).
+
+SLOT = 0.1                # s per reservation slot
+CELL_SPLIT = 2            # cells per tile side
+APPROACH_DISTANCE = TILE  # px before the stop line at which cars start booking
+COMMIT_MARGIN = 6.0       # px added to the braking distance at which a car commits
+EARLY = 0.5               # s a car may commit before its booked window
+LATE = 1.0                # s after its window start before a car re-books
+MAX_SEARCH_SLOTS = 300    # how far ahead (slots) a booking may be pushed
+CLEARANCE = 4.0           # px margin around the footprint
+SAMPLE_STEP = 3.0         # px between polyline samples
+CAR_HALF_WIDTH = 10.0     # lateral half extent swept into the footprint
+
+
+class Crossing:
+    __slots__ = ("s_in", "s_out", "cells", "exit_idx", "exit_point", "turning")
+
+    def __init__(self, s_in, s_out, cells, exit_idx, exit_point, turning):
+        self.s_in = s_in
+        self.s_out = s_out
+        self.cells = cells
+        self.exit_idx = exit_idx        # route tile index just after the crossing (or None)
+        self.exit_point = exit_point    # polyline point at s_out
+        self.turning = turning
+
+
+class _Booking:
+    __slots__ = ("idx", "keys", "start", "end", "inside")
+
+    def __init__(self):
+        self.idx = 0          # next crossing on the route
+        self.keys = []        # booked (cell, slot) entries
+        self.start = 0.0      # booked window (s of simulation time)
+        self.end = 0.0
+        self.inside = False   # committed: holds the crossing's cells
+
+
+def _cell_of(x, y):
+    cell = TILE / CELL_SPLIT
+    return (int(x // cell), int(y // cell))
+
+
+def _sample_run(window, tiles):
+    """
+    (s_in, s_out, cells, exit_point) of the polyline window's samples inside
+    tiles, arc lengths from window[0]; None if no sample falls inside.
+    """
+    s_in = s_out = None
+    exit_point = None
+    cells = set()
+    s0 = 0.0
+    for k in range(1, len(window)):
+        (ax, ay), (bx, by) = window[k - 1], window[k]
+        seg = math.hypot(bx - ax, by - ay)
+        if seg <= 0:
+            continue
+        ux, uy = (bx - ax) / seg, (by - ay) / seg
+        steps = max(1, int(seg // SAMPLE_STEP))
+        for m in range(steps + 1):
+            d = seg * m / steps
+            px, py = ax + ux * d, ay + uy * d
+            if (int(px // TILE), int(py // TILE)) not in tiles:
+                continue
+            if s_in is None:
+                s_in = s0 + d
+            s_out = s0 + d
+            exit_point = (px, py)
+            for off in (-CAR_HALF_WIDTH, 0.0, CAR_HALF_WIDTH):
+                cx, cy = px - uy * off, py + ux * off
+                if (int(cx // TILE), int(cy // TILE)) in tiles:
+                    cells.add(_cell_of(cx, cy))
+        s0 += seg
+    if s_in is None:
+        return None
+    return s_in, s_out, tuple(sorted(cells)), exit_point
+
+
+def route_crossings(route, is_junction, runs=None):
+    """
+    Crossings of a route, in route order. Each run of junction tiles only
+    samples the polyline points of its tiles and their two neighbours, so a
+    whole route costs one pass over its points.
+
+    A run's samples depend only on those points and tiles: runs (a dict the
+    caller keeps) caches them by both, so routes making the same movement
+    through a junction are sampled once.
+    """
+    tile_path = route.tile_path
+    points = route.points
+    starts = route.tile_starts
+    cum = route.cum_length
+    crossings = []
+    n = len(tile_path)
+    i = 0
+    while i < n:
+        if not is_junction(tile_path[i]):
+            i += 1
+            continue
+        j = i
+        while j + 1 < n and is_junction(tile_path[j + 1]):
+            j += 1
+
+        # segments between points owned by tiles i-1 .. j+1
+        lo = max(1, starts[max(i - 1, 0)])
+        hi = min(len(points), starts[min(j + 2, n)] + 1)
+        run_tiles = tuple(tile_path[i:j + 1])
+        window = tuple(points[lo - 1:hi])
+        if runs is None:
+            sampled = _sample_run(window, set(run_tiles))
+        else:
+            key = (run_tiles, window)
+            sampled = runs.get(key, False)
+            if sampled is False:
+                sampled = runs[key] = _sample_run(window, set(run_tiles))
+
+        if sampled is not None:
+            s_in, s_out, cells, exit_point = sampled
+            base = cum[lo - 1]
+            entry = tile_path[i - 1] if i > 0 else tile_path[i]
+            leave = tile_path[j + 1] if j + 1 < n else tile_path[j]
+            first, last = tile_path[i], tile_path[j]
+            d_in = (first[0] - entry[0], first[1] - entry[1])
+            d_out = (leave[0] - last[0], leave[1] - last[1])
+            turning = d_in != d_out and d_in != (0, 0) and d_out != (0, 0)
+            crossings.append(Crossing(
+                base + s_in, base + s_out, cells,
+                j + 1 if j + 1 < n else None, exit_point, turning,
+            ))
+        i = j + 1
+    return tuple(crossings)
+
+
+class IntersectionManager:
+    def __init__(self, lanes):
+        self.lanes = lanes
+        self.now = 0.0
+        self.table = {}      # (cell, slot) -> car
+        self.holders = {}    # cell -> car currently inside
+        self.bookings = {}   # car -> _Booking
+        self._crossings = {} # route key -> crossings
+        self._runs = {}      # junction run samples shared by routes (see route_crossings)
+        self.granted = 0
+        self.rebooked = 0
+
+    # -----------------------------
+    # ROUTE FOOTPRINTS
+    # -----------------------------
+    def crossings(self, route):
+        c = self._crossings.get(route.key)
+        if c is None:
+            c = self._crossings[route.key] = route_crossings(route, self.lanes.is_junction, self._runs)
+        return c
+
+    def invalidate_map(self):
+        self._crossings.clear()
+        self._runs.clear()
+
+    def forget(self, keys):
+        """Drop the crossings of routes whose junction tiles changed."""
+        for key in keys:
+            self._crossings.pop(key, None)
+
+    # -----------------------------
+    # TABLE
+    # -----------------------------
+    def _conflict(self, cells, s0, s1, car):
+        """Last slot in [s0, s1) booked by another car on one of the cells, or -1."""
+        table = self.table
+        for slot in range(s1 - 1, s0 - 1, -1):
+            for cell in cells:
+                owner = table.get((cell, slot))
+                if owner is not None and owner is not car:
+                    return slot
+        return -1
+
+    def _book(self, car, b, crossing, eta):
+        """Book the earliest free window at or after eta; False if none fits."""
+        self._unbook(car, b)
+        v = car.max_speed * (0.45 if crossing.turning else 1.0)
+        span = crossing.s_out - crossing.s_in + car.width + 2 * CLEARANCE
+        # conservative: cross at half the cruise speed (cars may start from rest)
+        duration = span / max(v * 0.5, 1.0)
+        s0 = int(eta / SLOT)
+        n = int(math.ceil(duration / SLOT)) + 1
+        cells = crossing.cells
+        start = s0
+        while start < s0 + MAX_SEARCH_SLOTS:
+            busy = self._conflict(cells, start, start + n, car)
+            if busy >= 0:
+                start = busy + 1
+                continue
+            keys = b.keys
+            for slot in range(start, start + n):
+                for cell in cells:
+                    key = (cell, slot)
+                    self.table[key] = car
+                    keys.append(key)
+            b.start = start * SLOT
+            b.end = (start + n) * SLOT
+            return True
+        return False
+
+    def _unbook(self, car, b):
+        table = self.table
+        for key in b.keys:
+            if table.get(key) is car:
+                del table[key]
+        b.keys = []
+        b.start = b.end = 0.0
+
+    def _extend(self, car, b, crossing):
+        """Keep booking slots while a committed car is still inside."""
+        s0 = int(b.end / SLOT)
+        s1 = int((self.now + 1.0) / SLOT) + 1
+        for slot in range(s0, s1):
+            for cell in crossing.cells:
+                key = (cell, slot)
+                if key not in self.table:
+                    self.table[key] = car
+                    b.keys.append(key)
+        b.end = max(b.end, s1 * SLOT)
+
+    def _cells_free(self, cells, car):
+        holders = self.holders
+        for cell in cells:
+            h = holders.get(cell)
+            if h is not None and h is not car:
+                return False
+        return True
+
+    def _exit_clear(self, car, crossing):
+        """Room for the whole car behind the last car on the lane after the crossing."""
+        if crossing.exit_idx is None:
+            return True
+        q = self.lanes.queues.get(car.route.lane_keys[crossing.exit_idx])
+        if q is None:
+            return True
+        tail = q[1]
+        ex, ey = crossing.exit_point
+        gap = math.hypot(tail.x - ex, tail.y - ey) - tail.width * 0.5
+        return gap > car.width + IDM_MIN_GAP
+
+    def _enter(self, car, b, crossing):
+        for cell in crossing.cells:
+            self.holders[cell] = car
+        b.inside = True
+        self.granted += 1
+
+    def _leave(self, car, b, crossing):
+        holders = self.holders
+        for cell in crossing.cells:
+            if holders.get(cell) is car:
+                del holders[cell]
+        self._unbook(car, b)
+        b.inside = False
+
+    # -----------------------------
+    # PER-CAR GATE
+    # -----------------------------
+    def gate(self, car, pos, hold=False):
+        """
+        Distance (px) from the car's centre to where it must stop, or None
+        if nothing at a junction limits it. pos is the car's arc position on
+        its route; hold=True (e.g. red light) forbids committing this tick.
+        Only junction tiles are gated; everywhere else the car just follows
+        its lane.
+        """
+        crossings = self.crossings(car.route)
+        b = self.bookings.get(car)
+        if b is None:
+            if not crossings:
+                return None
+            b = self.bookings[car] = _Booking()
+
+        half = car.width * 0.5
+        k = b.idx
+        while k < len(crossings) and pos - half - CLEARANCE > crossings[k].s_out:
+            if b.inside:
+                self._leave(car, b, crossings[k])
+            k += 1
+        b.idx = k
+        if k >= len(crossings):
+            return None
+
+        crossing = crossings[k]
+        if b.inside:
+            if self.now + SLOT > b.end:
+                self._extend(car, b, crossing)
+            return None
+
+        stop_line = crossing.s_in - half - CLEARANCE
+        to_go = stop_line - pos
+        if to_go < 0 and not b.keys:
+            # already inside without a booking (spawned or scattered there)
+            self._enter(car, b, crossing)
+            return None
+        if to_go > APPROACH_DISTANCE:
+            return None
+        # only the front car of an approach books; the rest follow their leader
+        lead = self.lanes.leader(car)
+        if lead is not None and self.lanes.headway(car, lead) < to_go:
+            lb = self.bookings.get(lead)
+            if lb is None or not lb.inside:
+                return None
+
+        now = self.now
+        if not b.keys or now > b.start + LATE:
+            if b.keys:
+                self.rebooked += 1
+            eta = now + max(to_go, 0.0) / max(car.speed, car.max_speed * 0.45)
+            if not self._book(car, b, crossing, eta):
+                return max(to_go, 0.0)
+
+        if (hold or now < b.start - EARLY
+                or not self._cells_free(crossing.cells, car)
+                or not self._exit_clear(car, crossing)):
+            return max(to_go, 0.0)
+        if to_go <= car.speed * car.speed / (2.0 * IDM_COMFORT_DECEL) + COMMIT_MARGIN:
+            self._enter(car, b, crossing)
+        return None
+
+    def remove(self, car):
+        b = self.bookings.pop(car, None)
+        if b is None:
+            return
+        if b.inside:
+            crossings = self.crossings(car.route)
+            if b.idx < len(crossings):
+                self._leave(car, b, crossings[b.idx])
+        self._unbook(car, b)
+
+    def clear(self):
+        self.table.clear()
+        self.holders.clear()
+        self.bookings.clear()
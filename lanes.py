@@ -0,0 +1,259 @@
+from config import TILE
+from pathfinding import DIRS4, ONEWAY_DIRS, spawn_pose
+from utils import world_center
+
+# ============================================================
+# Lane-ordered occupancy
+# ============================================================
+# A lane is (tile, entry dir, exit dir, lane index): every car on it follows
+# the same lane points, so cars on a lane form a FIFO queue. Queues are
+# intrusive doubly-linked lists through Car.lane_ahead / Car.lane_behind,
+# which makes enter/leave/leader lookups O(1).
+#
+# Junction tiles (3+ linked neighbours) still get queues per movement,
+# but cars there fall back to raycasts, because other movements cross them.
+# A one-way tile only links along its own axis, so parallel one-way rows
+# (arterial pairs) are not junctions.
+
+# Intelligent Driver Model parameters (px, s)
+IDM_MIN_GAP = 8.0        # s0: bumper gap at standstill
+IDM_HEADWAY = 0.8        # T: desired time headway
+IDM_COMFORT_DECEL = 300.0
+IDM_DELTA = 4
+LEADER_LOOKAHEAD_TILES = 2
+
+
+def tiles_linked(a_val, b_val, dx, dy):
+    """True if two adjacent drivable tiles are joined by road along (dx, dy)."""
+    for v in (a_val, b_val):
+        d = ONEWAY_DIRS.get(v)
+        if d is not None and (d[0] != 0) != (dx != 0):
+            return False
+    return True
+
+
+def route_lane_keys(tile_path, lane_index):
+    """Lane key for each tile of a route."""
+    keys = []
+    n = len(tile_path)
+    for i, (x, y) in enumerate(tile_path):
+        entry_dir = exit_dir = (0, 0)
+        if i > 0:
+            px, py = tile_path[i - 1]
+            entry_dir = (x - px, y - py)
+        if i + 1 < n:
+            nx, ny = tile_path[i + 1]
+            exit_dir = (nx - x, ny - y)
+        if i == 0:
+            entry_dir = exit_dir
+        elif i + 1 == n:
+            exit_dir = entry_dir
+        keys.append(((x, y), entry_dir, exit_dir, lane_index))
+    return keys
+
+
+def idm_accel(speed, v0, accel, gap=None, leader_speed=0.0):
+    """IDM acceleration; gap=None means free road."""
+    free = 1.0 - (speed / v0) ** IDM_DELTA if v0 > 0 else -1.0
+    if gap is None:
+        return accel * free
+    gap = max(gap, 0.1)
+    dv = speed - leader_speed
+    s_star = IDM_MIN_GAP + max(0.0, speed * IDM_HEADWAY + speed * dv / (2.0 * (accel * IDM_COMFORT_DECEL) ** 0.5))
+    return accel * (free - (s_star / gap) ** 2)
+
+
+class LaneOccupancy:
+    def __init__(self, grid, raycast_only=False):
+        self.grid = grid
+        self.raycast_only = raycast_only  # keep tracking lanes but use the legacy raycast model everywhere
+        self.queues = {}     # lane key -> [head (front-most) car, tail car]
+        self._junction = {}  # tile -> bool (lazy)
+
+    # -----------------------------
+    # MAP QUERIES
+    # -----------------------------
+    def is_junction(self, tile):
+        j = self._junction.get(tile)
+        if j is None:
+            x, y = tile
+            grid = self.grid
+            rows, cols = len(grid), len(grid[0])
+            n = 0
+            if 0 <= x < cols and 0 <= y < rows and grid[y][x] != 0:
+                val = grid[y][x]
+                for dx, dy in DIRS4:
+                    nx, ny = x + dx, y + dy
+                    if 0 <= nx < cols and 0 <= ny < rows and grid[ny][nx] != 0 \
+                            and tiles_linked(val, grid[ny][nx], dx, dy):
+                        n += 1
+            j = self._junction[tile] = n >= 3
+        return j
+
+    def near_junction(self, car, probe_x, probe_y):
+        """True if the car is on, or its nose probe reaches, a junction tile."""
+        if self.raycast_only:
+            return True
+        if self.is_junction(car.tile_path[car.tile_idx]):
+            return True
+        return self.is_junction((int(probe_x // TILE), int(probe_y // TILE)))
+
+    # -----------------------------
+    # MEMBERSHIP
+    # -----------------------------
+    def _link(self, car, key):
+        car.lane_key = key
+        car.lane_behind = None
+        q = self.queues.get(key)
+        if q is None:
+            car.lane_ahead = None
+            self.queues[key] = [car, car]
+        else:
+            tail = q[1]
+            tail.lane_behind = car
+            car.lane_ahead = tail
+            q[1] = car
+
+    def _unlink(self, car):
+        key = car.lane_key
+        if key is None:
+            return
+        q = self.queues[key]
+        ahead, behind = car.lane_ahead, car.lane_behind
+        if ahead is not None:
+            ahead.lane_behind = behind
+        else:
+            q[0] = behind
+        if behind is not None:
+            behind.lane_ahead = ahead
+        else:
+            q[1] = ahead
+        if q[0] is None:
+            del self.queues[key]
+        car.lane_key = car.lane_ahead = car.lane_behind = None
+
+    def add(self, car):
+        """Register a car on the lane of the route tile it currently occupies."""
+        tile_path = car.tile_path
+        if not tile_path:
+            car.tile_idx = 0
+            car.lane_key = car.lane_ahead = car.lane_behind = None
+            return
+        cur = (int(car.x // TILE), int(car.y // TILE))
+        idx = 0
+        for i, t in enumerate(tile_path):
+            if t == cur:
+                idx = i
+                break
+        car.tile_idx = idx
+        car.lane_key = None
+        self._link(car, car.route.lane_keys[idx])
+
+    def insert(self, car):
+        """
+        Register a car arriving mid-lane (region handoffs, ghosts) on the lane
+        of its route tile car.tile_idx, in position order along the exit direction.
+        """
+        key = car.route.lane_keys[car.tile_idx]
+        q = self.queues.get(key)
+        if q is None:
+            self._link(car, key)
+            return
+        ex, ey = key[2]
+        progress = car.x * ex + car.y * ey
+        ahead = q[1]
+        while ahead is not None and ahead.x * ex + ahead.y * ey < progress:
+            ahead = ahead.lane_ahead
+        car.lane_key = key
+        car.lane_ahead = ahead
+        if ahead is None:
+            behind = q[0]
+            q[0] = car
+        else:
+            behind = ahead.lane_behind
+            ahead.lane_behind = car
+        car.lane_behind = behind
+        if behind is None:
+            q[1] = car
+        else:
+            behind.lane_ahead = car
+
+    def remove(self, car):
+        self._unlink(car)
+
+    def advance(self, car):
+        """Move a car to the next lane once it has driven onto the next route tile."""
+        i = car.tile_idx + 1
+        tile_path = car.tile_path
+        if i >= len(tile_path):
+            return False
+        nx, ny = tile_path[i]
+        if int(car.x // TILE) != nx or int(car.y // TILE) != ny:
+            return False
+        self._unlink(car)
+        car.tile_idx = i
+        self._link(car, car.route.lane_keys[i])
+        return True
+
+    def clear(self):
+        for head, _ in self.queues.values():
+            car = head
+            while car is not None:
+                nxt = car.lane_behind
+                car.lane_key = car.lane_ahead = car.lane_behind = None
+                car = nxt
+        self.queues.clear()
+
+    def invalidate_map(self):
+        self._junction.clear()
+
+    def invalidate_tiles(self, tiles):
+        """Forget the junction flags of edited tiles (and their neighbours)."""
+        for t in tiles:
+            self._junction.pop(t, None)
+
+    # -----------------------------
+    # LEADER LOOKUP
+    # -----------------------------
+    def leader(self, car):
+        """Nearest car ahead on the car's own lane sequence (or None within the lookahead)."""
+        ahead = car.lane_ahead
+        if ahead is not None:
+            return ahead
+        keys = car.route.lane_keys
+        i = car.tile_idx + 1
+        end = min(len(keys), i + LEADER_LOOKAHEAD_TILES)
+        queues = self.queues
+        while i < end:
+            q = queues.get(keys[i])
+            if q is not None:
+                return q[1]
+            i += 1
+        return None
+
+    def entry_clear(self, route, length):
+        """
+        True if a car up to `length` px long fits at the route's spawn point
+        behind the last car on its first lane. Needs no car, so spawners can
+        check a portal before taking one from the pool.
+        """
+        keys = route.lane_keys
+        if not keys:
+            return True
+        q = self.queues.get(keys[0])
+        if q is None:
+            return True
+        tail = q[1]
+        path = route.tile_path
+        if len(path) > 1:
+            x, y, _ = spawn_pose(path[0], path[1])
+        else:
+            x, y = world_center(*path[0])
+        gap = ((tail.x - x) ** 2 + (tail.y - y) ** 2) ** 0.5 - (length + tail.width) * 0.5
+        return gap > IDM_MIN_GAP
+
+    def headway(self, car, leader):
+        """Bumper-to-bumper gap (px) to the leader."""
+        dx = leader.x - car.x
+        dy = leader.y - car.y
+        return (dx * dx + dy * dy) ** 0.5 - (car.width + leader.width) * 0.5
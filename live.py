@@ -0,0 +1,297 @@
+"""
+Live state stream for external dashboards.
+
+    python main.py --live 8765
+    nc 127.0.0.1 8765          # then type: {"cmd": "subscribe", "every": 30}
+
+An asyncio TCP server on its own thread. The protocol is newline-delimited
+JSON both ways.
+
+Server -> client: a "full" frame, then "delta" frames holding only cars that
+moved, appeared ("cars") or left ("gone"), lights whose phase, reward or
+penalties changed, and the crash count when it changed:
+
+    {"type": "delta", "tick": 812, "time": 13.53, "cars": [[id, x, y, angle], ...],
+     "gone": [id, ...], "lights": [[index, green, total_reward, penalties], ...], "crashes": 3}
+
+Client -> server (applied by the simulation at the start of its next tick):
+
+    {"cmd": "subscribe", "every": N}           at most one frame every N ticks
+    {"cmd": "pause"} / {"cmd": "resume"}
+    {"cmd": "step", "ticks": N}                advance N >= 0 ticks while paused (default 1)
+    {"cmd": "set_light", "light": i, "green": true}
+    {"cmd": "set_tile", "tile": [x, y], "code": c}   road edit (see map_edit.py)
+
+Malformed commands are answered with {"type": "error", "error": ...} and never
+reach the simulation.
+
+The simulation thread only copies plain tuples and hands the latest frame
+over; each client keeps just the newest frame it has not sent yet, so a slow
+consumer drops stale frames instead of delaying Simulation.update.
+"""
+import asyncio
+import json
+import queue
+import threading
+
+
+def _round(v):
+    return round(v, 1)
+
+
+def _int(cmd, key, default=None):
+    """Integer field of a client command (bools and floats are rejected)."""
+    v = cmd.get(key, default)
+    if type(v) is not int:
+        raise ValueError(f"{key} must be an integer")
+    return v
+
+
+class Frame:
+    __slots__ = ("tick", "time", "cars", "lights", "crashes")
+
+    def __init__(self, tick, time, cars, lights, crashes):
+        self.tick = tick
+        self.time = time
+        self.cars = cars        # {car_id: (x, y, angle)}
+        self.lights = lights    # (green, total_reward, penalties) per light index
+        self.crashes = crashes
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.every = 1
+        self.last_tick = None
+        self.pending = None
+        self.ready = asyncio.Event()
+        self.sent = None        # last frame delivered (delta base)
+        self.dropped = 0
+
+    def offer(self, frame):
+        if self.last_tick is not None and frame.tick - self.last_tick < self.every:
+            return
+        if self.pending is not None:
+            self.dropped += 1   # still sending an older frame: replace it
+        self.pending = frame
+        self.ready.set()
+
+    def encode(self, frame):
+        base = self.sent
+        if base is None:
+            msg = {
+                "type": "full", "tick": frame.tick, "time": round(frame.time, 3),
+                "cars": [[i, *p] for i, p in frame.cars.items()],
+                "lights": [[i, *l] for i, l in enumerate(frame.lights)],
+                "crashes": frame.crashes,
+            }
+        else:
+            old = base.cars
+            msg = {
+                "type": "delta", "tick": frame.tick, "time": round(frame.time, 3),
+                "cars": [[i, *p] for i, p in frame.cars.items() if old.get(i) != p],
+                "gone": [i for i in old if i not in frame.cars],
+                "lights": [[i, *l] for i, l in enumerate(frame.lights)
+                           if i >= len(base.lights) or base.lights[i] != l],
+            }
+            if frame.crashes != base.crashes:
+                msg["crashes"] = frame.crashes
+        self.sent = frame
+        self.last_tick = frame.tick
+        return (json.dumps(msg, separators=(",", ":")) + "\n").encode()
+
+
+class LiveServer:
+    """
+    Streams simulation state to TCP clients and queues their control commands.
+
+    Attach with Simulation(live=LiveServer(port)); the simulation calls
+    apply_commands() at each tick boundary and publish() after each tick.
+    """
+
+    def __init__(self, port=8765, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.commands = queue.SimpleQueue()
+        self.clients = set()
+        self.min_every = 1
+        self.n_lights = None    # light count of the attached simulation (known after its first tick)
+        self._latest = None
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="live-server", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if self.error is not None:
+            raise self.error
+
+    # -----------------------------
+    # SIMULATION THREAD
+    # -----------------------------
+    def publish(self, sim):
+        if not self.clients or sim.frame % self.min_every:
+            return
+        frame = Frame(
+            sim.frame, sim.sim_time,
+            {c.car_id: (_round(c.x), _round(c.y), _round(c.angle)) for c in sim.cars},
+            tuple(
+                (bool(tl.green), round(getattr(tl, "total_reward", 0), 2),
+                 {k: round(v, 2) for k, v in (getattr(tl, "penalties", None) or {}).items()})
+                for tl in sim.traffic_lights
+            ),
+            sim.episode_crashes,
+        )
+        with self._lock:
+            self._latest = frame
+            if self._scheduled:
+                return  # the loop has not picked up the previous frame yet: it takes this one
+            self._scheduled = True
+        self.loop.call_soon_threadsafe(self._dispatch)
+
+    def apply_commands(self, sim):
+        """
+        Run queued client commands (validated by the server thread; anything
+        that still does not apply is skipped). Returns False while the
+        simulation should not advance.
+        """
+        lights = sim.traffic_lights
+        self.n_lights = len(lights)
+        while True:
+            try:
+                cmd = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            name = cmd["cmd"]
+            if name == "pause":
+                sim.paused = True
+            elif name == "resume":
+                sim.paused = False
+                sim.step_ticks = 0
+            elif name == "step":
+                sim.step_ticks += cmd["ticks"]
+            elif name == "set_light":
+                if cmd["light"] < len(lights):
+                    tl = lights[cmd["light"]]
+                    tl.prev_green = tl.green
+                    tl.green = cmd["green"]
+                    tl.time_since_switch = 0
+            elif name == "set_tile":
+                try:
+                    sim.set_tile(cmd["tile"], cmd["code"])
+                except ValueError:
+                    pass  # off-map tile
+        if not sim.paused:
+            return True
+        if sim.step_ticks:
+            sim.step_ticks -= 1
+            return True
+        return False
+
+    def close(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._stop.set)
+        self.thread.join(timeout=2.0)
+
+    # -----------------------------
+    # SERVER THREAD
+    # -----------------------------
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        except Exception as exc:
+            self.error = exc
+            self._started.set()
+
+    async def _main(self):
+        self._stop = asyncio.Event()
+        self._tasks = set()
+        server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]  # resolves port=0
+        self._started.set()
+        async with server:
+            await self._stop.wait()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _dispatch(self):
+        with self._lock:
+            frame = self._latest
+            self._scheduled = False
+        for client in self.clients:
+            client.offer(frame)
+
+    def _update_rate(self):
+        self.min_every = min((c.every for c in self.clients), default=1)
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        self._tasks.add(asyncio.current_task())
+        sender = asyncio.ensure_future(self._send(client))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    cmd = json.loads(line)
+                    if not isinstance(cmd, dict):
+                        raise ValueError("command must be a JSON object")
+                    name = cmd.get("cmd")
+                    if name == "subscribe":
+                        client.every = max(1, _int(cmd, "every", 1))
+                        self._update_rate()
+                    else:
+                        self.commands.put(self._command(name, cmd))
+                except (ValueError, KeyError, TypeError) as exc:
+                    writer.write((json.dumps({"type": "error", "error": str(exc)}) + "\n").encode())
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            self._tasks.discard(asyncio.current_task())
+            self._update_rate()
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            writer.close()
+
+    def _command(self, name, cmd):
+        """Normalised copy of a control command; raises ValueError if it is malformed."""
+        if name in ("pause", "resume"):
+            return {"cmd": name}
+        if name == "step":
+            ticks = _int(cmd, "ticks", 1)
+            if ticks < 0:
+                raise ValueError("ticks must be >= 0")
+            return {"cmd": name, "ticks": ticks}
+        if name == "set_light":
+            light = _int(cmd, "light")
+            if light < 0 or (self.n_lights is not None and light >= self.n_lights):
+                raise ValueError(f"no light {light}")
+            green = cmd.get("green")
+            if not isinstance(green, bool):
+                raise ValueError("green must be true or false")
+            return {"cmd": name, "light": light, "green": green}
+        if name == "set_tile":
+            tile = cmd.get("tile")
+            if not isinstance(tile, list) or len(tile) != 2 or not all(type(v) is int for v in tile):
+                raise ValueError("tile must be [x, y]")
+            return {"cmd": name, "tile": (tile[0], tile[1]), "code": _int(cmd, "code")}
+        raise ValueError(f"unknown command {name!r}")
+
+    async def _send(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                frame, client.pending = client.pending, None
+                client.writer.write(client.encode(frame))
+                await client.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
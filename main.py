@@ -1,42 +1,65 @@
+import argparse
 import pygame
-from config import WIDTH, HEIGHT, FPS, BG, ROAD_MAP
-from grid import draw_map, draw_debug_paths
-from traffic_light import TrafficLight
+from config import WIDTH, HEIGHT, FPS, BG, ROAD_MAP, LIGHTS, TILE
+from grid import draw_map, draw_debug_paths, draw_heatmap
 from simulation import Simulation
-from utils import world_center
-from config import ROWS, COLS
+from map_loader import MapSpec, compile_map, load_compiled
+from recorder import TrajectoryRecorder
+from metrics import TripMetrics
+from profiler import Profiler
+from demand import DemandModel
+from live import LiveServer
+from heatmap import TileStats
+import map_edit
+
+parser = argparse.ArgumentParser(description="Traffic Simulation")
+parser.add_argument("--map", metavar="PATH",
+                    help="road map file (.csv, .json or .png); defaults to ROAD_MAP in config.py")
+parser.add_argument("--record", metavar="PATH",
+                    help="write per-tick car/light state to a trajectory file")
+parser.add_argument("--metrics", metavar="PATH",
+                    help="write trip and per-light KPI batches to a columnar file")
+parser.add_argument("--profile", action="store_true",
+                    help="time simulation phases (F3 toggles the on-screen overlay)")
+parser.add_argument("--profile-dump", metavar="PATH",
+                    help="append periodic JSON profile snapshots to PATH ('-' for stdout)")
+parser.add_argument("--profile-interval", type=float, default=5.0, metavar="SECONDS")
+parser.add_argument("--demand", metavar="PATH",
+                    help="JSON origin-destination demand periods (replaces the fixed-interval spawner)")
+parser.add_argument("--hybrid", action="store_true",
+                    help="advance free-flowing cars on plain links with the cheap link model")
+parser.add_argument("--live", type=int, metavar="PORT",
+                    help="stream state to dashboards and accept control commands on 127.0.0.1:PORT")
+parser.add_argument("--heatmap", action="store_true",
+                    help="collect per-tile congestion statistics (F4 toggles the overlay; requires numpy)")
+parser.add_argument("--heatmap-export", metavar="PATH",
+                    help="save the per-tile statistics to an .npz file on exit (implies --heatmap)")
+args = parser.parse_args()
 
 pygame.init()
 WIN = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Traffic Simulation")
 
-# Collect portals
-def collect_portals(grid):
-    portals = {}
-    for y, row in enumerate(grid):
-        for x, val in enumerate(row):
-            if val and val > 1:
-                portals.setdefault(val, []).append((x,y))
-    return portals
-
-PORTALS = collect_portals(ROAD_MAP)
-
-# Create traffic lights (same configuration as original script)
-TRAFFIC_LIGHTS = [
-    TrafficLight((1,0.5), light_id=7, start_green=True),
-    TrafficLight((1,4), light_id=7, start_green=True),
-    TrafficLight((0.5,3), light_id=7, start_green=False),
-    TrafficLight((3,2.5), light_id=7, start_green=False),
-]
-
-# Assign controlled tiles
-for tl in TRAFFIC_LIGHTS:
-    if tl.tile_pos == (2,2): tl.controlled_tiles = [(2,0)]
-    elif tl.tile_pos == (2,4): tl.controlled_tiles = [(2,6)]
-    elif tl.tile_pos == (1,3): tl.controlled_tiles = [(0,3)]
-    elif tl.tile_pos == (3,3): tl.controlled_tiles = [(4,3)]
+# Road map, portals and traffic lights (compiled artifact is cached per map file)
+if args.map:
+    MAP = load_compiled(args.map)
+else:
+    MAP = compile_map(MapSpec(ROAD_MAP, LIGHTS))
+GRID = MAP.grid
+PORTALS = MAP.portals
+TRAFFIC_LIGHTS = MAP.make_lights()
 
-simulation = Simulation(TRAFFIC_LIGHTS, PORTALS)
+recorder = TrajectoryRecorder(args.record) if args.record else None
+metrics = TripMetrics(args.metrics)  # in-memory only when no path is given
+profiler = None
+if args.profile or args.profile_dump:
+    profiler = Profiler(args.profile_dump, args.profile_interval, overlay=args.profile)
+heatmap = TileStats(MAP.rows, MAP.cols) if args.heatmap or args.heatmap_export else None
+show_heatmap = heatmap is not None
+simulation = Simulation(TRAFFIC_LIGHTS, PORTALS, recorder=recorder, metrics=metrics, profiler=profiler,
+                        grid=GRID, routes=MAP, hybrid=args.hybrid,
+                        demand=DemandModel.from_file(args.demand) if args.demand else None,
+                        live=LiveServer(args.live) if args.live else None, heatmap=heatmap)
 
 clock = pygame.time.Clock()
 running = True
@@ -51,14 +74,37 @@ while running:
         elif ev.type == pygame.KEYDOWN:
             if ev.key == pygame.K_ESCAPE:
                 running = False
+            elif ev.key == pygame.K_F3 and profiler is not None:
+                profiler.overlay = not profiler.overlay
+            elif ev.key == pygame.K_F4 and heatmap is not None:
+                show_heatmap = not show_heatmap
+        elif ev.type == pygame.MOUSEBUTTONDOWN and ev.button == 3:
+            # right click: close a road tile / reopen a closed one
+            tile = (ev.pos[0] // TILE, ev.pos[1] // TILE)
+            if tile in simulation.closed_tiles:
+                map_edit.open_tile(simulation, tile)
+            elif 0 <= tile[1] < len(GRID) and 0 <= tile[0] < len(GRID[0]) and GRID[tile[1]][tile[0]] != 0:
+                map_edit.close_tile(simulation, tile)
 
     simulation.update(dt)
 
     WIN.fill(BG)
-    draw_map(WIN)
+    draw_map(WIN, GRID, simulation.dirty_tiles)
+    simulation.dirty_tiles.clear()
+    if show_heatmap:
+        draw_heatmap(WIN, heatmap)
     draw_debug_paths(WIN, simulation.cars)
     simulation.draw(WIN)
 
     pygame.display.flip()
 
+if recorder is not None:
+    recorder.close()
+metrics.close()
+if profiler is not None:
+    profiler.close()
+if heatmap is not None and args.heatmap_export:
+    heatmap.save(args.heatmap_export)
+if simulation.live is not None:
+    simulation.live.close()
 pygame.quit()
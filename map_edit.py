@@ -0,0 +1,234 @@
+"""
+Runtime road edits: close or open tiles, change one-way codes, add portals.
+
+    map_edit.close_tile(sim, (12, 4))
+    map_edit.open_tile(sim, (12, 4))          # back to the code it had
+    map_edit.set_oneway(sim, (3, 7), "east")
+    map_edit.add_portal(sim, (0, 9), 7)
+    sim.set_tile((5, 5), -10)                 # any tile code
+
+An edit only touches what depends on the edited tile:
+
+  compiled map  masks and portal lists; precomputed routes are re-checked
+                lazily against the edit (CompiledMap.set_code)
+  route table   cached paths through the tile (and, if the edit opened a
+                move, the ones it could shorten) and their lane geometry
+  lanes         junction flags of the tile and its 4 neighbours; crossings
+                and link interaction points of routes through a tile whose
+                flag changed
+  cars          every car with the tile still ahead keeps its path up to
+                where it is and follows a new shortest path from there (one
+                reverse BFS per goal); cars that can no longer reach their
+                goal are taken off the map (counted by TripMetrics.record_stranded)
+  render        the tile is added to sim.dirty_tiles for grid.draw_map
+
+so the work is O(cars + cached routes) plus one BFS per affected goal (cut
+short once it has reached every car that needs it), and the edit is in
+effect from the next tick. The grid and compiled map are edited in place,
+except that a simulation sharing them with a fork (see Simulation.fork)
+first takes its own copy of them, its portals and its route table, so the
+other side keeps the old road. Partitioned runs do not support edits.
+"""
+import math
+
+from map_loader import tile_masks
+from pathfinding import DIRS4, bfs_tree_to
+
+ONEWAY_CODES = {"east": -1, "west": -2, "south": -3, "north": -4}
+
+
+def set_tile(sim, tile, code):
+    """Set one tile code on a running simulation; returns (rerouted, stranded) car counts."""
+    grid = sim.grid
+    x, y = tile
+    if not (0 <= y < len(grid) and 0 <= x < len(grid[0])):
+        raise ValueError(f"tile {tile} is off the map")
+    tile = (x, y)
+    old = grid[y][x]
+    if code == old:
+        return 0, 0
+    if sim.map_shared:
+        _unshare(sim)
+        grid = sim.grid
+
+    lanes = sim.lanes
+    area = [tile] + [(x + dx, y + dy) for dx, dy in DIRS4]
+    was_junction = {t: lanes.is_junction(t) for t in area}
+
+    # map and portals
+    compiled = sim.routes
+    if compiled is not None:
+        opened = compiled.set_code(tile, code)
+    else:
+        old_ex, old_en = tile_masks(old)
+        ex, en = tile_masks(code)
+        opened = bool(ex & ~old_ex or en & ~old_en)
+    grid[y][x] = code  # no-op when the grid is the compiled map's view
+    if compiled is None or sim.portals is not compiled.portals:
+        _move_portal(sim.portals, tile, old, code)
+    sim.portal_ids = list(sim.portals.keys())
+
+    # cached routes and lane geometry
+    table = sim.route_table
+    table.invalidate(tile, opened)
+    lanes.invalidate_tiles(area)
+    changed = [t for t in area if lanes.is_junction(t) != was_junction[t]]
+    if changed:
+        table.refresh(changed)
+        stale = {c.route.key for c in sim.cars if not c.route.tiles.isdisjoint(changed)}
+        # release while the old crossings are still cached (rebuilding them costs a route_crossings each)
+        for car in sim.cars:
+            if car.route.key in stale:
+                _release(sim, car)
+        if sim.junctions is not None:
+            sim.junctions.forget(stale)
+        if sim.meso is not None:
+            sim.meso.forget(stale)
+
+    # cars with the tile still ahead
+    ahead = []
+    starts = {}  # goal -> tiles a detour may leave from
+    for car in sim.cars:
+        route = car.route
+        if car.reached or tile not in route.tiles:
+            continue
+        i = car.tile_idx
+        try:
+            j = route.tile_path.index(tile, i + 1)
+        except ValueError:
+            continue  # only behind (or under) the car
+        ahead.append((car, i, j))
+        starts.setdefault(car.goal_tile, set()).update(route.tile_path[i:min(i + 2, j)])
+    trees = {goal: bfs_tree_to(goal, grid, tiles) for goal, tiles in starts.items()}
+
+    rerouted = 0
+    stranded = []
+    for car, i, j in ahead:
+        route = car.route
+        tree = trees[car.goal_tile]
+        # leave from the next tile if there is room to turn there, else from this one
+        new = table.detour(route, i + 1, tree) if j > i + 1 else None
+        if new is None:
+            new = table.detour(route, i, tree)
+        if new is None:
+            stranded.append(car)
+            continue
+        _switch_route(sim, car, new)
+        rerouted += 1
+
+    if stranded:
+        if sim.metrics is not None:
+            sim.metrics.record_stranded(sim.sim_time, len(stranded))
+        if sim.heatmap is not None:
+            sim.heatmap.forget(c.car_id for c in stranded)
+        gone = set(map(id, stranded))
+        for car in stranded:
+            _release(sim, car)
+            lanes.remove(car)
+            sim.occupancy.remove(car)
+            sim.pool.release(car)
+        sim.cars[:] = [c for c in sim.cars if id(c) not in gone]
+
+    sim.dirty_tiles.add(tile)
+    return rerouted, len(stranded)
+
+
+def close_tile(sim, tile):
+    """Close a road tile; open_tile restores its code."""
+    x, y = tile
+    code = sim.grid[y][x]
+    if code != 0:
+        sim.closed_tiles[(x, y)] = code
+    return set_tile(sim, tile, 0)
+
+
+def open_tile(sim, tile, code=None):
+    """Reopen a tile with the code it had before close_tile (plain two-way road otherwise)."""
+    if code is None:
+        code = sim.closed_tiles.pop((tile[0], tile[1]), 1)
+    return set_tile(sim, tile, code)
+
+
+def set_oneway(sim, tile, direction):
+    """Make a tile one-way ("east", "west", "south", "north") or two-way again (None)."""
+    if direction is None:
+        return set_tile(sim, tile, 1)
+    code = ONEWAY_CODES.get(direction)
+    if code is None:
+        raise ValueError(f"unknown one-way direction {direction!r}")
+    return set_tile(sim, tile, code)
+
+
+def add_portal(sim, tile, portal_id):
+    """Turn a tile into (another tile of) portal portal_id; cars spawn and despawn there."""
+    if portal_id <= 1:
+        raise ValueError("portal ids are tile codes > 1")
+    return set_tile(sim, tile, portal_id)
+
+
+# ============================================================
+# Internals
+# ============================================================
+def _unshare(sim):
+    """Copy-on-edit: give the simulation its own grid, compiled map, portals and route table."""
+    compiled = sim.routes
+    own = compiled.copy() if compiled is not None else None
+    if own is not None and sim.grid is compiled.grid:
+        grid = own.grid
+    else:
+        grid = [row[:] for row in sim.grid]
+    if own is not None and sim.portals is compiled.portals:
+        portals = own.portals
+    else:
+        portals = {pid: list(tiles) for pid, tiles in sim.portals.items()}
+    sim.routes, sim.grid, sim.portals = own, grid, portals
+    sim.lanes.grid = grid  # same codes, so its junction flags stay valid
+    sim.route_table = sim.route_table.copy(grid, own)
+    sim.map_shared = False
+
+
+def _move_portal(portals, tile, old, code):
+    if old > 1:
+        tiles = portals.get(old)
+        if tiles is not None and tile in tiles:
+            tiles.remove(tile)
+            if not tiles:
+                del portals[old]
+    if code > 1:
+        portals.setdefault(code, []).append(tile)
+
+
+def _release(sim, car):
+    """Drop what was derived from the car's route geometry (junction booking, link state)."""
+    if sim.junctions is not None:
+        sim.junctions.remove(car)
+    if car.meso:
+        sim.meso.promote(car)
+
+
+def _switch_route(sim, car, route):
+    _release(sim, car)
+    old = car.route.points
+    points = route.points
+    shared = 0
+    n = min(len(old), len(points))
+    while shared < n and old[shared] == points[shared]:
+        shared += 1
+    target = car.target_index
+    if target >= shared:
+        # the waypoint moved: take the first one of the new route past the
+        # car's arc position (both routes agree on it up to where they part)
+        tx, ty = old[target]
+        pos = car.route.cum_length[target] - math.hypot(tx - car.x, ty - car.y)
+        cum = route.cum_length
+        target = route.tile_starts[car.tile_idx]
+        while target < len(points) - 1 and cum[target] <= pos:
+            target += 1
+    car.route = route
+    car.tile_path = route.tile_path
+    car.path = points
+    car.target_index = target
+    car.light_idx = 0  # Car.update skips the lights already behind
+    sim.lanes.remove(car)
+    sim.lanes.insert(car)
+    sim.occupancy.update(car)
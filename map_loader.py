@@ -0,0 +1,492 @@
+"""
+Map files and compiled map artifacts.
+
+Supported sources (lights are declared in the same file):
+
+  .csv   one row of tile codes per line; '#' starts a comment;
+         "@light,x,y,green|red[,cx:cy ...][,id=N]" declares a light
+  .json  {"grid": [[...], ...], "lights": [{"tile": [x, y], "green": true,
+          "controlled": [[x, y], ...], "id": 7}, ...]}
+  .png   8-bit grayscale or palette image, one pixel per tile; the pixel
+         (palette index) is the tile code as a signed byte (246 = -10,
+         255 = -1 ...) unless a "traffic-map" tEXt chunk overrides it with
+         {"codes": {"<index>": code}}; the same chunk carries "lights".
+
+compile_map() turns a MapSpec into a CompiledMap (drivable mask, one-way
+exit/entry masks, portals, portal-to-portal routes, light index).
+load_compiled() caches that artifact under .map_cache/, keyed by the
+sha256 of the map file, so later startups skip parsing and routing.
+"""
+import hashlib
+import json
+import os
+import pickle
+import struct
+import zlib
+from array import array
+from collections import deque
+
+from pathfinding import DIRS4, allows_entry, allows_exit, collect_portals
+
+COMPILER_VERSION = 3
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".map_cache")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_META_KEY = b"traffic-map"
+
+
+class MapSpec:
+    def __init__(self, grid, lights=None, source=None):
+        self.grid = grid
+        self.lights = lights or []
+        self.source = source
+
+        widths = {len(row) for row in grid}
+        if not grid or len(widths) != 1:
+            raise ValueError(f"{source or 'map'}: grid must be a non-empty rectangle")
+
+
+# ============================================================
+# Parsers
+# ============================================================
+def _light(tile, green=True, controlled=None, light_id=None):
+    spec = {"tile": tuple(tile), "green": bool(green)}
+    if controlled:
+        spec["controlled"] = [tuple(t) for t in controlled]
+    if light_id is not None:
+        spec["id"] = int(light_id)
+    return spec
+
+
+def _number(tok):
+    v = float(tok)
+    return int(v) if v.is_integer() else v
+
+
+def parse_csv(text, source=None):
+    grid = []
+    lights = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        fields = [f.strip() for f in line.split(",") if f.strip()]
+        if fields[0].lower() == "@light":
+            if len(fields) < 3:
+                raise ValueError(f"{source}:{lineno}: @light needs x,y")
+            green = True
+            controlled = []
+            light_id = None
+            for tok in fields[3:]:
+                low = tok.lower()
+                if low in ("green", "red"):
+                    green = low == "green"
+                elif low.startswith("id="):
+                    light_id = int(tok[3:])
+                elif ":" in tok:
+                    cx, cy = tok.split(":")
+                    controlled.append((int(cx), int(cy)))
+                else:
+                    raise ValueError(f"{source}:{lineno}: bad @light field {tok!r}")
+            lights.append(_light((_number(fields[1]), _number(fields[2])), green, controlled, light_id))
+            continue
+        grid.append([int(v) for v in fields])
+    return MapSpec(grid, lights, source)
+
+
+def parse_json(text, source=None):
+    data = json.loads(text)
+    lights = [
+        _light(l["tile"], l.get("green", True), l.get("controlled"), l.get("id"))
+        for l in data.get("lights", [])
+    ]
+    return MapSpec([list(map(int, row)) for row in data["grid"]], lights, source)
+
+
+def _png_chunks(data):
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, ctype = struct.unpack(">I4s", data[pos:pos + 8])
+        yield ctype, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _unfilter(raw, width, height):
+    """Undo PNG scanline filters for 1 byte per pixel."""
+    out = bytearray(width * height)
+    prev = bytearray(width)
+    pos = 0
+    for y in range(height):
+        ftype = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + width])
+        pos += 1 + width
+        if ftype == 1:      # Sub
+            for i in range(1, width):
+                line[i] = (line[i] + line[i - 1]) & 0xFF
+        elif ftype == 2:    # Up
+            line = bytearray((a + b) & 0xFF for a, b in zip(line, prev))
+        elif ftype == 3:    # Average
+            for i in range(width):
+                left = line[i - 1] if i else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:    # Paeth
+            for i in range(width):
+                a = line[i - 1] if i else 0
+                b = prev[i]
+                c = prev[i - 1] if i else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                line[i] = (line[i] + pred) & 0xFF
+        elif ftype != 0:
+            raise ValueError(f"bad PNG filter type {ftype}")
+        out[y * width:(y + 1) * width] = line
+        prev = line
+    return out
+
+
+def parse_png(data, source=None):
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError(f"{source}: not a PNG file")
+    header = None
+    idat = []
+    meta = {}
+    for ctype, body in _png_chunks(data):
+        if ctype == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif ctype == b"IDAT":
+            idat.append(body)
+        elif ctype == b"tEXt":
+            key, _, val = body.partition(b"\0")
+            if key == PNG_META_KEY:
+                meta = json.loads(val.decode("latin-1"))
+        elif ctype == b"zTXt":
+            key, _, rest = body.partition(b"\0")
+            if key == PNG_META_KEY:
+                meta = json.loads(zlib.decompress(rest[1:]).decode("latin-1"))
+
+    if header is None:
+        raise ValueError(f"{source}: PNG without IHDR")
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or color_type not in (0, 3) or interlace:
+        raise ValueError(f"{source}: map images must be 8-bit grayscale/palette, non-interlaced")
+
+    pixels = _unfilter(zlib.decompress(b"".join(idat)), width, height)
+    codes = [i if i < 128 else i - 256 for i in range(256)]
+    for idx, code in meta.get("codes", {}).items():
+        codes[int(idx)] = int(code)
+
+    grid = [[codes[p] for p in pixels[y * width:(y + 1) * width]] for y in range(height)]
+    lights = [
+        _light(l["tile"], l.get("green", True), l.get("controlled"), l.get("id"))
+        for l in meta.get("lights", [])
+    ]
+    return MapSpec(grid, lights, source)
+
+
+def write_png(path, spec):
+    """Write a MapSpec as an 8-bit grayscale map image (signed-byte tile codes)."""
+    rows = len(spec.grid)
+    cols = len(spec.grid[0])
+    raw = bytearray()
+    for row in spec.grid:
+        raw.append(0)
+        raw.extend(v & 0xFF for v in row)
+
+    def chunk(ctype, body):
+        return struct.pack(">I", len(body)) + ctype + body + struct.pack(">I", zlib.crc32(ctype + body))
+
+    meta = json.dumps({"lights": spec.lights}).encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(PNG_SIGNATURE)
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", cols, rows, 8, 0, 0, 0, 0)))
+        f.write(chunk(b"tEXt", PNG_META_KEY + b"\0" + meta))
+        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 9)))
+        f.write(chunk(b"IEND", b""))
+
+
+def parse_map(data, source):
+    ext = os.path.splitext(source)[1].lower()
+    if ext == ".csv":
+        return parse_csv(data.decode("utf-8"), source)
+    if ext == ".json":
+        return parse_json(data.decode("utf-8"), source)
+    if ext == ".png":
+        return parse_png(data, source)
+    raise ValueError(f"{source}: unsupported map format {ext!r} (use .csv, .json or .png)")
+
+
+def load_map(path):
+    with open(path, "rb") as f:
+        return parse_map(f.read(), path)
+
+
+# ============================================================
+# Compiled map
+# ============================================================
+class CompiledMap:
+    """
+    Flat, precomputed view of a road map. Tiles are indexed i = y * cols + x.
+
+      codes      array('h')  raw tile codes
+      drivable   bytearray   1 if drivable
+      exits      bytearray   bit d set if leaving the tile along DIRS4[d] is allowed
+      entries    bytearray   bit d set if entering the tile along DIRS4[d] is allowed
+      portals    {portal id: [(x, y), ...]}
+      routes     {(start_tile, goal_tile): bytes of DIRS4 indices} between portal tiles
+      lights     light specs (see MapSpec)
+      light_index {controlled tile: light number}
+      edits      [(tile, opened)] runtime edits (see set_code)
+    """
+
+    def __init__(self, rows, cols, codes, drivable, exits, entries, portals, routes, lights, light_index):
+        self.rows = rows
+        self.cols = cols
+        self.codes = codes
+        self.drivable = drivable
+        self.exits = exits
+        self.entries = entries
+        self.portals = portals
+        self.routes = routes
+        self.lights = lights
+        self.light_index = light_index
+        self.edits = []  # (tile, opened a move) per runtime edit, in order
+        self._grid = None
+        self._decoded = {}
+
+    @property
+    def grid(self):
+        """List-of-rows view used by the simulation core (built once)."""
+        if self._grid is None:
+            cols = self.cols
+            codes = self.codes
+            self._grid = [codes[y * cols:(y + 1) * cols].tolist() for y in range(self.rows)]
+        return self._grid
+
+    def route(self, start, goal):
+        """
+        Tile path between two portal tiles, or None if not precompiled /
+        unreachable / possibly no longer shortest after a runtime edit.
+        """
+        key = (start, goal)
+        cached = self._decoded.get(key)
+        if cached is not None and cached[1] == len(self.edits):
+            return cached[0]
+        if cached is None:
+            steps = self.routes.get(key)
+            if steps is None:
+                return None
+            x, y = start
+            path = [(x, y)]
+            for d in steps:
+                dx, dy = DIRS4[d]
+                x += dx
+                y += dy
+                path.append((x, y))
+            checked = 0
+        else:
+            path, checked = cached
+        if not self._still_valid(key, path, checked):
+            del self.routes[key]
+            self._decoded.pop(key, None)
+            return None
+        self._decoded[key] = (path, len(self.edits))
+        return path
+
+    def make_lights(self):
+        from traffic_light import TrafficLight
+
+        lights = []
+        for i, spec in enumerate(self.lights):
+            tl = TrafficLight(tuple(spec["tile"]), light_id=spec.get("id", i), start_green=spec.get("green", True))
+            if spec.get("controlled"):
+                tl.controlled_tiles = [tuple(t) for t in spec["controlled"]]
+            lights.append(tl)
+        return lights
+
+    # -----------------------------
+    # RUNTIME EDITS
+    # -----------------------------
+    def copy(self):
+        """Copy that can be edited independently (light specs are shared)."""
+        other = CompiledMap(
+            self.rows, self.cols, array("h", self.codes), bytearray(self.drivable),
+            bytearray(self.exits), bytearray(self.entries),
+            {pid: list(tiles) for pid, tiles in self.portals.items()},
+            dict(self.routes), self.lights, self.light_index,
+        )
+        other.edits = list(self.edits)
+        other._decoded = dict(self._decoded)
+        return other
+
+    # Precomputed routes are checked lazily: route() replays the edits made
+    # since a path was last handed out, so an edit costs O(1) here however
+    # many routes the map has.
+    def set_code(self, tile, code):
+        """
+        Change one tile code (masks, portals, grid view). Returns True if the
+        edit allowed a move that was not allowed before (routes may shorten).
+        """
+        x, y = tile
+        i = y * self.cols + x
+        old = self.codes[i]
+        old_ex, old_en = self.exits[i], self.entries[i]
+        ex, en = tile_masks(code)
+        self.codes[i] = code
+        self.drivable[i] = 1 if code != 0 else 0
+        self.exits[i], self.entries[i] = ex, en
+        if self._grid is not None:
+            self._grid[y][x] = code
+
+        if old > 1:
+            tiles = self.portals.get(old)
+            if tiles is not None and tile in tiles:
+                tiles.remove(tile)
+                if not tiles:
+                    del self.portals[old]
+        if code > 1:
+            self.portals.setdefault(code, []).append(tile)
+
+        opened = bool(ex & ~old_ex or en & ~old_en)
+        self.edits.append((tile, opened))
+        return opened
+
+    def _still_valid(self, key, path, checked):
+        """False if an edit after the first `checked` ones touched the path or could shorten it."""
+        (sx, sy), (gx, gy) = key
+        n = len(path) - 1
+        tiles = None
+        for tile, opened in self.edits[checked:]:
+            tx, ty = tile
+            if opened and abs(sx - tx) + abs(sy - ty) + abs(gx - tx) + abs(gy - ty) < n:
+                return False
+            if tiles is None:
+                tiles = set(path)
+            if tile in tiles:
+                return False
+        return True
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_grid"] = None
+        state["_decoded"] = {}
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("edits", [])  # artifacts cached before runtime edits existed
+        self.__dict__.update(state)
+
+
+def tile_masks(code):
+    """(exit mask, entry mask) of a tile code: bit d set if moving along DIRS4[d] is allowed."""
+    if code == 0:
+        return 0, 0
+    ex = en = 0
+    for d, (dx, dy) in enumerate(DIRS4):
+        if allows_exit(code, dx, dy):
+            ex |= 1 << d
+        if allows_entry(code, dx, dy):
+            en |= 1 << d
+    return ex, en
+
+
+def _bfs_parents(start, cols, rows, drivable, exits, entries):
+    parent = array("i", [-1]) * (rows * cols)
+    pdir = bytearray(rows * cols)
+    s = start[1] * cols + start[0]
+    parent[s] = s
+    q = deque([s])
+    steps = [(d, dx, dy) for d, (dx, dy) in enumerate(DIRS4)]
+    while q:
+        i = q.popleft()
+        cy, cx = divmod(i, cols)
+        ex = exits[i]
+        for d, dx, dy in steps:
+            if not ex >> d & 1:
+                continue
+            nx, ny = cx + dx, cy + dy
+            if not (0 <= nx < cols and 0 <= ny < rows):
+                continue
+            j = ny * cols + nx
+            if parent[j] != -1 or not drivable[j] or not entries[j] >> d & 1:
+                continue
+            parent[j] = i
+            pdir[j] = d
+            q.append(j)
+    return parent, pdir
+
+
+def compile_map(spec):
+    grid = spec.grid
+    rows, cols = len(grid), len(grid[0])
+    codes = array("h", (v for row in grid for v in row))
+    drivable = bytearray(1 if v != 0 else 0 for v in codes)
+
+    exits = bytearray(rows * cols)
+    entries = bytearray(rows * cols)
+    for i, v in enumerate(codes):
+        exits[i], entries[i] = tile_masks(v)
+
+    portals = collect_portals(grid)
+    tiles = [(pid, t) for pid, ts in portals.items() for t in ts]
+
+    # one BFS per portal tile gives routes to every other portal tile
+    routes = {}
+    for pid, start in tiles:
+        parent, pdir = _bfs_parents(start, cols, rows, drivable, exits, entries)
+        s = start[1] * cols + start[0]
+        for gid, goal in tiles:
+            if gid == pid:
+                continue
+            g = goal[1] * cols + goal[0]
+            if parent[g] == -1:
+                continue
+            dirs = bytearray()
+            j = g
+            while j != s:
+                dirs.append(pdir[j])
+                j = parent[j]
+            dirs.reverse()
+            routes[(start, goal)] = bytes(dirs)
+
+    light_index = {}
+    for n, l in enumerate(spec.lights):
+        for t in l.get("controlled", [l["tile"]]):
+            light_index[tuple(t)] = n
+
+    return CompiledMap(rows, cols, codes, drivable, exits, entries, portals, routes, list(spec.lights), light_index)
+
+
+# ============================================================
+# Cache
+# ============================================================
+def content_key(data):
+    h = hashlib.sha256()
+    h.update(f"traffic-map/{COMPILER_VERSION}\0".encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+def load_compiled(path, cache_dir=CACHE_DIR):
+    """Load a map file, reusing the compiled artifact when its content hash matches."""
+    with open(path, "rb") as f:
+        data = f.read()
+    key = content_key(data)
+    cache_path = os.path.join(cache_dir, key + ".pickle") if cache_dir else None
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass  # stale or truncated artifact: rebuild below
+
+    compiled = compile_map(parse_map(data, path))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    return compiled
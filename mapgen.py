@@ -0,0 +1,133 @@
+import random
+
+# ============================================================
+# Synthetic road networks (benchmarks / stress tests)
+# ============================================================
+# Every generator returns (grid, lights):
+#   grid   : list of rows using the ROAD_MAP encoding (see pathfinding.py)
+#   lights : list of {"tile": (x, y), "controlled": [(x, y), ...], "green": bool}
+#
+# Portals are one-tile stubs on the map border, numbered from 2 upwards,
+# each with a light on the road tile it feeds into (same layout as main.py).
+
+ROAD = 1
+ROAD_2LANE = -10
+ONEWAY_E, ONEWAY_W, ONEWAY_S, ONEWAY_N = -1, -2, -3, -4
+
+
+def _empty(cols, rows):
+    return [[0] * cols for _ in range(rows)]
+
+
+def _add_border_portals(grid, every=1, rng=None):
+    """Turn road ends on the (empty) outer ring into portal stubs."""
+    rows, cols = len(grid), len(grid[0])
+    lights = []
+    pid = 2
+
+    def road(x, y):
+        return 0 <= x < cols and 0 <= y < rows and grid[y][x] != 0
+
+    # only roads that run into the border get a stub, not roads running along it
+    candidates = []
+    for x in range(1, cols - 1):
+        if road(x, 1) and road(x, 2):
+            candidates.append(((x, 0), (x, 1)))
+        if road(x, rows - 2) and road(x, rows - 3):
+            candidates.append(((x, rows - 1), (x, rows - 2)))
+    for y in range(1, rows - 1):
+        if road(1, y) and road(2, y):
+            candidates.append(((0, y), (1, y)))
+        if road(cols - 2, y) and road(cols - 3, y):
+            candidates.append(((cols - 1, y), (cols - 2, y)))
+
+    placed = set()
+    for i, (portal, inner) in enumerate(candidates):
+        if i % every:
+            continue
+        px, py = portal
+        # adjacent stubs (e.g. the ends of a one-way pair) would let routes hop
+        # portal-to-portal and merge sideways into the other road
+        if any((px + dx, py + dy) in placed for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))):
+            continue
+        placed.add(portal)
+        grid[py][px] = pid
+        pid += 1
+        green = rng.random() < 0.5 if rng is not None else bool(i % 2)
+        lights.append({"tile": inner, "controlled": [portal], "green": green})
+    return lights
+
+
+def grid_city(blocks_x=4, blocks_y=4, block=2, two_lane_every=0, portal_every=1, seed=0):
+    """
+    Manhattan grid: roads every (block + 1) tiles, a one-tile empty margin
+    around the city for portal stubs. `two_lane_every=n` makes every n-th
+    road a 2-lane road (-10).
+    """
+    rng = random.Random(seed)
+    step = block + 1
+    inner_w = blocks_x * step + 1
+    inner_h = blocks_y * step + 1
+    grid = _empty(inner_w + 2, inner_h + 2)
+
+    for j in range(blocks_y + 1):
+        y = 1 + j * step
+        val = ROAD_2LANE if two_lane_every and j % two_lane_every == 0 else ROAD
+        for x in range(1, inner_w + 1):
+            grid[y][x] = val
+    for i in range(blocks_x + 1):
+        x = 1 + i * step
+        val = ROAD_2LANE if two_lane_every and i % two_lane_every == 0 else ROAD
+        for y in range(1, inner_h + 1):
+            if grid[y][x] == 0:
+                grid[y][x] = val
+            else:
+                grid[y][x] = ROAD  # junctions stay plain two-way tiles
+
+    lights = _add_border_portals(grid, every=portal_every, rng=rng)
+    return grid, lights
+
+
+def arterial_city(length=24, pairs=2, spacing=4, pair_gap=5, seed=0):
+    """
+    Horizontal one-way pairs (eastbound row above a westbound row) crossed by
+    two-way streets every `spacing` columns. Junction tiles are two-way so
+    cars can turn between the arterials and the cross streets.
+    """
+    rng = random.Random(seed)
+    inner_h = pairs * pair_gap + 1
+    grid = _empty(length + 2, inner_h + 2)
+
+    for p in range(pairs):
+        y = 1 + p * pair_gap + 1
+        for x in range(1, length + 1):
+            grid[y][x] = ONEWAY_E
+            grid[y + 1][x] = ONEWAY_W
+
+    for x in range(1, length + 1, spacing):
+        for y in range(1, inner_h + 1):
+            grid[y][x] = ROAD
+
+    lights = _add_border_portals(grid, rng=rng)
+    return grid, lights
+
+
+def multi_portal_city(blocks=8, block=2, seed=0):
+    """Large grid with a portal stub on every road end and every 3rd road 2-lane."""
+    return grid_city(blocks, blocks, block=block, two_lane_every=3, portal_every=1, seed=seed)
+
+
+GENERATORS = {
+    "grid-small": lambda seed=0: grid_city(3, 3, seed=seed),
+    "grid-medium": lambda seed=0: grid_city(8, 8, seed=seed),
+    "grid-large": lambda seed=0: grid_city(20, 20, seed=seed),
+    "arterial": lambda seed=0: arterial_city(40, 3, seed=seed),
+    "multi-portal": lambda seed=0: multi_portal_city(12, seed=seed),
+}
+
+
+def generate(name, seed=0):
+    try:
+        return GENERATORS[name](seed=seed)
+    except KeyError:
+        raise ValueError(f"unknown map {name!r}; choose from {', '.join(GENERATORS)}") from None
@@ -0,0 +1,136 @@
+import math
+from bisect import bisect_right
+
+from config import TILE
+from intersections import route_crossings
+
+# ============================================================
+# Hybrid mesoscopic mode
+# ============================================================
+# A free-flowing car on a plain link (no junction, light or route end within
+# reach, no leader close ahead) is demoted to the link model: it keeps its
+# lane queue slot and simply slides along its route polyline at its cruise
+# speed, skipping lights, raycasts, IDM and junction gates. It is promoted
+# back to full Car.update physics a fixed distance before the next
+# interaction point, or as soon as it closes on a leader.
+#
+# Cars never leave Simulation.cars, so the switch conserves vehicles and
+# followers still see meso cars as lane leaders.
+
+PROMOTE_DISTANCE = 1.25 * TILE # px before a junction/light/route end where cars go micro (> booking range)
+MIN_LINK = 0.5 * TILE          # shortest meso stretch worth demoting for
+FREE_GAP = 2 * TILE            # leader headway required to demote
+PROMOTE_GAP = TILE             # leader headway below which a meso car goes micro
+CRUISE_FRACTION = 0.75         # demote only above this share of max speed (drag caps cruise near 0.85)
+
+
+class MesoModel:
+    def __init__(self, lanes, junctions=None):
+        self.lanes = lanes
+        self.junctions = junctions
+        self._points = {}  # route key -> sorted arc positions of interaction points
+        self._runs = {}    # junction run samples (used without an intersection manager)
+        self.demoted = 0
+        self.promoted = 0
+
+    def interaction_points(self, route):
+        pts = self._points.get(route.key)
+        if pts is None:
+            if self.junctions is not None:
+                crossings = self.junctions.crossings(route)
+            else:
+                crossings = route_crossings(route, self.lanes.is_junction, self._runs)
+            pts = [c.s_in for c in crossings]
+            pts.extend(s for s, _ in route.lights)
+            pts.append(route.length)
+            pts.sort()
+            self._points[route.key] = pts
+        return pts
+
+    def invalidate_map(self):
+        self._points.clear()
+        self._runs.clear()
+
+    def forget(self, keys):
+        for key in keys:
+            self._points.pop(key, None)
+
+    # -----------------------------
+    # MICRO -> MESO
+    # -----------------------------
+    def try_demote(self, car):
+        if car.reached or car.speed < car.max_speed * CRUISE_FRACTION:
+            return False
+        if car.control_light is not None and not car.has_cleared_light:
+            return False
+        if self.junctions is not None:
+            b = self.junctions.bookings.get(car)
+            if b is not None and (b.inside or b.keys):
+                return False
+        lanes = self.lanes
+        if car.lane_key is None or lanes.raycast_only:
+            return False
+
+        route = car.route
+        ti = car.target_index
+        if ti < 1 or ti >= len(route.points):
+            return False
+        tx, ty = route.points[ti]
+        pos = route.cum_length[ti] - math.hypot(tx - car.x, ty - car.y)
+
+        pts = self.interaction_points(route)
+        end = pts[bisect_right(pts, pos)] - PROMOTE_DISTANCE if pos < pts[-1] else pos
+        if end - pos < MIN_LINK:
+            return False
+
+        lead = lanes.leader(car)
+        if lead is not None and lanes.headway(car, lead) < FREE_GAP:
+            return False
+
+        car.meso = True
+        car.meso_pos = pos
+        car.meso_end = end
+        self.demoted += 1
+        return True
+
+    # -----------------------------
+    # MESO STEP
+    # -----------------------------
+    def promote(self, car):
+        """Back to full Car.update physics (also used when its route changes under it)."""
+        car.meso = False
+        car.prev_dir = (0, 0)  # heading was not tracked on the link; avoid a phantom turn
+        self.promoted += 1
+
+    def advance(self, car, dt):
+        """Move a meso car along its link; returns False if it was promoted instead."""
+        lanes = self.lanes
+        lead = lanes.leader(car)
+        if lead is not None and lanes.headway(car, lead) < PROMOTE_GAP:
+            self.promote(car)
+            return False
+
+        pos = car.meso_pos + car.speed * dt
+        if pos >= car.meso_end:
+            pos = car.meso_end
+            self.promote(car)
+        car.meso_pos = pos
+
+        # place the car on the polyline at arc length pos
+        route = car.route
+        cum = route.cum_length
+        points = route.points
+        ti = car.target_index
+        while ti < len(points) - 1 and cum[ti] <= pos:
+            ti += 1
+        car.target_index = ti
+        (ax, ay), (bx, by) = points[ti - 1], points[ti]
+        seg = cum[ti] - cum[ti - 1]
+        f = (pos - cum[ti - 1]) / seg if seg > 0 else 1.0
+        f = max(0.0, min(1.0, f))
+        car.x = ax + (bx - ax) * f
+        car.y = ay + (by - ay) * f
+        car.angle = math.degrees(math.atan2(by - ay, bx - ax))
+
+        lanes.advance(car)
+        return True
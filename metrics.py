@@ -0,0 +1,289 @@
+import json
+import math
+import struct
+from array import array
+from collections import deque
+
+from writer import BackgroundWriter
+
+# ============================================================
+# Columnar batch file
+# ============================================================
+# magic line, then any number of batches:
+#   u32 header length | JSON header | column 0 bytes | column 1 bytes | ...
+# header = {"table": str, "rows": int, "columns": [[name, typecode, nbytes], ...]}
+# typecodes are `array` module codes ("q" int64, "d" float64, "i" int32).
+MAGIC = b"TCOL1\n"
+_LEN = struct.Struct("<I")
+
+TRIP_COLUMNS = [
+    ("car_id", "q"),
+    ("spawn_time", "d"),
+    ("arrival_time", "d"),
+    ("travel_time", "d"),
+    ("route_length", "d"),
+    ("stop_time", "d"),
+    ("light_wait", "d"),
+    ("tiles", "q"),            # number of tiles in the path
+    ("path_offset", "q"),      # start of this trip's tiles in path_x/path_y
+]
+
+# light batches hold per-light increments since the previous batch (sum by light for totals)
+LIGHT_COLUMNS = [
+    ("time", "d"),             # simulation time the batch was cut
+    ("light", "q"),
+    ("throughput", "q"),
+    ("total_delay", "d"),
+    ("mean_delay", "d"),
+]
+
+
+def encode_batch(table, columns, values):
+    """values: dict name -> array; extra arrays (e.g. path_x) are appended as columns."""
+    header_cols = []
+    blobs = []
+    for name, code in columns:
+        arr = values[name]
+        if not isinstance(arr, array):
+            arr = array(code, arr)
+        data = arr.tobytes()
+        header_cols.append([name, arr.typecode, len(data)])
+        blobs.append(data)
+    rows = len(values[columns[0][0]]) if columns else 0
+    header = json.dumps({"table": table, "rows": rows, "columns": header_cols}).encode()
+    return _LEN.pack(len(header)) + header + b"".join(blobs)
+
+
+def read_batches(path):
+    """Yield (table, {column: array}) for every batch in a columnar metrics file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a metrics file")
+        while True:
+            raw = f.read(_LEN.size)
+            if len(raw) < _LEN.size:
+                return
+            header = json.loads(f.read(_LEN.unpack(raw)[0]))
+            cols = {}
+            for name, code, nbytes in header["columns"]:
+                arr = array(code)
+                arr.frombytes(f.read(nbytes))
+                cols[name] = arr
+            yield header["table"], cols
+
+
+def load_table(path, table):
+    """Concatenate every batch of one table; trip tile paths are re-based onto the merged arrays."""
+    merged = {}
+    for name, cols in read_batches(path):
+        if name != table:
+            continue
+        if "path_offset" in cols and "path_x" in merged:
+            base = len(merged["path_x"])
+            cols["path_offset"] = array("q", (o + base for o in cols["path_offset"]))
+        for col, arr in cols.items():
+            if col in merged:
+                merged[col].extend(arr)
+            else:
+                merged[col] = arr
+    return merged
+
+
+# ============================================================
+# In-memory aggregates
+# ============================================================
+class LightStats:
+    def __init__(self, name):
+        self.name = name
+        self.throughput = 0
+        self.total_delay = 0.0
+
+    @property
+    def mean_delay(self):
+        return self.total_delay / self.throughput if self.throughput else 0.0
+
+
+def route_length(points):
+    total = 0.0
+    for i in range(1, len(points)):
+        (ax, ay), (bx, by) = points[i - 1], points[i]
+        total += math.hypot(bx - ax, by - ay)
+    return total
+
+
+class TripMetrics:
+    """
+    Collects a trip record for every car that reaches its goal, per-light
+    throughput/delay aggregates and rolling-window summaries.
+
+    A trip counts towards the throughput of every light its route passes
+    and towards the delay of each light it waited at. Cars taken off the map
+    because a road edit left them no way to their goal are only counted.
+
+    If `path` is given, trips and per-light increments are written as
+    columnar batches of `batch_rows` trips by a background thread, so
+    recording never stalls a tick.
+    """
+
+    def __init__(self, path=None, batch_rows=1024, window=60.0, start=0.0):
+        self.batch_rows = batch_rows
+        self.window = window
+        self.start = start        # simulation time recording started
+        self.now = start          # latest time seen
+        self.pending = []
+        self.lights = {}          # light index -> LightStats
+        self.light_delta = {}     # light index -> [throughput, delay] not yet written
+        self.recent = deque()     # (arrival_time, travel_time, stop_time)
+        self.recent_crashes = deque()
+        self.total_trips = 0
+        self.total_crashes = 0
+        self.total_stranded = 0   # cars removed by map edits (see map_edit.py)
+
+        self.writer = None
+        if path is not None:
+            self.writer = BackgroundWriter(path, self._encode, mode="wb", name="metrics-writer")
+            self.writer.write_now(MAGIC)
+
+    # -----------------------------
+    # RECORDING (simulation thread)
+    # -----------------------------
+    def _light(self, idx, tl):
+        stats = self.lights.get(idx)
+        if stats is None:
+            stats = self.lights[idx] = LightStats(getattr(tl, "name", "?"))
+        return stats
+
+    def record_trip(self, car, now):
+        travel = now - car.spawn_time
+        self.total_trips += 1
+        self.now = now
+        self.recent.append((now, travel, car.stop_time))
+
+        lights = car.traffic_lights
+        track = self.writer is not None
+        delta = self.light_delta
+        passed = set()
+        for _, idx in car.route.lights:
+            if idx in passed:
+                continue  # several stop points of one light along the route
+            passed.add(idx)
+            self._light(idx, lights[idx]).throughput += 1
+            if track:
+                d = delta.get(idx)
+                if d is None:
+                    d = delta[idx] = [0, 0.0]
+                d[0] += 1
+        for idx, wait in car.light_waits:
+            self._light(idx, lights[idx]).total_delay += wait
+            if track:
+                d = delta.get(idx)
+                if d is None:
+                    d = delta[idx] = [0, 0.0]
+                d[1] += wait
+
+        if self.writer is not None:
+            # keep only references here; the writer thread does the number crunching
+            self.pending.append((car.car_id, car.spawn_time, now, car.stop_time,
+                                 car.light_wait, car.path, car.tile_path))
+            if len(self.pending) >= self.batch_rows:
+                self._hand_off()
+
+        self._trim(now)
+
+    def record_crash(self, now):
+        self.total_crashes += 1
+        self.now = now
+        self.recent_crashes.append(now)
+        self._trim(now)
+
+    def record_stranded(self, now, n=1):
+        self.total_stranded += n
+        self.now = now
+
+    def _trim(self, now):
+        cutoff = now - self.window
+        while self.recent and self.recent[0][0] < cutoff:
+            self.recent.popleft()
+        while self.recent_crashes and self.recent_crashes[0] < cutoff:
+            self.recent_crashes.popleft()
+
+    def _hand_off(self):
+        if self.pending:
+            self.writer.submit(("trips", self.pending))
+            self.pending = []
+        if self.light_delta:
+            rows = [(idx, n, delay) for idx, (n, delay) in sorted(self.light_delta.items())]
+            self.writer.submit(("lights", (self.now, rows)))
+            self.light_delta = {}
+
+    # -----------------------------
+    # SUMMARIES
+    # -----------------------------
+    def summary(self, now=None):
+        if now is not None:
+            self.now = max(self.now, now)
+            self._trim(now)
+        n = len(self.recent)
+        travel = sorted(t for _, t, _ in self.recent)
+        span = min(self.window, self.now - self.start)  # the first window is still filling
+        return {
+            "window": self.window,
+            "trips": n,
+            "throughput_per_min": n * 60.0 / span if span > 0 else 0.0,
+            "mean_travel_time": sum(travel) / n if n else 0.0,
+            "p95_travel_time": travel[min(n - 1, int(n * 0.95))] if n else 0.0,
+            "mean_stop_time": sum(s for _, _, s in self.recent) / n if n else 0.0,
+            "crashes": len(self.recent_crashes),
+            "total_trips": self.total_trips,
+            "total_crashes": self.total_crashes,
+            "total_stranded": self.total_stranded,
+        }
+
+    def light_summary(self):
+        """{light index: KPIs} (names need not be unique)."""
+        return {
+            idx: {"name": s.name, "throughput": s.throughput, "total_delay": s.total_delay, "mean_delay": s.mean_delay}
+            for idx, s in sorted(self.lights.items())
+        }
+
+    # -----------------------------
+    # ENCODING (writer thread)
+    # -----------------------------
+    def _encode(self, item):
+        table, rows = item
+        if table == "lights":
+            now, rows = rows
+            cols = {name: array(code) for name, code in LIGHT_COLUMNS}
+            for i, throughput, total_delay in rows:
+                cols["time"].append(now)
+                cols["light"].append(i)
+                cols["throughput"].append(throughput)
+                cols["total_delay"].append(total_delay)
+                cols["mean_delay"].append(total_delay / throughput if throughput else 0.0)
+            return encode_batch("lights", LIGHT_COLUMNS, cols)
+
+        cols = {name: array(code) for name, code in TRIP_COLUMNS}
+        path_x = array("i")
+        path_y = array("i")
+        for car_id, spawn, arrival, stop, wait, points, tile_path in rows:
+            cols["car_id"].append(car_id)
+            cols["spawn_time"].append(spawn)
+            cols["arrival_time"].append(arrival)
+            cols["travel_time"].append(arrival - spawn)
+            cols["route_length"].append(route_length(points))
+            cols["stop_time"].append(stop)
+            cols["light_wait"].append(wait)
+            cols["tiles"].append(len(tile_path))
+            cols["path_offset"].append(len(path_x))
+            for tx, ty in tile_path:
+                path_x.append(tx)
+                path_y.append(ty)
+        cols["path_x"] = path_x
+        cols["path_y"] = path_y
+        return encode_batch("trips", TRIP_COLUMNS + [("path_x", "i"), ("path_y", "i")], cols)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self._hand_off()
+        self.writer.close()
@@ -0,0 +1,124 @@
+from config import TILE, QUEUE_SPEED
+from pathfinding import DIRS4
+
+# ============================================================
+# Tile occupancy index
+# ============================================================
+# Per-tile and per-(tile, movement) counts of moving and stopped cars. A car
+# is counted on the tile of its current lane (see lanes.py) under the
+# movement it makes there (entry and exit direction), so counts only change
+# when a car changes lane tile or crosses QUEUE_SPEED: update() is O(1) per car.
+#
+# Light observations (queue, blockage) then read a handful of fixed tiles
+# instead of scanning every car.
+
+MOVING, STOPPED = 0, 1
+
+
+def light_stop_tile(tl):
+    sx, sy = tl.stop_point
+    return (int(sx // TILE), int(sy // TILE))
+
+
+class TileOccupancy:
+    def __init__(self, stopped_speed=QUEUE_SPEED):
+        self.stopped_speed = stopped_speed
+        self.tiles = {}      # tile -> [moving, stopped]
+        self.approach = {}   # (tile, entry dir, exit dir) -> [moving, stopped]
+        self._light_tiles = {}  # light -> (stop tile, own tiles, approach slots)
+
+    # -----------------------------
+    # MEMBERSHIP
+    # -----------------------------
+    def _bump(self, slot, state, n):
+        c = self.tiles.get(slot[0])
+        if c is None:
+            c = self.tiles[slot[0]] = [0, 0]
+        c[state] += n
+        c = self.approach.get(slot)
+        if c is None:
+            c = self.approach[slot] = [0, 0]
+        c[state] += n
+
+    def _slot(self, car):
+        key = car.lane_key
+        if key is None:
+            return None, MOVING
+        return key[:3], (STOPPED if car.speed < self.stopped_speed else MOVING)
+
+    def add(self, car):
+        slot, state = self._slot(car)
+        car.occ_slot, car.occ_state = slot, state
+        if slot is not None:
+            self._bump(slot, state, 1)
+
+    def update(self, car):
+        """Re-count a car after it moved; no-op unless its tile or stopped state changed."""
+        slot, state = self._slot(car)
+        if slot == car.occ_slot and state == car.occ_state:
+            return
+        if car.occ_slot is not None:
+            self._bump(car.occ_slot, car.occ_state, -1)
+        if slot is not None:
+            self._bump(slot, state, 1)
+        car.occ_slot, car.occ_state = slot, state
+
+    def remove(self, car):
+        if car.occ_slot is not None:
+            self._bump(car.occ_slot, car.occ_state, -1)
+        car.occ_slot = None
+
+    def clear(self):
+        self.tiles.clear()
+        self.approach.clear()
+
+    def invalidate_lights(self):
+        self._light_tiles.clear()
+
+    # -----------------------------
+    # QUERIES
+    # -----------------------------
+    def count(self, tile, state=None):
+        c = self.tiles.get(tile)
+        if c is None:
+            return 0
+        return c[0] + c[1] if state is None else c[state]
+
+    def approach_count(self, tile, entry_dir, exit_dir, state=None):
+        """Cars on tile making one movement (entry_dir == exit_dir: straight through)."""
+        c = self.approach.get((tile, entry_dir, exit_dir))
+        if c is None:
+            return 0
+        return c[0] + c[1] if state is None else c[state]
+
+    def light_tiles(self, tl):
+        """(stop tile, tiles the light governs, through movements on the neighbours into the stop tile)."""
+        lt = self._light_tiles.get(tl)
+        if lt is None:
+            stop = light_stop_tile(tl)
+            own = [stop]
+            for t in getattr(tl, "controlled_tiles", ()):
+                t = (int(t[0]), int(t[1]))
+                if t not in own:
+                    own.append(t)
+            x, y = stop
+            # cars turning off before the stop tile are not queued for it
+            approaches = [((x - dx, y - dy), (dx, dy), (dx, dy)) for dx, dy in DIRS4]
+            approaches = [s for s in approaches if s[0] not in own]
+            lt = self._light_tiles[tl] = (stop, own, approaches)
+        return lt
+
+    def light_queue(self, tl, approaches=False):
+        """Cars on the light's own tiles; with approaches=True also cars driving straight into its stop tile."""
+        _, own, slots = self.light_tiles(tl)
+        n = 0
+        for t in own:
+            n += self.count(t)
+        if approaches:
+            for tile, entry_dir, exit_dir in slots:
+                n += self.approach_count(tile, entry_dir, exit_dir)
+        return n
+
+    def light_blocked(self, tl):
+        """True if a car is queued (below QUEUE_SPEED) on the light's stop tile."""
+        return self.count(self.light_tiles(tl)[0], STOPPED) > 0
@@ -0,0 +1,608 @@
+"""
+Partitioned simulation: spatial domain decomposition across worker processes.
+
+    python partition.py --map grid-large --regions 4 --cars 2000 --ticks 3600 --compare
+
+The compiled road grid is cut into vertical strips with equal drivable tile
+counts. Each region is stepped by its own worker process running a
+RegionSimulation over the full map: it spawns from its own portals, decides
+its own lights and moves only the cars it owns.
+
+A car is owned by the region of the next junction within OWNER_LOOKAHEAD route
+tiles (else of the tile it is on), so a junction's reservations and its
+light queues live in a single worker. When a car's owner changes it is handed
+off, with its full state, through the coordinator. Every tick each worker
+also publishes the cars within HALO tiles of another region as ghost
+records (the coordinator grows the buffer when a region has more than fit),
+and the phases of its lights, in shared memory; neighbours insert
+the ghosts into their lane queues and tile occupancy (leaders, raycasts,
+light queues, crash checks) without stepping them, and mirror the lights.
+A tick has two phases: every worker reads and steps ("step"), and only once
+all of them are done do they publish ("publish"), so each region reads
+exactly the previous tick's ghosts and lights.
+
+max_active_cars is global: each tick the coordinator hands the free slots
+to the regions as spawn budgets (by portal share, see _spawn_budgets).
+Handoffs move cars between regions and never add any.
+
+Differences from a single process, so results agree statistically (not bit
+for bit) for the same seed: each region draws from its own random streams
+and learns its own Q-table, lights owned by another region are seen one tick
+late, and a crash anywhere resets every region at the start of the next tick.
+Recording, live streaming and the hybrid link model are single-process only.
+--compare exits non-zero when mean travel time differs from the
+single-process run by more than --tolerance, when the trip counts a and b
+differ by more than both --tolerance and 2*sqrt(a + b) (two standard
+deviations of the difference of two Poisson counts, which dominates below a
+few hundred trips), or when either run finished fewer than --min-trips trips
+(too few to compare; run more --ticks).
+"""
+import argparse
+import math
+import multiprocessing as mp
+import struct
+import sys
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+
+from config import MAX_ACTIVE_CARS, SPAWN_INTERVAL_MS
+from map_loader import MapSpec, compile_map, load_compiled
+from mapgen import GENERATORS, generate
+from metrics import TripMetrics
+from occupancy import light_stop_tile
+from simulation import Simulation
+from snapshot import CAR_FIELDS
+from utils import rects_overlap
+
+OWNER_LOOKAHEAD = 3   # route tiles ahead at which a junction claims a car
+HALO = 3              # tiles around a region boundary whose cars are mirrored as ghosts
+MAX_REGIONS = 32      # ghost destinations are a 32-bit mask
+
+# ghost record: car id, start x/y, goal x/y, lane index, destination mask,
+#               x, y, angle, speed, width, height, tile index
+GHOST = struct.Struct("<ihhhhbxxxIffffffi")
+COUNT = struct.Struct("<I")
+# light record: green, prev_green, time_since_switch
+LIGHT = struct.Struct("<BBxxi")
+
+
+# ============================================================
+# Partition plan
+# ============================================================
+class Plan:
+    """Tile -> region map, per-tile ghost destinations and portal ownership."""
+
+    def __init__(self, compiled, regions):
+        rows, cols = compiled.rows, compiled.cols
+        regions = max(1, min(regions, cols, MAX_REGIONS))
+        drivable = compiled.drivable
+
+        # vertical strips with equal drivable tile counts
+        per_col = [sum(drivable[y * cols + x] for y in range(rows)) for x in range(cols)]
+        total = sum(per_col) or 1
+        col_region = []
+        seen = 0
+        for n in per_col:
+            col_region.append(min(regions - 1, seen * regions // total))
+            seen += n
+        self.regions = regions
+        self.cols = cols
+        self.region = [col_region[i % cols] for i in range(rows * cols)]
+
+        # regions within HALO columns of each tile (strips: columns are enough)
+        self.halo = []
+        for x in range(cols):
+            mask = 0
+            for c in range(max(0, x - HALO), min(cols, x + HALO + 1)):
+                mask |= 1 << col_region[c]
+            self.halo.append(mask)
+
+        self.portals = [[] for _ in range(regions)]
+        for pid, tiles in compiled.portals.items():
+            self.portals[self.tile_region(tiles[0])].append(pid)
+
+    def tile_region(self, tile):
+        return self.region[tile[1] * self.cols + tile[0]]
+
+    def car_caps(self, max_active_cars):
+        """Split max_active_cars by portal share (largest remainder: the caps sum to it exactly)."""
+        n_portals = sum(map(len, self.portals))
+        if not n_portals:
+            return [0] * self.regions
+        exact = [max_active_cars * len(own) / n_portals for own in self.portals]
+        caps = [int(e) for e in exact]
+        by_remainder = sorted(range(self.regions), key=lambda r: caps[r] - exact[r])
+        for r in by_remainder[:max_active_cars - sum(caps)]:
+            caps[r] += 1
+        return caps
+
+    def halo_mask(self, tile):
+        return self.halo[tile[0]]
+
+
+# ============================================================
+# Region worker simulation
+# ============================================================
+class RegionSimulation(Simulation):
+    def __init__(self, region, plan, compiled, seed=None, max_active_cars=MAX_ACTIVE_CARS,
+                 spawn_interval_ms=SPAWN_INTERVAL_MS, **kw):
+        # the region spawns its share of the global demand from its own portals
+        n_portals = len(compiled.portals) or 1
+        own = plan.portals[region]
+        share = len(own) / n_portals
+        super().__init__(
+            compiled.make_lights(), compiled.portals, grid=compiled.grid, routes=compiled,
+            max_active_cars=plan.car_caps(max_active_cars)[region],
+            spawn_interval_ms=spawn_interval_ms / share if share else float("inf"),
+            reset_on_crash=False, seed=None if seed is None else f"{seed}/{region}", **kw,
+        )
+        self.region = region
+        self.plan = plan
+        self.origin_ids = own
+        self.light_owner = [plan.tile_region(light_stop_tile(tl)) for tl in self.traffic_lights]
+        self.controlled_lights = [tl for tl, r in zip(self.traffic_lights, self.light_owner) if r == region]
+        self.ghost_region = {}   # id(ghost car) -> owning region
+        self.crashed = False
+
+    # -----------------------------
+    # OWNERSHIP
+    # -----------------------------
+    def owner(self, car):
+        path = car.tile_path
+        i = car.tile_idx
+        is_junction = self.lanes.is_junction
+        for t in path[i:i + OWNER_LOOKAHEAD + 1]:
+            if is_junction(t):
+                return self.plan.tile_region(t)
+        return self.plan.tile_region(path[i])
+
+    def spawn_car_random(self):
+        if not self.origin_ids:
+            return None
+        for _ in range(10):
+            start_id = self.rng.choice(self.origin_ids)
+            goal_id = self.rng.choice(self.portal_ids)
+            if start_id == goal_id:
+                continue
+            start_tile = self.rng.choice(self.portals[start_id])
+            goal_tile = self.rng.choice(self.portals[goal_id])
+            if self.route_path(start_tile, goal_tile):
+                return self.spawn_car(start_tile, goal_tile)
+        return None
+
+    # -----------------------------
+    # HANDOFFS
+    # -----------------------------
+    def emit_handoffs(self):
+        """Remove cars owned by other regions; returns {region: [car state, ...]}."""
+        out = {}
+        keep = 0
+        cars = self.cars
+        light_index = {id(tl): i for i, tl in enumerate(self.traffic_lights)}
+        for car in cars:
+            r = self.owner(car)
+            if r == self.region:
+                cars[keep] = car
+                keep += 1
+                continue
+            control = light_index[id(car.control_light)] if car.control_light is not None else -1
+            out.setdefault(r, []).append((tuple(getattr(car, f) for f in CAR_FIELDS), control))
+            self.lanes.remove(car)
+            self.occupancy.remove(car)
+            if self.junctions is not None:
+                self.junctions.remove(car)
+            self.pool.release(car)
+        del cars[keep:]
+        return out
+
+    def _materialize(self, start, goal, lane_index):
+        car = self.pool.take()
+        car.traffic_lights = self.traffic_lights
+        route = self.route_table.get(start, goal, lane_index)
+        car.route = route
+        car.tile_path = route.tile_path
+        car.path = route.points
+        car.ray_tests = 0
+        car.lane_key = car.lane_ahead = car.lane_behind = None
+        car.occ_slot = None
+        car.occ_state = 0
+        return car
+
+    def receive(self, handoffs):
+        lights = self.traffic_lights
+        for values, control in handoffs:
+            state = dict(zip(CAR_FIELDS, values))
+            car = self._materialize(state["start_tile"], state["goal_tile"], state["lane_index"])
+            for f, v in state.items():
+                setattr(car, f, v)
+            car.control_light = lights[control] if control >= 0 else None
+            self.lanes.insert(car)
+            self.occupancy.add(car)
+            self.cars.append(car)
+
+    # -----------------------------
+    # GHOSTS AND LIGHTS (shared memory)
+    # -----------------------------
+    def drop_ghosts(self):
+        for g in self.ghosts:
+            self.lanes.remove(g)
+            self.occupancy.remove(g)
+        self.pool.release_all(self.ghosts)
+        self.ghosts = []
+        self.ghost_region.clear()
+
+    def read_ghosts(self, buf, capacity):
+        self.drop_ghosts()
+        bit = 1 << self.region
+        block = COUNT.size + capacity * GHOST.size
+        for r in range(self.plan.regions):
+            if r == self.region:
+                continue
+            base = r * block
+            n = COUNT.unpack_from(buf, base)[0]
+            for car_id, sx, sy, gx, gy, lane, mask, x, y, angle, speed, w, h, tile_idx in \
+                    GHOST.iter_unpack(buf[base + COUNT.size:base + COUNT.size + n * GHOST.size]):
+                if not mask & bit:
+                    continue
+                g = self._materialize((sx, sy), (gx, gy), lane)
+                g.car_id, g.lane_index = car_id, lane
+                g.x, g.y, g.angle, g.speed, g.width, g.height = x, y, angle, speed, w, h
+                g.tile_idx = tile_idx
+                g.reached = g.meso = False
+                g.control_light = None
+                self.lanes.insert(g)
+                self.occupancy.add(g)
+                self.ghosts.append(g)
+                self.ghost_region[id(g)] = r
+
+    def write_ghosts(self, buf, capacity):
+        """Publish up to capacity ghosts; returns how many cars need one (more: buffer must grow)."""
+        base = self.region * (COUNT.size + capacity * GHOST.size)
+        off = base + COUNT.size
+        n = 0
+        own = ~(1 << self.region)
+        plan = self.plan
+        for car in self.cars:
+            tile = car.tile_path[car.tile_idx]
+            mask = (plan.halo_mask(tile) | 1 << plan.tile_region(tile)) & own
+            if not mask:
+                continue
+            n += 1
+            if n > capacity:
+                continue
+            (sx, sy), (gx, gy) = car.start_tile, car.goal_tile
+            GHOST.pack_into(buf, off, car.car_id, sx, sy, gx, gy, car.lane_index, mask,
+                            car.x, car.y, car.angle, car.speed, car.width, car.height, car.tile_idx)
+            off += GHOST.size
+        COUNT.pack_into(buf, base, min(n, capacity))
+        return n
+
+    def read_lights(self, buf):
+        for i, (tl, r) in enumerate(zip(self.traffic_lights, self.light_owner)):
+            if r != self.region:
+                green, prev, since = LIGHT.unpack_from(buf, i * LIGHT.size)
+                tl.green, tl.prev_green, tl.time_since_switch = bool(green), bool(prev), since
+
+    def write_lights(self, buf):
+        for i, (tl, r) in enumerate(zip(self.traffic_lights, self.light_owner)):
+            if r == self.region:
+                LIGHT.pack_into(buf, i * LIGHT.size, tl.green, tl.prev_green, tl.time_since_switch)
+
+    # -----------------------------
+    # SIMULATION HOOKS
+    # -----------------------------
+    def detect_crash(self):
+        a, b = super().detect_crash()
+        if a is not None:
+            return a, b
+        # owned vs ghost: counted by the lower-numbered of the two regions only
+        ghosts = [g for g in self.ghosts if self.ghost_region[id(g)] > self.region]
+        if not ghosts:
+            return None, None
+        for a in self.cars:
+            if a.reached or a.meso:
+                continue
+            ra = a.get_rect()
+            for b in ghosts:
+                if rects_overlap(*ra, *b.get_rect()):
+                    return a, b
+        return None, None
+
+    def allow_spawns(self, n):
+        """Let the coming tick spawn at most n cars (this region's share of the free global slots)."""
+        self.max_active_cars = len(self.cars) + max(0, n)
+
+    def update(self, dt):
+        crashes = self.episode_crashes
+        super().update(dt)
+        self.crashed = self.episode_crashes != crashes
+
+    def reset_episode(self):
+        self.drop_ghosts()
+        super().reset_episode()
+
+
+# ============================================================
+# Worker process
+# ============================================================
+def _worker(region, conn, plan, compiled, seed, capacity, ghost_name, light_name, sim_kw):
+    ghost_shm = SharedMemory(name=ghost_name)
+    light_shm = SharedMemory(name=light_name)
+    try:
+        sim = RegionSimulation(region, plan, compiled, seed, metrics=TripMetrics(window=float("inf")), **sim_kw)
+        gbuf, lbuf = ghost_shm.buf, light_shm.buf
+        sim.write_lights(lbuf)
+        conn.send(None)  # ready
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            if msg[0] == "summary":
+                s = sim.metrics.summary()
+                conn.send((s["total_trips"], s["mean_travel_time"], s["mean_stop_time"], len(sim.cars)))
+                continue
+            if msg[0] == "publish":
+                # every region has read this tick's inputs: safe to overwrite them
+                n_ghosts = sim.write_ghosts(gbuf, capacity)
+                sim.write_lights(lbuf)
+                conn.send(n_ghosts)
+                continue
+            if msg[0] == "ghosts":
+                # the coordinator grew the ghost buffer: republish this tick's ghosts in it
+                _, ghost_name, capacity = msg
+                del gbuf
+                ghost_shm.close()
+                ghost_shm = SharedMemory(name=ghost_name)
+                gbuf = ghost_shm.buf
+                sim.write_ghosts(gbuf, capacity)
+                conn.send(None)
+                continue
+            _, dt, handoffs, crash, reset, budget = msg
+            if crash and not sim.crashed:
+                sim.penalize_crash()
+            if reset:
+                sim.reset_episode()
+            sim.read_lights(lbuf)
+            sim.receive(handoffs)
+            sim.read_ghosts(gbuf, capacity)
+            sim.allow_spawns(budget)
+            sim.update(dt)
+            conn.send((sim.emit_handoffs(), sim.crashed, len(sim.cars)))
+        del gbuf, lbuf
+        sim.drop_ghosts()
+    finally:
+        ghost_shm.close()
+        light_shm.close()
+
+
+# ============================================================
+# Coordinator
+# ============================================================
+class PartitionedSimulation:
+    """
+    Drop-in for headless Simulation.update loops over a CompiledMap; one
+    worker process per region. Call close() when done.
+    """
+
+    def __init__(self, compiled, regions=None, seed=None, max_active_cars=MAX_ACTIVE_CARS,
+                 spawn_interval_ms=SPAWN_INTERVAL_MS, reset_on_crash=True, **sim_kw):
+        self.plan = Plan(compiled, regions or mp.cpu_count())
+        n = self.plan.regions
+        self.capacity = max(256, max_active_cars)
+        self.max_active_cars = max_active_cars
+        self.reset_on_crash = reset_on_crash
+        n_portals = sum(map(len, self.plan.portals)) or 1
+        self.spawn_shares = [len(own) / n_portals for own in self.plan.portals]
+        self._spawn_credit = [0.0] * n   # slots owed to each region (sums to 0)
+        self.ghost_shm = SharedMemory(create=True, size=n * (COUNT.size + self.capacity * GHOST.size))
+        self.light_shm = SharedMemory(create=True, size=max(1, len(compiled.lights)) * LIGHT.size)
+
+        sim_kw.update(max_active_cars=max_active_cars, spawn_interval_ms=spawn_interval_ms)
+        self.conns = []
+        self.procs = []
+        for r in range(n):
+            parent, child = mp.Pipe()
+            p = mp.Process(
+                target=_worker, name=f"region-{r}", daemon=True,
+                args=(r, child, self.plan, compiled, seed, self.capacity,
+                      self.ghost_shm.name, self.light_shm.name, sim_kw),
+            )
+            p.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(p)
+        for c in self.conns:
+            c.recv()
+
+        self.tick = 0
+        self.sim_time = 0.0
+        self.episode_crashes = 0
+        self.active_cars = 0
+        self.handed_off = 0
+        self._inbox = [[] for _ in range(n)]
+        self._crash = False
+
+    def update(self, dt):
+        self.tick += 1
+        self.sim_time += dt
+        reset = self._crash and self.reset_on_crash
+        budgets = self._spawn_budgets(self.max_active_cars - (0 if reset else self.active_cars))
+        for r, c in enumerate(self.conns):
+            c.send(("step", dt, [] if reset else self._inbox[r], self._crash, reset, budgets[r]))
+        inbox = [[] for _ in self.conns]
+        crashed = False
+        active = 0
+        for c in self.conns:
+            out, crash, n = c.recv()
+            crashed |= crash
+            active += n
+            for r, cars in out.items():
+                inbox[r].extend(cars)
+                self.handed_off += len(cars)
+        # publish only now: no region is still reading the previous tick's buffers
+        for c in self.conns:
+            c.send(("publish",))
+        ghosts = max(c.recv() for c in self.conns)
+        self._inbox = inbox
+        self._crash = crashed
+        self.active_cars = active + sum(len(b) for b in inbox)
+        if crashed:
+            self.episode_crashes += 1
+        if ghosts > self.capacity:
+            self._grow_ghosts(ghosts)
+
+    def _spawn_budgets(self, free):
+        """
+        Split the free global car slots between the regions by portal share.
+        Each region's unrounded share carries over to the next tick, so a
+        region with a small share still gets its turn when only a slot or
+        two are free at a time. The budgets sum to free (negative ones
+        spawn nothing).
+        """
+        free = max(0, free)
+        credit = [c + free * s for c, s in zip(self._spawn_credit, self.spawn_shares)]
+        budgets = [math.floor(c) for c in credit]
+        owed = sorted(range(len(budgets)), key=lambda r: budgets[r] - credit[r])
+        for r in owed[:free - sum(budgets)]:
+            budgets[r] += 1
+        self._spawn_credit = [c - b for c, b in zip(credit, budgets)]
+        return budgets
+
+    def _grow_ghosts(self, needed):
+        """Replace the ghost buffer with a larger one before any worker reads this tick's ghosts."""
+        capacity = max(needed, 2 * self.capacity)
+        shm = SharedMemory(create=True, size=self.plan.regions * (COUNT.size + capacity * GHOST.size))
+        for c in self.conns:
+            c.send(("ghosts", shm.name, capacity))
+        for c in self.conns:
+            c.recv()
+        self.ghost_shm.close()
+        self.ghost_shm.unlink()
+        self.ghost_shm = shm
+        self.capacity = capacity
+
+    def summary(self):
+        trips = travel = stop = 0.0
+        for c in self.conns:
+            c.send(("summary",))
+        for c in self.conns:
+            n, mean_travel, mean_stop, _ = c.recv()
+            trips += n
+            travel += n * mean_travel
+            stop += n * mean_stop
+        return {
+            "total_trips": int(trips),
+            "mean_travel_time": travel / trips if trips else 0.0,
+            "mean_stop_time": stop / trips if trips else 0.0,
+            "total_crashes": self.episode_crashes,
+        }
+
+    def close(self):
+        for c in self.conns:
+            try:
+                c.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self.procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        self.ghost_shm.close()
+        self.ghost_shm.unlink()
+        self.light_shm.close()
+        self.light_shm.unlink()
+
+
+# ============================================================
+# Comparison run
+# ============================================================
+def load_map(name, seed=0):
+    if name in GENERATORS:
+        return compile_map(MapSpec(*generate(name, seed=seed)))
+    return load_compiled(name)
+
+
+def relative_diff(a, b):
+    """|a - b| relative to the larger of the two (0 when both are 0)."""
+    scale = max(abs(a), abs(b))
+    return abs(a - b) / scale if scale else 0.0
+
+
+def trips_differ(a, b, tolerance):
+    """Trip counts a and b differ by more than tolerance and by more than their Poisson noise."""
+    return relative_diff(a, b) > tolerance and abs(a - b) > 2.0 * math.sqrt(a + b)
+
+
+def run(sim, ticks, dt):
+    t0 = perf_counter()
+    for _ in range(ticks):
+        sim.update(dt)
+    return perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a map partitioned across worker processes")
+    parser.add_argument("--map", default="grid-large", help="map file or synthetic map name")
+    parser.add_argument("--regions", type=int, default=mp.cpu_count())
+    parser.add_argument("--cars", type=int, default=1000, help="max active cars")
+    parser.add_argument("--spawn-interval", type=float, default=20.0, metavar="MS")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", action="store_true", help="also run single-process with the same seed")
+    parser.add_argument("--tolerance", type=float, default=0.15, metavar="FRAC",
+                        help="--compare fails if mean travel time (or, beyond Poisson noise, the trip "
+                             "count) differs by more than this fraction")
+    parser.add_argument("--min-trips", type=int, default=30,
+                        help="--compare fails if either run finished fewer trips than this")
+    args = parser.parse_args(argv)
+
+    compiled = load_map(args.map, args.seed)
+    kw = dict(max_active_cars=args.cars, spawn_interval_ms=args.spawn_interval)
+    rows = []
+
+    psim = PartitionedSimulation(compiled, args.regions, seed=args.seed, **kw)
+    try:
+        elapsed = run(psim, args.ticks, args.dt)
+        rows.append((f"partitioned x{psim.plan.regions}", elapsed, psim.summary(), psim.active_cars))
+    finally:
+        psim.close()
+
+    if args.compare:
+        metrics = TripMetrics(window=float("inf"))
+        sim = Simulation(compiled.make_lights(), compiled.portals, metrics=metrics, grid=compiled.grid,
+                         routes=compiled, seed=args.seed, **kw)
+        elapsed = run(sim, args.ticks, args.dt)
+        rows.append(("single process", elapsed, metrics.summary(), len(sim.cars)))
+
+    for name, elapsed, s, active in rows:
+        print(
+            f"{name:<18} ticks/s={args.ticks / elapsed:8.1f} cars={active:<6} trips={s['total_trips']:<6} "
+            f"travel={s['mean_travel_time']:6.2f}s stop={s['mean_stop_time']:6.2f}s crashes={s['total_crashes']}"
+        )
+
+    if args.compare:
+        failed = False
+        part, single = rows[0][2], rows[1][2]
+        trips = min(part["total_trips"], single["total_trips"])
+        if trips < args.min_trips:
+            print(f"only {trips} trips finished (--min-trips {args.min_trips}): too few to compare, "
+                  f"run more --ticks", file=sys.stderr)
+            return 1
+        for key in ("total_trips", "mean_travel_time"):
+            a, b = part[key], single[key]
+            if key == "total_trips":
+                bad = trips_differ(a, b, args.tolerance)
+            else:
+                bad = relative_diff(a, b) > args.tolerance
+            if bad:
+                print(f"{key}: partitioned {a:.2f} vs single {b:.2f} differs by "
+                      f"{relative_diff(a, b):.1%} (tolerance {args.tolerance:.1%})", file=sys.stderr)
+                failed = True
+        if failed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,6 +15,7 @@ from utils import world_center
 # -4  = one-way NORTH (only move -y)
 
 DIRS4 = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+ONEWAY_DIRS = {-1: (1, 0), -2: (-1, 0), -3: (0, 1), -4: (0, -1)}
 
 
 def is_drivable(val: int) -> bool:
@@ -35,6 +36,12 @@ def allows_exit(tile_val: int, dx: int, dy: int) -> bool:
     return True  # two-way roads / portals
 
 
+def allows_entry(tile_val: int, dx: int, dy: int) -> bool:
+    """Return True if a move (dx,dy) may enter a tile (no driving against a one-way)."""
+    d = ONEWAY_DIRS.get(tile_val)
+    return d is None or (dx, dy) != (-d[0], -d[1])
+
+
 # ------------------------------------------------------------
 # BFS tile path with one-way constraints
 # ------------------------------------------------------------
@@ -75,10 +82,10 @@ def bfs_find_path(start, goal, grid):
 
                 # one-way constraints:
                 # - current tile must allow leaving in (dx,dy)
-                # - next tile must allow entering from (-dx,-dy)
+                # - next tile must not be entered against its direction
                 if not allows_exit(cur_val, dx, dy):
                     continue
-                if not allows_exit(nxt_val, -dx, -dy):
+                if not allows_entry(nxt_val, dx, dy):
                     continue
 
                 visited.add((nx, ny))
@@ -98,9 +105,75 @@ def bfs_find_path(start, goal, grid):
     return path
 
 
+def bfs_tree_to(goal, grid, targets=None):
+    """
+    Reverse BFS from goal: {tile: next tile towards goal} for every tile that
+    can reach it under the one-way rules (goal maps to None). One tree serves
+    every car heading to the same goal. With targets, the search stops once
+    all of them are in the tree (their paths are complete by then).
+    """
+    gx, gy = goal
+    ROWS = len(grid)
+    COLS = len(grid[0])
+    if not (0 <= gx < COLS and 0 <= gy < ROWS) or not is_drivable(grid[gy][gx]):
+        return {}
+
+    left = None
+    if targets is not None:
+        left = set(targets)
+        left.discard(goal)
+        if not left:
+            return {goal: None}
+    nxt = {goal: None}
+    q = deque([goal])
+    while q:
+        cur = q.popleft()
+        cx, cy = cur
+        # allows_entry / allows_exit inlined: this runs over the whole map
+        against = ONEWAY_DIRS.get(grid[cy][cx])
+        if against is not None:
+            against = (-against[0], -against[1])
+        for d in DIRS4:
+            if d == against:
+                continue
+            # predecessor p moves d onto the current tile
+            p = (cx - d[0], cy - d[1])
+            px, py = p
+            if not (0 <= px < COLS and 0 <= py < ROWS) or p in nxt:
+                continue
+            prev_val = grid[py][px]
+            if prev_val == 0:
+                continue
+            only = ONEWAY_DIRS.get(prev_val)
+            if only is not None and only != d:
+                continue
+            nxt[p] = cur
+            q.append(p)
+            if left is not None:
+                left.discard(p)
+                if not left:
+                    return nxt
+    return nxt
+
+
+def tree_path(tree, start):
+    """Tile path from start along a bfs_tree_to tree ([] if start cannot reach its goal)."""
+    if start not in tree:
+        return []
+    path = [start]
+    nxt = tree[start]
+    while nxt is not None:
+        path.append(nxt)
+        nxt = tree[nxt]
+    return path
+
+
 # ------------------------------------------------------------
 # Lane-aware geometry (+ multi-lane offsets + curves)
 # ------------------------------------------------------------
+CURVE_STEPS = 12  # a turning tile gets CURVE_STEPS + 1 points, any other tile one
+
+
 def lanes_per_direction(tile_val: int) -> int:
     # -10 means 2 lanes each direction
     if tile_val == -10:
@@ -124,17 +197,19 @@ def _lane_offset(tile_val: int, lane_index: int) -> float:
     return base + lane_index * lane_spacing
 
 
-def tile_path_to_lane_points(tile_path, lane_index: int = 0):
+def tile_path_to_lane_points(tile_path, lane_index: int = 0, grid=None):
     """
     Convert tile path to world points.
     - lane_index: pick 0..(lanes-1) for 2-lane roads, else ignored
+    - grid: road map the path was planned on (defaults to ROAD_MAP)
     """
     if not tile_path:
         return []
+    if grid is None:
+        grid = ROAD_MAP
 
     # smoother curves
     CURVE_RADIUS = TILE * 0.40
-    CURVE_STEPS = 12
 
     points = []
 
@@ -153,7 +228,7 @@ def tile_path_to_lane_points(tile_path, lane_index: int = 0):
             dy = y - py
 
         # offset depends on this tile type
-        tile_val = ROAD_MAP[y][x]
+        tile_val = grid[y][x]
         OFFSET = _lane_offset(tile_val, lane_index)
 
         # apply lane offset for right-side traffic
@@ -186,19 +261,19 @@ def tile_path_to_lane_points(tile_path, lane_index: int = 0):
                 lx = cx + dx2 * CURVE_RADIUS
                 ly = cy + dy2 * CURVE_RADIUS
 
-                # slight bias so curve stays inside the lane on turns
+                # slight bias so curve stays inside the lane on turns;
+                # the entry point sits in the incoming lane (right of the
+                # incoming direction) for left and right turns alike
                 turn = dx1 * dy2 - dy1 * dx2
                 perp_x = -dy1
                 perp_y = dx1
 
+                ex += perp_x * OFFSET
+                ey += perp_y * OFFSET
                 if turn > 0:
-                    ex += perp_x * OFFSET
-                    ey += perp_y * OFFSET
                     lx += perp_x * (OFFSET * 0.5)
                     ly += perp_y * (OFFSET * 0.5)
                 else:
-                    ex -= perp_x * OFFSET
-                    ey -= perp_y * OFFSET
                     lx -= perp_x * (OFFSET * 0.5)
                     ly -= perp_y * (OFFSET * 0.5)
 
@@ -226,3 +301,55 @@ def tile_path_to_lane_points(tile_path, lane_index: int = 0):
         points.append((cx, cy))
 
     return points
+
+
+def spawn_pose(start_tile, next_tile):
+    """(x, y, angle) at which a car entering the map on start_tile appears."""
+    sx, sy = start_tile
+    nx, ny = next_tile
+    dir_x = nx - sx
+    dir_y = ny - sy
+    cx, cy = world_center(sx, sy)
+
+    OFFSET = TILE * 0.25
+    SPAWN_DISTANCE = TILE * 0.6
+
+    if dir_x == 1:
+        return cx - SPAWN_DISTANCE, cy + OFFSET, 0
+    if dir_x == -1:
+        return cx + SPAWN_DISTANCE, cy - OFFSET, 180
+    if dir_y == 1:
+        return cx - OFFSET, cy - SPAWN_DISTANCE, 90
+    if dir_y == -1:
+        return cx + OFFSET, cy + SPAWN_DISTANCE, 270
+    return cx, cy, 0
+
+
+def lane_point_starts(tile_path):
+    """
+    Index of the first tile_path_to_lane_points point of each tile, plus the
+    total point count: tile i owns points[starts[i]:starts[i + 1]].
+    """
+    starts = [0]
+    n = len(tile_path)
+    for i in range(n):
+        k = 1
+        if 0 < i < n - 1:
+            (px, py), (x, y), (nx, ny) = tile_path[i - 1], tile_path[i], tile_path[i + 1]
+            if (x - px, y - py) != (nx - x, ny - y):
+                k = CURVE_STEPS + 1
+        starts.append(starts[-1] + k)
+    return starts
+
+
+# ------------------------------------------------------------
+# Portals
+# ------------------------------------------------------------
+def collect_portals(grid):
+    """Map portal id -> list of tiles carrying that id (values > 1)."""
+    portals = {}
+    for y, row in enumerate(grid):
+        for x, val in enumerate(row):
+            if val and val > 1:
+                portals.setdefault(val, []).append((x, y))
+    return portals
@@ -0,0 +1,202 @@
+import json
+import sys
+from time import perf_counter
+
+from writer import BackgroundWriter
+
+# log2 buckets over microseconds: bucket k holds durations in [2^(k-1), 2^k) us
+HIST_BUCKETS = 24
+
+
+class PhaseStats:
+    __slots__ = ("calls", "total", "max", "last", "hist")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.hist = [0] * HIST_BUCKETS
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+        b = int(seconds * 1e6).bit_length()
+        self.hist[b if b < HIST_BUCKETS else HIST_BUCKETS - 1] += 1
+
+    def percentile(self, q):
+        """Upper bound (seconds) of the histogram bucket holding the q-th quantile."""
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        for b, n in enumerate(self.hist):
+            seen += n
+            if seen >= target:
+                return (1 << b) / 1e6
+        return self.max
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_ms": self.total * 1e3,
+            "mean_ms": self.total * 1e3 / self.calls if self.calls else 0.0,
+            "last_ms": self.last * 1e3,
+            "max_ms": self.max * 1e3,
+            "p50_ms": self.percentile(0.50) * 1e3,
+            "p95_ms": self.percentile(0.95) * 1e3,
+            "hist_us_log2": list(self.hist),
+        }
+
+
+# ============================================================
+# Profiler
+# ============================================================
+class Profiler:
+    """
+    Named phase timers and counters for Simulation.update.
+
+    Usage on the hot path:
+        t = prof.clock()
+        ...
+        t = prof.lap("spawn", t)
+        prof.count("bfs_calls")
+        prof.end_tick()
+    """
+
+    enabled = True
+
+    def __init__(self, dump_path=None, dump_interval=5.0, overlay=False):
+        self.phases = {}
+        self.counters = {}          # cumulative
+        self.tick_counters = {}     # last completed tick
+        self._cur = {}
+        self.ticks = 0
+        self.overlay = overlay
+        self.started = perf_counter()
+
+        self.dump_interval = dump_interval
+        self.last_dump = self.started
+        self.dump_writer = None
+        if dump_path is not None and dump_path != "-":
+            self.dump_writer = BackgroundWriter(
+                dump_path, lambda snap: (json.dumps(snap) + "\n").encode(), mode="ab", name="profile-dump"
+            )
+        self.dump_to_stdout = dump_path == "-"
+
+    def clock(self):
+        return perf_counter()
+
+    def lap(self, phase, t0):
+        t = perf_counter()
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+        stats.add(t - t0)
+        return t
+
+    def count(self, name, n=1):
+        self._cur[name] = self._cur.get(name, 0) + n
+
+    def end_tick(self):
+        self.ticks += 1
+        cur = self._cur
+        for name, n in cur.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.tick_counters = cur
+        self._cur = {}
+
+        if self.dump_writer is not None or self.dump_to_stdout:
+            now = perf_counter()
+            if now - self.last_dump >= self.dump_interval:
+                self.last_dump = now
+                self.dump()
+
+    def snapshot(self):
+        elapsed = perf_counter() - self.started
+        return {
+            "ticks": self.ticks,
+            "elapsed_s": elapsed,
+            "ticks_per_s": self.ticks / elapsed if elapsed > 0 else 0.0,
+            "phases": {name: s.as_dict() for name, s in self.phases.items()},
+            "counters": dict(self.counters),
+            "last_tick": dict(self.tick_counters),
+        }
+
+    def dump(self):
+        snap = self.snapshot()
+        if self.dump_writer is not None:
+            self.dump_writer.submit(snap)
+        else:
+            print(json.dumps(snap), file=sys.stdout)
+
+    def reset(self):
+        self.phases.clear()
+        self.counters.clear()
+        self.tick_counters = {}
+        self._cur = {}
+        self.ticks = 0
+        self.started = perf_counter()
+
+    def close(self):
+        if self.dump_writer is not None:
+            self.dump_writer.submit(self.snapshot())
+            self.dump_writer.close()
+            self.dump_writer = None
+
+    # -----------------------------
+    # ON-SCREEN OVERLAY
+    # -----------------------------
+    def draw_overlay(self, surface, x=10, y=10):
+        import pygame
+
+        font = pygame.font.SysFont("consolas", 13)
+        lines = [f"tick {self.ticks}"]
+        for name, s in self.phases.items():
+            lines.append(
+                f"{name:<9} last {s.last * 1e3:6.2f}ms  mean {s.total * 1e3 / max(1, s.calls):6.2f}ms"
+                f"  p95 {s.percentile(0.95) * 1e3:6.2f}ms"
+            )
+        for name, n in self.tick_counters.items():
+            lines.append(f"{name:<14} {n}")
+
+        line_height = 15
+        bg = pygame.Surface((420, line_height * len(lines) + 8), pygame.SRCALPHA)
+        bg.fill((10, 10, 10, 200))
+        surface.blit(bg, (x, y))
+        for i, text in enumerate(lines):
+            surface.blit(font.render(text, True, (220, 220, 220)), (x + 6, y + 4 + i * line_height))
+
+
+class NullProfiler:
+    """Drop-in for Profiler that does nothing; the default for Simulation."""
+
+    enabled = False
+    overlay = False
+
+    def clock(self):
+        return 0.0
+
+    def lap(self, phase, t0):
+        return 0.0
+
+    def count(self, name, n=1):
+        pass
+
+    def end_tick(self):
+        pass
+
+    def snapshot(self):
+        return {}
+
+    def draw_overlay(self, surface, x=10, y=10):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
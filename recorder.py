@@ -0,0 +1,209 @@
+import bisect
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from writer import BackgroundWriter
+
+# ============================================================
+# File layout
+# ============================================================
+# header : magic, format version, record size, reserved
+# records: fixed size, appended in tick order
+#
+#   tick   u32   Simulation.frame: +1 per update, also across restore
+#   ident  u32   car id / light index
+#   kind   u8    KIND_CAR, KIND_LIGHT or KIND_CRASH
+#   flag   u8    light: 1 = green ; car: lane index
+#   x, y   f32   world position (px) / light stop point
+#   angle  f32   heading in degrees (car) / 0 (light)
+#   speed  f32   px/s (car) / time_since_switch (light)
+MAGIC = b"TRJ1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+RECORD = struct.Struct("<IIBBxxffff")
+
+KIND_CAR = 0
+KIND_LIGHT = 1
+KIND_CRASH = 2   # one record per car involved, written right before the episode reset
+
+Record = namedtuple("Record", "tick ident kind flag x y angle speed")
+
+
+def _encode_rows(rows):
+    pack = RECORD.pack
+    return b"".join([pack(*r) for r in rows])
+
+
+# ============================================================
+# Recorder (simulation side)
+# ============================================================
+class TrajectoryRecorder:
+    """
+    Appends per-tick car and light state to a fixed-record binary file.
+
+    The simulation thread only builds plain tuples; packing and disk I/O
+    happen on a background thread, in chunks of `chunk_records` rows.
+    """
+
+    def __init__(self, path, every=1, chunk_records=8192):
+        self.path = path
+        self.every = max(1, int(every))
+        self.chunk_records = chunk_records
+        self.rows = []
+        self.writer = BackgroundWriter(path, _encode_rows, mode="wb", name="trajectory-writer")
+        self.writer.write_now(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+
+    def record_tick(self, tick, cars, traffic_lights):
+        if tick % self.every:
+            return
+        rows = self.rows
+        append = rows.append
+        for car in cars:
+            append((tick, car.car_id, KIND_CAR, car.lane_index, car.x, car.y, car.angle, car.speed))
+        for i, tl in enumerate(traffic_lights):
+            lx, ly = tl.stop_point
+            append((tick, i, KIND_LIGHT, 1 if tl.green else 0, lx, ly, 0.0, tl.time_since_switch))
+        if len(rows) >= self.chunk_records:
+            self._hand_off()
+
+    def record_crash(self, tick, a, b):
+        for car in (a, b):
+            self.rows.append((tick, car.car_id, KIND_CRASH, car.lane_index, car.x, car.y, car.angle, car.speed))
+        # a crash is exactly what we want on disk even if the process dies next
+        self._hand_off()
+
+    def _hand_off(self):
+        if self.rows:
+            self.writer.submit(self.rows)
+            self.rows = []
+
+    def flush(self):
+        self._hand_off()
+        self.writer.flush()
+
+    def close(self):
+        self._hand_off()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ============================================================
+# Reader (replay / analysis side)
+# ============================================================
+class TrajectoryReader:
+    """
+    Memory-maps a trajectory file for random access.
+    A truncated trailing record (process killed mid-write) is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"{path}: not a trajectory file (too short)")
+
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rec_size, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: bad magic {magic!r}")
+        if version != VERSION or rec_size != RECORD.size:
+            raise ValueError(f"{path}: unsupported version {version} (record size {rec_size})")
+
+        self.count = (size - HEADER.size) // RECORD.size
+        self._tick_keys = _TickKeys(self)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return Record(*RECORD.unpack_from(self.mm, HEADER.size + i * RECORD.size))
+
+    def __iter__(self, chunk=65536):
+        for start in range(0, self.count, chunk):
+            stop = min(self.count, start + chunk)
+            raw = self.mm[HEADER.size + start * RECORD.size:HEADER.size + stop * RECORD.size]
+            for r in RECORD.iter_unpack(raw):
+                yield Record(*r)
+
+    def tick_at(self, i):
+        return struct.unpack_from("<I", self.mm, HEADER.size + i * RECORD.size)[0]
+
+    def tick_span(self):
+        if not self.count:
+            return None
+        return self.tick_at(0), self.tick_at(self.count - 1)
+
+    def index_range(self, first_tick, last_tick=None):
+        """[lo, hi) record indices covering first_tick..last_tick (binary search)."""
+        if last_tick is None:
+            last_tick = first_tick
+        lo = bisect.bisect_left(self._tick_keys, first_tick)
+        hi = bisect.bisect_right(self._tick_keys, last_tick, lo)
+        return lo, hi
+
+    def records_at(self, tick):
+        lo, hi = self.index_range(tick)
+        return [self[i] for i in range(lo, hi)]
+
+    def cars_at(self, tick):
+        return [r for r in self.records_at(tick) if r.kind == KIND_CAR]
+
+    def lights_at(self, tick):
+        return [r for r in self.records_at(tick) if r.kind == KIND_LIGHT]
+
+    def car_track(self, car_id, first_tick=0, last_tick=0xFFFFFFFF):
+        lo, hi = self.index_range(first_tick, last_tick)
+        out = []
+        for i in range(lo, hi):
+            r = self[i]
+            if r.ident == car_id and r.kind != KIND_LIGHT:
+                out.append(r)
+        return out
+
+    def crashes(self):
+        return [r for r in self if r.kind == KIND_CRASH]
+
+    def as_array(self):
+        """Zero-copy NumPy structured view of all records (requires numpy)."""
+        import numpy as np
+
+        dtype = np.dtype([
+            ("tick", "<u4"), ("ident", "<u4"), ("kind", "u1"), ("flag", "u1"), ("_pad", "V2"),
+            ("x", "<f4"), ("y", "<f4"), ("angle", "<f4"), ("speed", "<f4"),
+        ])
+        return np.frombuffer(self.mm, dtype=dtype, count=self.count, offset=HEADER.size)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TickKeys:
+    """Sequence view of record ticks so bisect can search the mmap directly."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return self.reader.count
+
+    def __getitem__(self, i):
+        return self.reader.tick_at(i)
@@ -0,0 +1,124 @@
+import pygame
+
+from config import WHITE
+
+# ============================================================
+# pygame frontend for the simulation core
+# ============================================================
+# Core modules (simulation, car, traffic_light, ...) never import pygame at
+# module level; their draw() methods import this module on first use.
+
+
+def draw_car(surf, car):
+    if car.reached:
+        return
+
+    car_surf = pygame.Surface((car.width, car.height), pygame.SRCALPHA)
+    car_surf.fill(car.color)
+
+    # scaled "nose" arrow so longer cars look right
+    nose = max(6, int(car.width * 0.18))
+    nose_back = max(12, int(car.width * 0.45))
+    pad = max(3, int(car.height * 0.20))
+    pygame.draw.polygon(
+        car_surf, (255, 240, 240),
+        [
+            (car.width - nose, car.height // 2),
+            (car.width - nose_back, pad),
+            (car.width - nose_back, car.height - pad),
+        ]
+    )
+
+    rot = pygame.transform.rotate(car_surf, -car.angle)
+    rect = rot.get_rect(center=(int(car.x), int(car.y)))
+    surf.blit(rot, rect)
+
+    # OPTIONAL DEBUG: draw rays (comment out if you want clean visuals)
+    # desired_heading = car.angle
+    # for ang in [desired_heading, desired_heading - 15, desired_heading + 15]:
+    #     rx = car.x + math.cos(math.radians(ang)) * max(80, int(car.width * 2.2))
+    #     ry = car.y + math.sin(math.radians(ang)) * max(80, int(car.width * 2.2))
+    #     pygame.draw.line(surf, (255, 255, 255), (car.x, car.y), (rx, ry), 1)
+
+
+def draw_light(surf, tl):
+    cx, cy = tl.stop_point
+    color = (0,200,0) if tl.green else (200,0,0)
+    pygame.draw.circle(surf, color, (cx, cy), 10)
+    font = pygame.font.SysFont(None, 20)
+    txt = font.render(str(tl.light_id), True, WHITE)
+    surf.blit(txt, (cx-6, cy-6))
+
+
+def draw_simulation(surface, sim):
+    # draw cars and lights
+    for car in sim.cars:
+        draw_car(surface, car)
+
+    for tl in sim.traffic_lights:
+        draw_light(surface, tl)
+
+    # RL panel
+    font = pygame.font.SysFont("consolas", 14)
+    title_font = pygame.font.SysFont("consolas", 16, bold=True)
+
+    line_height = 18
+    panel_width = 600
+    panel_height = line_height * (len(sim.traffic_lights) * 2 + 4)
+
+    panel_x = surface.get_width() - panel_width - 50
+    panel_y = 15
+
+    bg = pygame.Surface((panel_width, panel_height), pygame.SRCALPHA)
+    bg.fill((20, 20, 20, 220))
+    surface.blit(bg, (panel_x, panel_y))
+
+    title = title_font.render("RL Traffic Light Status", True, (255, 255, 255))
+    surface.blit(title, (panel_x + 14, panel_y + 2))
+
+    crash_text = font.render(f"Crashes: {sim.episode_crashes}", True, (220, 220, 220))
+    surface.blit(crash_text, (panel_x + 420, panel_y + 4))
+
+    y_offset = 27
+
+    for tl in sim.traffic_lights:
+        dbg = getattr(tl, "debug_info", None)
+        if dbg is None:
+            action, queue, reward = "reset", 0, 0
+        else:
+            try:
+                action, queue, reward = dbg
+            except Exception:
+                action, queue, reward = "reset", 0, 0
+
+        if not hasattr(tl, "total_reward"):
+            tl.total_reward = 0
+
+        color = (0, 200, 0) if action == "stay" else (230, 80, 80)
+
+        main_text = (
+            f"Light {getattr(tl, 'name', '?'):<5} | "
+            f"A:{str(action):<6} | "
+            f"Q:{int(queue):<2} | "
+            f"R:{int(reward):<3} | "
+            f"Score:{int(tl.total_reward):<6}"
+        )
+        line = font.render(main_text, True, color)
+        surface.blit(line, (panel_x + 14, panel_y + y_offset))
+        y_offset += line_height
+
+        p = getattr(tl, "penalties", None)
+        if not isinstance(p, dict):
+            p = {"queue": 0, "opp": 0, "switch": 0, "block": 0, "clear": 0}
+
+        penalty_text = (
+            f"      -> Penalties: "
+            f"Q:{p.get('queue', 0)}   "
+            f"Opp:{p.get('opp', 0)}   "
+            f"Sw:{p.get('switch', 0)}   "
+            f"Bl:{p.get('block', 0)}   "
+            f"Cl:{p.get('clear', 0)}"
+        )
+        penalty_line = font.render(penalty_text, True, (220, 220, 220))
+        surface.blit(penalty_line, (panel_x + 20, panel_y + y_offset))
+        y_offset += line_height + 4
@@ -2,8 +2,9 @@ import random
 import math
 
 class RLLightAgent:
-    def __init__(self, actions):
+    def __init__(self, actions, rng=None):
         self.actions = actions  # ["stay", "switch"]
+        self.rng = rng if rng is not None else random.Random()  # exploration stream
         self.Q = {}             # Q-table: Q[state][action]
         self.alpha = 0.1        # learning rate
         self.gamma = 0.9        # discount factor
@@ -16,8 +17,8 @@ class RLLightAgent:
 
     def choose_action(self, state):
         # Explore
-        if random.random() < self.epsilon:
-            return random.choice(self.actions)
+        if self.rng.random() < self.epsilon:
+            return self.rng.choice(self.actions)
 
         # Exploit
         q_vals = self.get_Q(state)
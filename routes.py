@@ -0,0 +1,249 @@
+import math
+
+from config import TILE, STOP_DISTANCE
+from lanes import route_lane_keys
+from pathfinding import bfs_find_path, lane_point_starts, tile_path_to_lane_points, tree_path
+
+
+def light_encounters(points, cum_length, lights, stop_distance=STOP_DISTANCE, tile_path=None, tile_starts=None):
+    """
+    Ordered (arc length, light index) pairs for the (index, light) candidates
+    whose stop point lies within stop_distance of the route polyline, at the
+    closest point. Indices refer to the simulation's traffic_lights list, so a
+    route can be shared by simulations with the same light layout.
+
+    Given the tile path and its lane_point_starts (and stop_distance < 0.7 TILE),
+    only segments starting at a point of a path tile within 2 tiles of the stop
+    point's tile are measured: lane points stay within 0.8 TILE of their tile's
+    centre and path tiles are adjacent, so every point of any other segment is
+    over 0.7 TILE from the stop point.
+    """
+    n = len(points)
+    owners = None
+    if tile_path is not None and stop_distance < 0.7 * TILE:
+        owners = {}
+        for k, t in enumerate(tile_path):
+            owners.setdefault(t, []).append(k)
+    out = []
+    for idx, tl in lights:
+        lx, ly = tl.stop_point
+        best_d = stop_distance
+        best_s = None
+        if owners is None:
+            segments = range(1, n)
+        else:
+            tx, ty = int(lx // TILE), int(ly // TILE)
+            near = sorted(k for dy in range(-2, 3) for dx in range(-2, 3) for k in owners.get((tx + dx, ty + dy), ()))
+            segments = [i for k in near for i in range(tile_starts[k] + 1, min(n, tile_starts[k + 1] + 1))]
+        for i in segments:
+            (ax, ay), (bx, by) = points[i - 1], points[i]
+            sx, sy = bx - ax, by - ay
+            seg = cum_length[i] - cum_length[i - 1]
+            t = 0.0
+            if seg > 0:
+                t = max(0.0, min(1.0, ((lx - ax) * sx + (ly - ay) * sy) / (seg * seg)))
+            d = math.hypot(ax + sx * t - lx, ay + sy * t - ly)
+            if d < best_d:
+                best_d = d
+                best_s = cum_length[i - 1] + seg * t
+        if best_s is not None:
+            out.append((best_s, idx))
+    out.sort(key=lambda e: e[0])
+    return tuple(out)
+
+
+class Route:
+    """
+    Immutable, shared route geometry. Every car driving the same
+    (start, goal, lane) references one Route instead of its own lists.
+    """
+
+    __slots__ = ("key", "tile_path", "tiles", "points", "tile_starts", "cum_length", "length", "lane_keys", "lights")
+
+    def __init__(self, key, tile_path, points, lights=()):
+        # lights: candidate (index, TrafficLight) pairs
+        self.key = key
+        self.tile_path = tile_path
+        self.tiles = frozenset(tile_path)
+        self.points = points
+        self.tile_starts = lane_point_starts(tile_path)  # tile i owns points[tile_starts[i]:tile_starts[i + 1]]
+
+        # cumulative arc length at each waypoint
+        cum = [0.0]
+        for i in range(1, len(points)):
+            (ax, ay), (bx, by) = points[i - 1], points[i]
+            cum.append(cum[-1] + math.hypot(bx - ax, by - ay))
+        self.cum_length = cum
+        self.length = cum[-1]
+
+        self.lane_keys = route_lane_keys(tile_path, key[2])
+
+        # traffic lights met along the way: (arc length of stop point, light index)
+        self.lights = light_encounters(points, cum, lights, tile_path=tile_path, tile_starts=self.tile_starts)
+
+
+class RouteTable:
+    """
+    Cache of tile paths and lane geometry keyed by (start, goal[, lane]).
+    Uses a CompiledMap's precomputed portal routes when available, BFS otherwise.
+
+    After a map edit (see map_edit.py) every newly built Route gets a unique
+    key, so caches keyed by route key (junction crossings, link interaction
+    points) never mix geometry from before and after the edit.
+    """
+
+    def __init__(self, grid, compiled=None, traffic_lights=()):
+        self.grid = grid
+        self.compiled = compiled
+        self.tile_paths = {}   # (start, goal) -> tile path ([] = unreachable)
+        self.routes = {}       # (start, goal, lane) -> Route
+        self.through = {}      # tile -> {(start, goal)} whose cached tile path crosses it
+        self.adopted = {}      # (start, goal, lane, tile path) -> Route off the table's path
+        self.bfs_calls = 0
+        self.edits = 0         # map edits seen
+        self.built = 0         # routes built with a unique key
+        self.set_lights(traffic_lights)
+
+    def set_lights(self, traffic_lights):
+        """Index lights by the tile of their stop point; drops cached routes."""
+        self.light_tiles = {}
+        for idx, tl in enumerate(traffic_lights):
+            lx, ly = tl.stop_point
+            self.light_tiles.setdefault((int(lx // TILE), int(ly // TILE)), []).append((idx, tl))
+        self.routes.clear()
+
+    def lights_near(self, tile_path):
+        """(index, light) pairs whose stop point is on or next to (8-neighbourhood) a path tile."""
+        found = []
+        if not self.light_tiles:
+            return found
+        seen = set()
+        for x, y in tile_path:
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    t = (x + dx, y + dy)
+                    if t in seen:
+                        continue
+                    seen.add(t)
+                    for entry in self.light_tiles.get(t, ()):
+                        if entry not in found:
+                            found.append(entry)
+        return found
+
+    def tile_path(self, start, goal):
+        key = (start, goal)
+        path = self.tile_paths.get(key)
+        if path is None:
+            if self.compiled is not None:
+                path = self.compiled.route(start, goal)
+            if path is None:
+                path = bfs_find_path(start, goal, self.grid)
+                self.bfs_calls += 1
+            self.tile_paths[key] = path
+            through = self.through
+            for t in path:
+                keys = through.get(t)
+                if keys is None:
+                    keys = through[t] = set()
+                keys.add(key)
+        return path
+
+    def build(self, key, tile_path, lane_index, unique=False):
+        """Route over tile_path; the key gets a serial number once the map has been edited (or if unique)."""
+        if unique or self.edits:
+            self.built += 1
+            key = key + (self.built,)
+        points = tile_path_to_lane_points(tile_path, lane_index=lane_index, grid=self.grid)
+        return Route(key, tile_path, points, self.lights_near(tile_path))
+
+    def get(self, start, goal, lane_index=0):
+        key = (start, goal, lane_index)
+        route = self.routes.get(key)
+        if route is None:
+            route = self.routes[key] = self.build(key, self.tile_path(start, goal), lane_index)
+        return route
+
+    def adopt(self, start, goal, lane_index, tile_path):
+        """Route over an explicit tile path (rerouted cars, restored snapshots)."""
+        route = self.routes.get((start, goal, lane_index))
+        if route is not None and route.tile_path == tile_path:
+            return route
+        key = (start, goal, lane_index, tuple(tile_path))
+        route = self.adopted.get(key)
+        if route is None:
+            route = self.adopted[key] = self.build((start, goal, lane_index), list(tile_path), lane_index, unique=True)
+        return route
+
+    def detour(self, route, keep, tree):
+        """
+        Route following route.tile_path up to index keep and then the
+        bfs_tree_to tree of its goal; None if that tile cannot reach the goal.
+        """
+        rest = tree_path(tree, route.tile_path[keep])
+        if not rest:
+            return None
+        start, goal, lane_index = route.key[:3]
+        return self.adopt(start, goal, lane_index, route.tile_path[:keep] + rest)
+
+    # -----------------------------
+    # MAP EDITS
+    # -----------------------------
+    def invalidate(self, tile, opened=False):
+        """
+        Drop cached paths and routes through an edited tile and, if the edit
+        opened a move, every path it could shorten or make possible (Manhattan
+        detour bound). Returns the dropped (start, goal) pairs. The compiled
+        map checks its own routes against the edit (CompiledMap.set_code).
+        """
+        self.edits += 1
+        dropped = set(self.through.get(tile, ()))
+        if opened:
+            tx, ty = tile
+            for key, path in self.tile_paths.items():
+                (sx, sy), (gx, gy) = key
+                if not path or abs(sx - tx) + abs(sy - ty) + abs(gx - tx) + abs(gy - ty) < len(path) - 1:
+                    dropped.add(key)
+        through = self.through
+        for key in dropped:
+            for t in self.tile_paths.pop(key):
+                keys = through.get(t)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del through[t]
+        self._drop_routes(dropped)
+        for key in [k for k, r in self.adopted.items() if tile in r.tiles]:
+            del self.adopted[key]
+        return dropped
+
+    def refresh(self, tiles):
+        """Rebuild (under new keys) the cached routes through tiles; their tile paths stay valid."""
+        self.edits += 1
+        pairs = set()
+        for t in tiles:
+            pairs.update(self.through.get(t, ()))
+        self._drop_routes(pairs)
+
+    def _drop_routes(self, pairs):
+        if pairs:
+            for key in [k for k in self.routes if k[:2] in pairs]:
+                del self.routes[key]
+
+    def copy(self, grid, compiled=None):
+        """Table over an edited copy of the map (see map_edit.py); cached Routes are shared."""
+        other = RouteTable(grid, compiled)
+        other.light_tiles = self.light_tiles
+        other.tile_paths = dict(self.tile_paths)
+        other.routes = dict(self.routes)
+        other.through = {t: set(keys) for t, keys in self.through.items()}
+        other.adopted = dict(self.adopted)
+        other.bfs_calls = self.bfs_calls
+        other.edits = self.edits
+        other.built = self.built  # new keys never match a route a car already holds
+        return other
+
+    def clear(self):
+        self.tile_paths.clear()
+        self.routes.clear()
+        self.through.clear()
+        self.adopted.clear()
@@ -1,25 +1,82 @@
+import copy
 import math
 import random
-import pygame
 
-from config import MAX_ACTIVE_CARS, SPAWN_INTERVAL_MS, MAX_SPAWN_TRIES, CAR_COLORS, ROAD_MAP
-from pathfinding import bfs_find_path
-from car import Car
+from config import (
+    MAX_ACTIVE_CARS, SPAWN_INTERVAL_MS, MAX_SPAWN_TRIES, CAR_COLORS, ROAD_MAP, REWARD_WEIGHTS, MIN_HOLD,
+    SUBSTEP_PX, MAX_SUBSTEPS, TILE,
+)
+from utils import rects_overlap, swept_rects_overlap
+from car import CarPool, MAX_CAR_LENGTH
+from routes import RouteTable
+from lanes import LaneOccupancy
+from occupancy import TileOccupancy
+from intersections import IntersectionManager
+from meso import MesoModel
 from rl_agent import RLLightAgent
+from profiler import NULL_PROFILER
+import snapshot
+import map_edit
 
 
 class Simulation:
-    def __init__(self, traffic_lights, portals):
+    def __init__(self, traffic_lights, portals, recorder=None, metrics=None, profiler=None,
+                 grid=None, max_active_cars=MAX_ACTIVE_CARS, spawn_interval_ms=SPAWN_INTERVAL_MS,
+                 reset_on_crash=True, routes=None, raycast_only=False, intersections=True,
+                 hybrid=False, demand=None, seed=None, rewards=None, min_hold=MIN_HOLD, live=None,
+                 heatmap=None):
         self.cars = []
         self.traffic_lights = traffic_lights
         self.portals = portals
         self.portal_ids = list(portals.keys())
-        self.last_spawn_time = pygame.time.get_ticks()
-
-        self.rl_agent = RLLightAgent(actions=["stay", "switch"])
+        self.grid = grid if grid is not None else ROAD_MAP
+        self.routes = routes  # optional CompiledMap: precomputed portal-to-portal routes
+        self.route_table = RouteTable(self.grid, routes, traffic_lights)
+        self.pool = CarPool()
+        self.lanes = LaneOccupancy(self.grid, raycast_only=raycast_only)
+        self.occupancy = TileOccupancy()
+        # junction tile-time reservations (None = cars negotiate junctions with raycasts only)
+        self.junctions = IntersectionManager(self.lanes) if intersections else None
+        # hybrid mode: free-flowing cars on plain links use the cheap link model
+        self.meso = MesoModel(self.lanes, self.junctions) if hybrid else None
+
+        self.max_active_cars = max_active_cars
+        self.spawn_interval_ms = spawn_interval_ms
+        self.reset_on_crash = reset_on_crash  # benchmarks keep running through crashes
+        self.last_spawn_time = 0.0  # ms of simulation time
+        self.demand = demand  # optional DemandModel: replaces the fixed-interval spawner
+
+        # independent random streams (spawning, car personalities, exploration);
+        # seed=None draws fresh entropy, any other value makes runs reproducible
+        self.seed = seed
+        self.rng = random.Random()
+        self.car_rng = random.Random()
+        self.rl_agent = RLLightAgent(actions=["stay", "switch"], rng=random.Random())
+        if seed is not None:
+            self.reseed(seed)
+        self.reset_snapshot = None  # reset_episode restores this instead of emptying the map
 
         self.last_sa = {}  # tl -> (state, action)
         self.episode_crashes = 0
+        self.controlled_lights = traffic_lights  # lights the agent decides (a region worker mirrors the rest)
+        self.ghosts = []  # read-only neighbour cars (partitioned mode): seen by others, never stepped
+        self.rewards = dict(REWARD_WEIGHTS, **(rewards or {}))
+        self.min_hold = min_hold
+
+        self.tick = 0
+        self.frame = 0       # updates run by this object: restore moves tick back, never this
+        self.sim_time = 0.0  # seconds, sum of dt
+        self.next_car_id = 0
+        self.recorder = recorder  # optional TrajectoryRecorder
+        self.metrics = metrics    # optional TripMetrics
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.live = live          # optional LiveServer: state stream + control commands
+        self.heatmap = heatmap    # optional TileStats: decayed per-tile congestion statistics
+        self.paused = False       # set by live pause/resume commands
+        self.step_ticks = 0       # ticks still to run while paused
+        self.dirty_tiles = set()  # tiles edited since the map layer was last redrawn
+        self.closed_tiles = {}    # tile -> code it had before map_edit.close_tile
+        self.map_shared = False   # grid, compiled map and route table shared with a fork (copied on edit)
 
         # Make sure panel does not crash at start
         for tl in self.traffic_lights:
@@ -32,31 +89,67 @@ class Simulation:
     # HELPERS
     # -----------------------------
     def detect_crash(self):
-        n = len(self.cars)
-        for i in range(n):
-            a = self.cars[i]
-            if getattr(a, "reached", False):
+        # link (meso) cars keep FIFO order and spacing on plain road: not checked
+        cars = [c for c in self.cars if not c.reached and not c.meso]
+        # swept test over the whole tick, so fast cars cannot pass through each other
+        boxes = []
+        tiles = []
+        buckets = {}  # tile -> indices of the cars whose swept box touches it
+        for i, c in enumerate(cars):
+            x, y, w, h = c.get_rect()
+            dx, dy = c.x - c.prev_x, c.y - c.prev_y
+            sweep = (x - dx if dx > 0 else x, y - dy if dy > 0 else y, w + abs(dx), h + abs(dy))
+            boxes.append(((x, y, w, h), dx, dy, sweep))
+            sx, sy, sw, sh = sweep
+            touched = [(tx, ty)
+                       for ty in range(int(sy // TILE), int((sy + sh) // TILE) + 1)
+                       for tx in range(int(sx // TILE), int((sx + sw) // TILE) + 1)]
+            for t in touched:
+                bucket = buckets.get(t)
+                if bucket is None:
+                    buckets[t] = [i]
+                else:
+                    bucket.append(i)
+            tiles.append(touched)
+        # overlapping boxes share a tile; pairs are tested in (i, j) order, so
+        # the pair reported is the first one an all-pairs scan would find
+        for i, touched in enumerate(tiles):
+            if len(touched) == 1:
+                others = [j for j in buckets[touched[0]] if j > i]
+            else:
+                others = sorted({j for t in touched for j in buckets[t] if j > i})
+            if not others:
                 continue
-            ra = a.get_rect()
-            for j in range(i + 1, n):
-                b = self.cars[j]
-                if getattr(b, "reached", False):
-                    continue
-                if ra.colliderect(b.get_rect()):
-                    return a, b
+            ra, adx, ady, sa = boxes[i]
+            for j in others:
+                rb, bdx, bdy, sb = boxes[j]
+                if rects_overlap(*sa, *sb) and swept_rects_overlap(*ra, *rb, adx - bdx, ady - bdy):
+                    return cars[i], cars[j]
         return None, None
 
     def reset_episode(self):
+        if self.reset_snapshot is not None:
+            # restart from a saved (e.g. congested) state; learning and counters carry on
+            tick, crashes = self.tick, self.episode_crashes
+            self.restore(self.reset_snapshot, agent=False)
+            self.tick, self.episode_crashes = tick, crashes
+            return
+
+        self.lanes.clear()
+        self.occupancy.clear()
+        if self.junctions is not None:
+            self.junctions.clear()
+        self.pool.release_all(self.cars)
         self.cars.clear()
-        self.last_spawn_time = pygame.time.get_ticks()
+        self.last_spawn_time = self.sim_time * 1000.0
         self.last_sa.clear()
 
         for tl in self.traffic_lights:
             # If you added tl.reset(...) use it, otherwise fallback
             if hasattr(tl, "reset"):
-                tl.reset(start_green=random.choice([True, False]))
+                tl.reset(start_green=self.rng.choice([True, False]))
             else:
-                tl.green = random.choice([True, False])
+                tl.green = self.rng.choice([True, False])
                 tl.prev_green = tl.green
                 tl.time_since_switch = 0
 
@@ -67,24 +160,134 @@ class Simulation:
             tl.debug_info = ("reset", 0, 0)
             tl.penalties = {"queue": 0, "opp": 0, "switch": 0, "block": 0, "clear": 0}
 
-    def get_queue_near_light(self, tl, radius=80):
-        queue = 0
-        lx, ly = tl.stop_point
+    def penalize_crash(self):
+        """Crash penalty on every light's last decision."""
+        crash_penalty = -self.rewards["crash"]
+        for tl in self.traffic_lights:
+            sa = self.last_sa.get(tl)
+            if sa is not None:
+                s, act = sa
+                self.rl_agent.update(s, act, crash_penalty, s)
+                self.profiler.count("q_updates")
+
+    # -----------------------------
+    # SEEDING / SNAPSHOTS
+    # -----------------------------
+    def reseed(self, seed):
+        self.seed = seed
+        self.rng.seed(f"{seed}:spawn")
+        self.car_rng.seed(f"{seed}:cars")
+        self.rl_agent.rng.seed(f"{seed}:agent")
+        if self.demand is not None:
+            self.demand.rng.seed(f"{seed}:demand")
+
+    def snapshot(self):
+        """Compact, picklable copy of the full simulation state (see snapshot.py)."""
+        return snapshot.take(self)
+
+    def restore(self, snap, agent=True):
+        snapshot.restore(self, snap, agent)
+
+    def fork(self, snap=None, seed=None):
+        """
+        Independent simulation started from snap (default: the current state).
+        Map, compiled routes and the route cache are shared until either side
+        edits the map (map_edit copies them first); lights, cars and RNG
+        streams are not shared. seed reseeds the fork for what-if rollouts.
+        """
+        if snap is None:
+            snap = self.snapshot()
+        demand = None
+        if self.demand is not None:
+            demand = copy.copy(self.demand)
+            demand.rng = random.Random()
+        other = Simulation(
+            [copy.copy(tl) for tl in self.traffic_lights], self.portals,
+            grid=self.grid, routes=self.routes,
+            max_active_cars=self.max_active_cars, spawn_interval_ms=self.spawn_interval_ms,
+            reset_on_crash=self.reset_on_crash, raycast_only=self.lanes.raycast_only,
+            intersections=self.junctions is not None, hybrid=self.meso is not None,
+            demand=demand, seed=self.seed, rewards=self.rewards, min_hold=self.min_hold,
+        )
+        agent = self.rl_agent
+        other.rl_agent.alpha, other.rl_agent.gamma, other.rl_agent.epsilon = agent.alpha, agent.gamma, agent.epsilon
+        other.route_table = self.route_table  # routes reference lights by index only
+        self.map_shared = other.map_shared = True
+        other.restore(snap)
+        if seed is not None:
+            other.reseed(seed)
+        return other
+
+    # -----------------------------
+    # MAP EDITS
+    # -----------------------------
+    def set_tile(self, tile, code):
+        """Change one tile code while running; reroutes affected cars (see map_edit.py)."""
+        return map_edit.set_tile(self, tile, code)
+
+    def substeps(self, dt):
+        """
+        Physics sub-steps for this tick: enough that no car moves more than
+        SUBSTEP_PX and no gap to a lane leader closes by more than half per
+        sub-step (capped at MAX_SUBSTEPS). Also records each car's
+        start-of-tick position for the swept crash check and resets its
+        per-tick ray test count.
+        """
+        rate = 0.0  # sub-steps per second
+        headway = self.lanes.headway
         for car in self.cars:
-            if not getattr(car, "has_cleared_light", False):
-                if math.hypot(car.x - lx, car.y - ly) < radius:
-                    queue += 1
-        return queue
+            car.prev_x, car.prev_y = car.x, car.y
+            car.ray_tests = 0
+            if car.meso:
+                continue
+            v = min(car.max_speed, car.speed + car.accel * dt)
+            r = v / SUBSTEP_PX
+            lead = car.lane_ahead
+            if lead is not None and v > lead.speed:
+                r = max(r, (v - lead.speed) * 2.0 / max(headway(car, lead), 2.0))
+            if r > rate:
+                rate = r
+        return max(1, min(MAX_SUBSTEPS, math.ceil(rate * dt)))
+
+    def get_queue_near_light(self, tl, approaches=False):
+        return self.occupancy.light_queue(tl, approaches)
 
     def get_cars_cleared(self, old_q, new_q):
         return max(0, old_q - new_q)
 
-    def is_intersection_blocked(self):
-        for car in self.cars:
-            if 250 < car.x < 450 and 250 < car.y < 450:
-                if car.speed < 10:
-                    return True
-        return False
+    def is_intersection_blocked(self, tl):
+        return self.occupancy.light_blocked(tl)
+
+    def add_car(self, car):
+        """Put a spawned car on the road: id, trip clock and lane registration."""
+        car.car_id = self.next_car_id
+        car.spawn_time = self.sim_time
+        self.next_car_id += 1
+        self.cars.append(car)
+        self.lanes.add(car)
+        self.occupancy.add(car)
+
+    def route_path(self, start_tile, goal_tile):
+        bfs_before = self.route_table.bfs_calls
+        tile_path = self.route_table.tile_path(start_tile, goal_tile)
+        self.profiler.count("bfs_calls", self.route_table.bfs_calls - bfs_before)
+        return tile_path
+
+    def spawn_car(self, start_tile, goal_tile):
+        """
+        Pooled car for a routable start/goal, or None while its entry lane is
+        full. A backed-up portal is detected before a car is taken from the
+        pool or a random number is drawn.
+        """
+        table = self.route_table
+        sx, sy = start_tile
+        lanes = (0, 1) if self.grid[sy][sx] == -10 else (0,)
+        free = [i for i in lanes if self.lanes.entry_clear(table.get(start_tile, goal_tile, i), MAX_CAR_LENGTH)]
+        if not free:
+            return None  # spawning now would drop the car onto the queue
+        lane = free[0] if len(free) == 1 else self.car_rng.randint(0, 1)
+        color = self.rng.choice(CAR_COLORS)
+        return self.pool.acquire(start_tile, goal_tile, color, self.traffic_lights, table, self.car_rng, lane)
 
     def spawn_car_random(self):
         if len(self.portal_ids) < 2:
@@ -92,19 +295,17 @@ class Simulation:
 
         tries = 0
         while tries < MAX_SPAWN_TRIES:
-            start_id = random.choice(self.portal_ids)
-            goal_id = random.choice(self.portal_ids)
+            start_id = self.rng.choice(self.portal_ids)
+            goal_id = self.rng.choice(self.portal_ids)
             if start_id == goal_id:
                 tries += 1
                 continue
 
-            start_tile = random.choice(self.portals[start_id])
-            goal_tile = random.choice(self.portals[goal_id])
+            start_tile = self.rng.choice(self.portals[start_id])
+            goal_tile = self.rng.choice(self.portals[goal_id])
 
-            tile_path = bfs_find_path(start_tile, goal_tile, ROAD_MAP)
-            if tile_path:
-                color = random.choice(CAR_COLORS)
-                return Car(start_tile, goal_tile, color, self.traffic_lights)
+            if self.route_path(start_tile, goal_tile):
+                return self.spawn_car(start_tile, goal_tile)
 
             tries += 1
 
@@ -114,22 +315,32 @@ class Simulation:
     # MAIN UPDATE LOOP
     # -----------------------------
     def update(self, dt):
-        now = pygame.time.get_ticks()
+        if self.live is not None and not self.live.apply_commands(self):
+            return  # paused
+        prof = self.profiler
+        t = prof.clock()
+        self.tick += 1
+        self.frame += 1
+        self.sim_time += dt
+        now = self.sim_time * 1000.0
 
         # spawn cars
-        if len(self.cars) < MAX_ACTIVE_CARS and now - self.last_spawn_time >= SPAWN_INTERVAL_MS:
+        if self.demand is not None:
+            prof.count("spawned", self.demand.release(self))
+        elif len(self.cars) < self.max_active_cars and now - self.last_spawn_time >= self.spawn_interval_ms:
             car = self.spawn_car_random()
             if car:
-                self.cars.append(car)
+                self.add_car(car)
             self.last_spawn_time = now
+        t = prof.lap("spawn", t)
 
         # -------------------------
         # RL LOOP FOR EACH LIGHT
         # Decide actions first, then move cars, then detect crash
         # -------------------------
-        for tl in self.traffic_lights:
+        for tl in self.controlled_lights:
             queue = self.get_queue_near_light(tl)
-            opp_queue = self.get_queue_near_light(tl, radius=130)
+            opp_queue = self.get_queue_near_light(tl, approaches=True)
             time_since = min(getattr(tl, "time_since_switch", 0), 10)
             is_green = int(getattr(tl, "green", True))
 
@@ -139,138 +350,126 @@ class Simulation:
             self.last_sa[tl] = (state, action)
 
             # Apply action
-            tl.update_with_rl(action)
+            tl.update_with_rl(action, self.min_hold)
 
             # Reward
             old_queue = queue
             new_queue = self.get_queue_near_light(tl)
             cleared = self.get_cars_cleared(old_queue, new_queue)
-            blocked = self.is_intersection_blocked()
+            blocked = self.is_intersection_blocked(tl)
 
-            reward = (
-                cleared * 2
-                - new_queue
-                - opp_queue * 0.5
-                - (2 if getattr(tl, "time_since_switch", 0) == 0 else 0)
-                - (5 if blocked else 0)
-            )
+            w = self.rewards
+            switched = getattr(tl, "time_since_switch", 0) == 0
+            tl.penalties = {
+                "queue": -new_queue * w["queue"],
+                "opp": -opp_queue * w["opp"],
+                "switch": -(w["switch"] if switched else 0),
+                "block": -(w["block"] if blocked else 0),
+                "clear": cleared * w["clear"],
+            }
+            reward = sum(tl.penalties.values())
 
             if not hasattr(tl, "total_reward"):
                 tl.total_reward = 0
             tl.total_reward += reward
 
-            tl.penalties = {
-                "queue": -new_queue,
-                "opp": -opp_queue * 0.5,
-                "switch": -(2 if getattr(tl, "time_since_switch", 0) == 0 else 0),
-                "block": -(5 if blocked else 0),
-                "clear": cleared * 2,
-            }
-
             tl.debug_info = (action, new_queue, int(reward))
 
             next_queue = min(new_queue, 5)
-            next_opp_queue = min(self.get_queue_near_light(tl, radius=130), 5)
+            next_opp_queue = min(self.get_queue_near_light(tl, approaches=True), 5)
             next_time_since = min(getattr(tl, "time_since_switch", 0), 10)
             next_green = int(getattr(tl, "green", True))
             next_state = (next_queue, next_opp_queue, next_time_since, next_green)
 
             self.rl_agent.update(state, action, reward, next_state)
+            prof.count("q_updates")
+        t = prof.lap("lights", t)
 
         # update cars
-        for car in self.cars:
-            car.update(dt, self.cars)
+        occupancy = self.occupancy
+        junctions = self.junctions
+        meso = self.meso
+        others = self.cars + self.ghosts if self.ghosts else self.cars
+        steps = self.substeps(dt)
+        h = dt / steps
+        last = steps - 1
+        for step in range(steps):
+            if junctions is not None:
+                junctions.now = self.sim_time - h * (last - step)
+            for car in self.cars:
+                if car.meso:
+                    if step:
+                        continue  # link cars move once per tick
+                    if meso.advance(car, dt):
+                        occupancy.update(car)
+                        continue
+                car.update(h, others, self.lanes, junctions)
+                occupancy.update(car)
+                if meso is not None and step == last:
+                    meso.try_demote(car)
+        if prof.enabled:
+            prof.count("substeps", steps)
+            prof.count("cars_updated", len(self.cars))
+            prof.count("ray_tests", sum(c.ray_tests for c in self.cars))
+            if meso is not None:
+                prof.count("meso_cars", sum(1 for c in self.cars if c.meso))
+        t = prof.lap("cars", t)
+
+        if self.heatmap is not None:
+            self.heatmap.update(self.cars, dt, self.sim_time)
+            t = prof.lap("heatmap", t)
+
+        # remove reached (in place, finished cars go back to the pool)
+        cars = self.cars
+        keep = 0
+        for c in cars:
+            if c.reached:
+                if self.metrics is not None:
+                    self.metrics.record_trip(c, self.sim_time)
+                self.lanes.remove(c)
+                self.occupancy.remove(c)
+                if junctions is not None:
+                    junctions.remove(c)
+                self.pool.release(c)
+            else:
+                cars[keep] = c
+                keep += 1
+        del cars[keep:]
+        t = prof.lap("rebuild", t)
 
-        # remove reached
-        self.cars = [c for c in self.cars if not getattr(c, "reached", False)]
+        if self.recorder is not None:
+            self.recorder.record_tick(self.frame, self.cars, self.traffic_lights)
+            t = prof.lap("record", t)
 
         # crash detection after movement
         a, b = self.detect_crash()
+        t = prof.lap("crash", t)
         if a is not None:
             self.episode_crashes += 1
+            if self.recorder is not None:
+                self.recorder.record_crash(self.frame, a, b)
+            if self.metrics is not None:
+                self.metrics.record_crash(self.sim_time)
 
-            crash_penalty = -200.0
-            for tl in self.traffic_lights:
-                sa = self.last_sa.get(tl)
-                if sa is not None:
-                    s, act = sa
-                    self.rl_agent.update(s, act, crash_penalty, s)
+            self.penalize_crash()
 
-            self.reset_episode()
-            return
+            if self.reset_on_crash:
+                self.reset_episode()
+
+        if self.live is not None:
+            self.live.publish(self)
+            prof.lap("live", t)
+        prof.end_tick()
 
     # -----------------------------
     # DRAW FUNCTION
     # -----------------------------
     def draw(self, surface):
-        # draw cars and lights
-        for car in self.cars:
-            car.draw(surface)
-
-        for tl in self.traffic_lights:
-            tl.draw(surface)
-
-        # RL panel
-        font = pygame.font.SysFont("consolas", 14)
-        title_font = pygame.font.SysFont("consolas", 16, bold=True)
-
-        line_height = 18
-        panel_width = 600
-        panel_height = line_height * (len(self.traffic_lights) * 2 + 4)
-
-        panel_x = surface.get_width() - panel_width - 50
-        panel_y = 15
+        from render import draw_simulation
 
-        bg = pygame.Surface((panel_width, panel_height), pygame.SRCALPHA)
-        bg.fill((20, 20, 20, 220))
-        surface.blit(bg, (panel_x, panel_y))
-
-        title = title_font.render("RL Traffic Light Status", True, (255, 255, 255))
-        surface.blit(title, (panel_x + 14, panel_y + 2))
-
-        crash_text = font.render(f"Crashes: {self.episode_crashes}", True, (220, 220, 220))
-        surface.blit(crash_text, (panel_x + 420, panel_y + 4))
-
-        y_offset = 27
-
-        for tl in self.traffic_lights:
-            dbg = getattr(tl, "debug_info", None)
-            if dbg is None:
-                action, queue, reward = "reset", 0, 0
-            else:
-                try:
-                    action, queue, reward = dbg
-                except Exception:
-                    action, queue, reward = "reset", 0, 0
-
-            if not hasattr(tl, "total_reward"):
-                tl.total_reward = 0
+        t = self.profiler.clock()
+        draw_simulation(surface, self)
 
-            color = (0, 200, 0) if action == "stay" else (230, 80, 80)
-
-            main_text = (
-                f"Light {getattr(tl, 'name', '?'):<5} | "
-                f"A:{str(action):<6} | "
-                f"Q:{int(queue):<2} | "
-                f"R:{int(reward):<3} | "
-                f"Score:{int(tl.total_reward):<6}"
-            )
-            line = font.render(main_text, True, color)
-            surface.blit(line, (panel_x + 14, panel_y + y_offset))
-            y_offset += line_height
-
-            p = getattr(tl, "penalties", None)
-            if not isinstance(p, dict):
-                p = {"queue": 0, "opp": 0, "switch": 0, "block": 0, "clear": 0}
-
-            penalty_text = (
-                f"      -> Penalties: "
-                f"Q:{p.get('queue', 0)}   "
-                f"Opp:{p.get('opp', 0)}   "
-                f"Sw:{p.get('switch', 0)}   "
-                f"Bl:{p.get('block', 0)}   "
-                f"Cl:{p.get('clear', 0)}"
-            )
-            penalty_line = font.render(penalty_text, True, (220, 220, 220))
-            surface.blit(penalty_line, (panel_x + 20, panel_y + y_offset))
-            y_offset += line_height + 4
+        if self.profiler.overlay:
+            self.profiler.draw_overlay(surface)
+        self.profiler.lap("draw", t)
@@ -0,0 +1,208 @@
+"""
+Simulation snapshots: capture, restore and fork.
+
+A Snapshot is plain, picklable data. Cars are stored column-wise, and lights
+and routes are referenced by index and route key, so taking one costs
+O(cars + Q-table) and restoring rebuilds the derived indexes (lane queues,
+tile occupancy, junction reservations) from it. Cars rerouted by a map edit
+(see map_edit.py) also keep their tile path. Outputs (recorder, metrics,
+profiler) are not part of the state.
+"""
+from collections import deque
+
+from intersections import _Booking
+
+# Car slots copied verbatim (everything that is not a reference or a derived index)
+CAR_FIELDS = (
+    "start_tile", "goal_tile", "color", "car_id",
+    "spawn_time", "stop_time", "light_wait", "light_waits",
+    "blocked_by_car", "block_gap", "release_gap",
+    "width", "height", "max_speed", "speed", "car_type",
+    "prev_dir", "reached", "has_cleared_light",
+    "lane_index", "light_idx", "x", "y", "angle", "target_index", "prev_x", "prev_y", "tile_idx",
+    "meso", "meso_pos", "meso_end",
+)
+
+LIGHT_FIELDS = ("green", "prev_green", "time_since_switch", "total_reward")
+
+
+class Snapshot:
+    __slots__ = (
+        "tick", "sim_time", "next_car_id", "last_spawn_time", "episode_crashes",
+        "rng", "car_rng", "agent_rng",
+        "cars", "control", "paths", "queues", "bookings",
+        "lights", "last_sa", "q_table", "junction_stats", "demand",
+    )
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        state.setdefault("paths", ())  # taken before map edits existed
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def __len__(self):
+        return len(self.cars[0]) if self.cars else 0
+
+
+# ============================================================
+# Capture
+# ============================================================
+def take(sim):
+    snap = Snapshot()
+    snap.tick = sim.tick
+    snap.sim_time = sim.sim_time
+    snap.next_car_id = sim.next_car_id
+    snap.last_spawn_time = sim.last_spawn_time
+    snap.episode_crashes = sim.episode_crashes
+    snap.rng = sim.rng.getstate()
+    snap.car_rng = sim.car_rng.getstate()
+    snap.agent_rng = sim.rl_agent.rng.getstate()
+
+    cars = sim.cars
+    index = {id(c): i for i, c in enumerate(cars)}
+    light_index = {id(tl): i for i, tl in enumerate(sim.traffic_lights)}
+    snap.cars = tuple(tuple(getattr(c, f) for c in cars) for f in CAR_FIELDS)
+    snap.control = tuple(
+        light_index[id(c.control_light)] if c.control_light is not None else -1 for c in cars
+    )
+    # cars not on the table's route for their trip (rerouted after a map edit)
+    routes = sim.route_table.routes
+    snap.paths = tuple(
+        (i, tuple(c.tile_path)) for i, c in enumerate(cars)
+        if routes.get((c.start_tile, c.goal_tile, c.lane_index)) is not c.route
+    )
+
+    # lane queues in FIFO order (head first)
+    queues = []
+    for head, _ in sim.lanes.queues.values():
+        order = []
+        car = head
+        while car is not None:
+            order.append(index[id(car)])
+            car = car.lane_behind
+        queues.append(tuple(order))
+    snap.queues = tuple(queues)
+
+    j = sim.junctions
+    if j is not None:
+        snap.bookings = tuple(
+            (index[id(c)], b.idx, tuple(b.keys), b.start, b.end, b.inside)
+            for c, b in j.bookings.items() if id(c) in index
+        )
+        snap.junction_stats = (j.granted, j.rebooked)
+    else:
+        snap.bookings = ()
+        snap.junction_stats = (0, 0)
+
+    snap.lights = tuple(tuple(getattr(tl, f, 0) for f in LIGHT_FIELDS) for tl in sim.traffic_lights)
+    snap.last_sa = tuple((light_index[id(tl)], sa) for tl, sa in sim.last_sa.items())
+
+    actions = sim.rl_agent.actions
+    snap.q_table = {s: tuple(q[a] for a in actions) for s, q in sim.rl_agent.Q.items()}
+
+    d = sim.demand
+    if d is not None:
+        snap.demand = (
+            d.rng.getstate(), list(d.heap), d.horizon, d._seq,
+            [(o, list(q)) for o, q in d.backlog.items()],
+            (d.sampled, d.spawned, d.dropped, d.unroutable),
+        )
+    else:
+        snap.demand = None
+    return snap
+
+
+# ============================================================
+# Restore
+# ============================================================
+def restore(sim, snap, agent=True):
+    """Replace the simulation's state with the snapshot; agent=False keeps the learned Q-table."""
+    # drop the current population and every derived index
+    sim.lanes.clear()
+    sim.occupancy.clear()
+    if sim.junctions is not None:
+        sim.junctions.clear()
+    sim.pool.release_all(sim.cars)
+    sim.cars.clear()
+
+    sim.tick = snap.tick
+    sim.sim_time = snap.sim_time
+    sim.next_car_id = snap.next_car_id
+    sim.last_spawn_time = snap.last_spawn_time
+    sim.episode_crashes = snap.episode_crashes
+    sim.rng.setstate(snap.rng)
+    sim.car_rng.setstate(snap.car_rng)
+
+    lights = sim.traffic_lights
+    for tl, values in zip(lights, snap.lights):
+        for f, v in zip(LIGHT_FIELDS, values):
+            setattr(tl, f, v)
+    sim.last_sa = {lights[i]: sa for i, sa in snap.last_sa}
+
+    if agent:
+        actions = sim.rl_agent.actions
+        sim.rl_agent.Q = {s: dict(zip(actions, q)) for s, q in snap.q_table.items()}
+        sim.rl_agent.rng.setstate(snap.agent_rng)
+
+    # cars
+    n = len(snap)
+    table = sim.route_table
+    columns = snap.cars
+    paths = dict(snap.paths)
+    cars = []
+    for i in range(n):
+        car = sim.pool.take()
+        for f, col in zip(CAR_FIELDS, columns):
+            setattr(car, f, col[i])
+        car.traffic_lights = lights
+        path = paths.get(i)
+        if path is not None:
+            route = table.adopt(car.start_tile, car.goal_tile, car.lane_index, list(path))
+        else:
+            route = table.get(car.start_tile, car.goal_tile, car.lane_index)
+        car.route = route
+        car.tile_path = route.tile_path
+        car.path = route.points
+        c = snap.control[i]
+        car.control_light = lights[c] if c >= 0 else None
+        car.ray_tests = 0
+        car.lane_key = car.lane_ahead = car.lane_behind = None
+        car.occ_slot = None
+        car.occ_state = 0
+        cars.append(car)
+    sim.cars.extend(cars)
+
+    lanes = sim.lanes
+    for order in snap.queues:
+        for i in order:
+            car = cars[i]
+            lanes._link(car, car.route.lane_keys[car.tile_idx])
+    for car in cars:
+        sim.occupancy.add(car)
+
+    j = sim.junctions
+    if j is not None:
+        j.now = sim.sim_time
+        j.granted, j.rebooked = snap.junction_stats
+        for i, idx, keys, start, end, inside in snap.bookings:
+            car = cars[i]
+            b = _Booking()
+            b.idx, b.keys, b.start, b.end, b.inside = idx, list(keys), start, end, inside
+            j.bookings[car] = b
+            for key in keys:
+                j.table[key] = car
+            if inside:
+                for cell in j.crossings(car.route)[idx].cells:
+                    j.holders[cell] = car
+
+    d = sim.demand
+    if d is not None and snap.demand is not None:
+        rng_state, heap, horizon, seq, backlog, counters = snap.demand
+        d.rng.setstate(rng_state)
+        d.heap = list(heap)
+        d.horizon = horizon
+        d._seq = seq
+        d.backlog = {o: deque(q) for o, q in backlog}
+        d.sampled, d.spawned, d.dropped, d.unroutable = counters
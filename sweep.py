@@ -0,0 +1,281 @@
+"""
+Hyperparameter sweep for the RL light controller.
+
+    python sweep.py --grid alpha=0.05,0.1,0.2 epsilon=0.02,0.05 --seeds 0 1 2
+    python sweep.py --random 40 alpha=0.01:0.5 gamma=0.8:0.99 min_hold=4:16 crash=50:400
+    python sweep.py --map grid-medium --duration 600 --budget 30 --out sweep.jsonl --table sweep.csv
+
+Parameters are the agent's alpha/gamma/epsilon, the lights' min_hold and the
+reward weights in config.REWARD_WEIGHTS (clear, queue, opp, switch, block,
+crash). Every (params, seed) run is a headless, seeded simulation executed in
+a process pool (one worker per core by default). A run ends after `duration`
+simulated seconds, after `budget` wall seconds, or early once it has crashed
+`max_crashes` times. Finished runs are appended to the --out JSONL file as
+they complete; re-running the same command skips them, so an interrupted
+sweep resumes where it stopped. Each result records its run settings (map,
+duration, dt, cars, max_crashes); a results file written with other settings
+is refused instead of being mixed in.
+"""
+import argparse
+import csv
+import inspect
+import itertools
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+from config import ROAD_MAP, LIGHTS, REWARD_WEIGHTS, MIN_HOLD
+from map_loader import MapSpec, compile_map, load_compiled
+from mapgen import GENERATORS, generate
+from metrics import TripMetrics
+from simulation import Simulation
+
+AGENT_PARAMS = ("alpha", "gamma", "epsilon")
+PARAMS = AGENT_PARAMS + ("min_hold",) + tuple(REWARD_WEIGHTS)
+# run_one arguments that change what a run simulates (budget only caps wall time)
+RUN_SETTINGS = ("map_name", "duration", "dt", "max_active_cars", "max_crashes")
+
+TABLE_COLUMNS = ["crash_rate", "throughput", "mean_delay", "mean_travel_time", "trips", "crashes",
+                 "sim_time", "wall_s", "stopped"]
+
+
+# ============================================================
+# Parameter spaces
+# ============================================================
+def _value(tok):
+    try:
+        return int(tok)
+    except ValueError:
+        return float(tok)
+
+
+def parse_spec(tokens):
+    """['alpha=0.1,0.2', 'gamma=0.8:0.99'] -> {'alpha': [0.1, 0.2], 'gamma': (0.8, 0.99)}"""
+    space = {}
+    for tok in tokens:
+        name, sep, values = tok.partition("=")
+        if not sep or name not in PARAMS:
+            raise ValueError(f"bad parameter {tok!r}; expected NAME=V1,V2 or NAME=LO:HI with NAME in {', '.join(PARAMS)}")
+        if ":" in values:
+            lo, hi = values.split(":")
+            space[name] = (_value(lo), _value(hi))
+        else:
+            space[name] = [_value(v) for v in values.split(",")]
+    return space
+
+
+def grid_configs(space):
+    """Cartesian product of every listed value (ranges contribute their two ends)."""
+    names = sorted(space)
+    values = [list(space[n]) for n in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def random_configs(space, n, seed=0):
+    """n draws: lists are sampled uniformly, LO:HI ranges uniformly (integers if both ends are)."""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        cfg = {}
+        for name in sorted(space):
+            v = space[name]
+            if isinstance(v, list):
+                cfg[name] = rng.choice(v)
+            elif isinstance(v[0], int) and isinstance(v[1], int):
+                cfg[name] = rng.randint(*v)
+            else:
+                cfg[name] = rng.uniform(*v)
+        configs.append(cfg)
+    return configs
+
+
+def run_key(params, seed):
+    return json.dumps({"params": params, "seed": seed}, sort_keys=True)
+
+
+# ============================================================
+# Single run (worker process)
+# ============================================================
+_MAPS = {}  # per-worker compiled map cache
+
+
+def load_map(name, seed=0):
+    key = (name, seed)
+    compiled = _MAPS.get(key)
+    if compiled is None:
+        if name is None:
+            compiled = compile_map(MapSpec(ROAD_MAP, LIGHTS))
+        elif name in GENERATORS:
+            compiled = compile_map(MapSpec(*generate(name, seed=seed)))
+        else:
+            compiled = load_compiled(name)
+        _MAPS[key] = compiled
+    return compiled
+
+
+def run_one(params, seed, map_name=None, duration=300.0, dt=1 / 60, budget=60.0, max_crashes=None,
+            max_active_cars=None):
+    compiled = load_map(map_name)
+    rewards = {k: params[k] for k in REWARD_WEIGHTS if k in params}
+    metrics = TripMetrics(window=float("inf"))
+    kw = {"max_active_cars": max_active_cars} if max_active_cars else {}
+    sim = Simulation(compiled.make_lights(), compiled.portals, metrics=metrics, grid=compiled.grid,
+                     routes=compiled, seed=seed, rewards=rewards,
+                     min_hold=params.get("min_hold", MIN_HOLD), **kw)
+    for name in AGENT_PARAMS:
+        if name in params:
+            setattr(sim.rl_agent, name, params[name])
+
+    ticks = int(round(duration / dt))
+    stopped = "done"
+    t0 = perf_counter()
+    for _ in range(ticks):
+        sim.update(dt)
+        if max_crashes is not None and sim.episode_crashes >= max_crashes:
+            stopped = "crashes"
+            break
+        if perf_counter() - t0 > budget:
+            stopped = "budget"
+            break
+    wall = perf_counter() - t0
+
+    s = metrics.summary()
+    minutes = sim.sim_time / 60.0
+    return {
+        "params": params,
+        "seed": seed,
+        "crash_rate": sim.episode_crashes / minutes if minutes else 0.0,  # per simulated minute
+        "throughput": s["total_trips"] / minutes if minutes else 0.0,     # trips per simulated minute
+        "mean_delay": s["mean_stop_time"],
+        "mean_travel_time": s["mean_travel_time"],
+        "trips": s["total_trips"],
+        "crashes": sim.episode_crashes,
+        "sim_time": sim.sim_time,
+        "wall_s": wall,
+        "stopped": stopped,
+    }
+
+
+# ============================================================
+# Results
+# ============================================================
+def load_results(path):
+    """Finished runs from a (possibly truncated) results file."""
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # partial last line of an interrupted sweep
+    return results
+
+
+def write_table(path, results, names):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(names + ["seed"] + TABLE_COLUMNS)
+        for r in results:
+            w.writerow([r["params"].get(n, "") for n in names] + [r["seed"]] + [r[c] for c in TABLE_COLUMNS])
+
+
+def format_row(r, names):
+    params = " ".join(f"{n}={r['params'][n]:.4g}" for n in names if n in r["params"])
+    return (
+        f"{params:<48} seed={r['seed']:<3} crashes/min={r['crash_rate']:6.2f} "
+        f"trips/min={r['throughput']:6.1f} delay={r['mean_delay']:6.2f}s [{r['stopped']}]"
+    )
+
+
+def run_settings(run_kw):
+    """RUN_SETTINGS of a sweep, run_one's defaults filled in."""
+    defaults = inspect.signature(run_one).parameters
+    return {k: run_kw.get(k, defaults[k].default) for k in RUN_SETTINGS}
+
+
+def sweep(configs, seeds, out, workers=None, **run_kw):
+    """
+    Run every (config, seed) not already in `out`; returns all results (old
+    and new). Raises ValueError if `out` holds runs made with other settings.
+    """
+    settings = run_settings(run_kw)
+    results = load_results(out)
+    stale = [r for r in results if r.get("run") != settings]
+    if stale:
+        raise ValueError(
+            f"{out}: {len(stale)} of {len(results)} runs were made with other settings "
+            f"({stale[0].get('run')} != {settings}); use another --out or the same run options"
+        )
+    done = {run_key(r["params"], r["seed"]) for r in results}
+    todo = [(p, s) for p in configs for s in seeds if run_key(p, s) not in done]
+    if results:
+        print(f"resuming: {len(done)} runs done, {len(todo)} to go", flush=True)
+
+    # rewrite the file so a truncated last line does not corrupt later appends
+    with open(out, "w") as f:
+        for r in results:
+            f.write(json.dumps(r) + "\n")
+        if not todo:
+            return results
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(run_one, p, s, **run_kw) for p, s in todo]
+            for fut in as_completed(futures):
+                r = fut.result()
+                r["run"] = settings
+                results.append(r)
+                f.write(json.dumps(r) + "\n")
+                f.flush()
+                print(format_row(r, sorted(r["params"])), flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep for the light controller")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--grid", nargs="+", metavar="NAME=V1,V2", help="cartesian product of the listed values")
+    mode.add_argument("--random", nargs="+", metavar="N NAME=LO:HI",
+                      help="N random draws from value lists or LO:HI ranges")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0], help="simulation seeds run per config")
+    parser.add_argument("--search-seed", type=int, default=0, help="seed of the random search itself")
+    parser.add_argument("--map", help="map file or synthetic map name; defaults to ROAD_MAP in config.py")
+    parser.add_argument("--cars", type=int, help="max active cars (default: config.MAX_ACTIVE_CARS)")
+    parser.add_argument("--duration", type=float, default=300.0, help="simulated seconds per run")
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument("--budget", type=float, default=60.0, help="max wall seconds per run")
+    parser.add_argument("--max-crashes", type=int, help="stop a run early after this many crashes")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="sweep.jsonl",
+                        help="results file; existing runs are skipped (same run options required)")
+    parser.add_argument("--table", metavar="PATH", help="also write the results table as CSV")
+    args = parser.parse_args(argv)
+
+    if args.grid:
+        space = parse_spec(args.grid)
+        configs = grid_configs(space)
+    else:
+        n, *spec = args.random
+        space = parse_spec(spec)
+        configs = random_configs(space, int(n), args.search_seed)
+
+    results = sweep(configs, args.seeds, args.out, workers=args.workers, map_name=args.map,
+                    duration=args.duration, dt=args.dt, budget=args.budget, max_crashes=args.max_crashes,
+                    max_active_cars=args.cars)
+
+    names = sorted(space)
+    results.sort(key=lambda r: (r["crash_rate"], -r["throughput"], r["mean_delay"]))
+    print("\nbest first:")
+    for r in results:
+        print(format_row(r, names))
+    if args.table:
+        write_table(args.table, results, names)
+        print(f"table written to {args.table}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
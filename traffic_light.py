@@ -1,6 +1,4 @@
-import pygame
 from utils import world_center
-from config import WHITE
 
 class TrafficLight:
     def __init__(self, tile_pos, light_id, green_duration=4000, red_duration=4000, start_green=True):
@@ -63,9 +61,6 @@ class TrafficLight:
         return not approaching
 
     def draw(self, surf):
-        cx, cy = self.stop_point
-        color = (0,200,0) if self.green else (200,0,0)
-        pygame.draw.circle(surf, color, (cx, cy), 10)
-        font = pygame.font.SysFont(None, 20)
-        txt = font.render(str(self.light_id), True, WHITE)
-        surf.blit(txt, (cx-6, cy-6))
+        from render import draw_light
+
+        draw_light(surf, self)
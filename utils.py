@@ -1,9 +1,5 @@
-import pygame
 from config import TILE, LANE_OFFSET
 
-def tile_rect(tx, ty):
-    return pygame.Rect(tx * TILE, ty * TILE, TILE, TILE)
-
 def world_center(tx, ty):
     return (tx * TILE + TILE // 2, ty * TILE + TILE // 2)
 
@@ -22,3 +18,28 @@ def lane_center_from_dir(cx, cy, dx, dy):
 def rects_overlap(ax, ay, aw, ah, bx, by, bw, bh):
     return (ax < bx + bw and ax + aw > bx and
             ay < by + bh and ay + ah > by)
+
+def swept_rects_overlap(ax, ay, aw, ah, bx, by, bw, bh, dx, dy):
+    """
+    True if rect A, which ended at (ax, ay) after moving by (dx, dy) relative
+    to rect B during the step, overlapped B at any time in the step.
+    """
+    t0, t1 = 0.0, 1.0
+    for p, size_a, q, size_b, d in ((ax - dx, aw, bx, bw, dx), (ay - dy, ah, by, bh, dy)):
+        # overlap on this axis while q - size_a < p + d*t < q + size_b
+        lo = q - size_a - p
+        hi = q + size_b - p
+        if d == 0:
+            if not lo < 0 < hi:
+                return False
+            continue
+        s0, s1 = lo / d, hi / d
+        if s0 > s1:
+            s0, s1 = s1, s0
+        if s0 > t0:
+            t0 = s0
+        if s1 < t1:
+            t1 = s1
+        if t0 >= t1:
+            return False
+    return True
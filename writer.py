@@ -0,0 +1,67 @@
+import queue
+import threading
+
+
+# ============================================================
+# Background writer: moves file I/O off the simulation thread
+# ============================================================
+class BackgroundWriter:
+    """
+    Owns a file and a daemon thread that drains a queue of work items.
+    `encode(item)` runs on the writer thread and must return bytes.
+    The simulation thread only ever calls `submit`, which never blocks.
+    """
+
+    def __init__(self, path, encode, mode="ab", name="bg-writer"):
+        self.path = path
+        self.encode = encode
+        self.file = open(path, mode)
+        self.queue = queue.SimpleQueue()
+        self.error = None
+        self._closed = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        if self._closed:
+            raise ValueError("writer is closed")
+        self.queue.put(item)
+
+    def write_now(self, data):
+        # only safe before the first submit (headers etc.)
+        self.file.write(data)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                try:
+                    self.file.flush()
+                finally:
+                    item.set()
+                continue
+            try:
+                self.file.write(self.encode(item))
+            except Exception as exc:  # keep draining so close() never hangs
+                self.error = exc
+        self.file.flush()
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far is on disk (not on the hot path)."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error